@@ -0,0 +1,201 @@
+#!/usr/bin/env python3.6
+# -*- coding: utf-8 -*-
+#
+# This file is part of wormhole-tracker package released under
+# the GNU GPLv3 license. See the LICENSE file for more information.
+
+"""
+Local stand-in for the EVE SSO and character location API.
+
+Every character flies a scripted route, jumping to the next system every
+`jump_interval` seconds, with a per-character offset so jumps do not
+happen all at once. Responses are delayed by `latency` +- `jitter`
+seconds, `error_rate` and `unauthorized_rate` of location requests fail
+with 503 and 401, and access tokens expire after `token_ttl` seconds.
+
+Start it and point the tracker to it:
+
+    python benchmarks/fake_eve.py --port=8888
+    wormhole-tracker --sso_url=http://127.0.0.1:8888 \\
+                     --api_url=http://127.0.0.1:8888 ...
+"""
+
+import logging
+from random import random, uniform
+from time import time
+from urllib.parse import urlencode
+from uuid import uuid4
+
+from tornado import gen
+from tornado.escape import json_decode
+from tornado.ioloop import IOLoop
+from tornado.options import define, options, parse_command_line
+from tornado.web import Application, HTTPError, RequestHandler
+
+define('port', 8888, int)
+define('jump_interval', 30.0, float)
+define('route_length', 1000, int)
+define('latency', 0.05, float)
+define('jitter', 0.02, float)
+define('error_rate', 0.0, float)
+define('unauthorized_rate', 0.0, float)
+define('token_ttl', 1200, int)
+define('max_age', 0, int)
+
+
+def offset(character_id, jump_interval):
+    """
+    :return: deterministic per-character shift of the jump schedule
+    """
+    return (character_id * 7919) % 1000 / 1000 * jump_interval
+
+
+def jump_index(character_id, now, epoch, jump_interval):
+    """
+    :return: how many jumps character has done by the `now`
+    """
+    return int((now - epoch - offset(character_id, jump_interval))
+               // jump_interval)
+
+
+def jump_time(character_id, index, epoch, jump_interval):
+    """
+    :return: time when character has done the `index`th jump
+    """
+    return epoch + offset(character_id, jump_interval) + index * jump_interval
+
+
+def system_name(index, route_length):
+    return f"J{index % route_length:06d}"
+
+
+class FakeEve(Application):
+    def __init__(self):
+        super(FakeEve, self).__init__([
+            (r"/oauth/authorize/?", AuthorizeHandler),
+            (r"/oauth/token",       TokenHandler),
+            (r"/oauth/verify",      VerifyHandler),
+            (r"/characters/(\d+)/location/", LocationHandler),
+            (r"/fake/clock",        ClockHandler),
+        ])
+        self.epoch = time()
+        self.access_tokens = {}   # Access token to (character id, expiry)
+        self.refresh_tokens = {}  # Refresh token to character id
+
+    def issue(self, character_id):
+        access_token, refresh_token = uuid4().hex, uuid4().hex
+        expires = time() + options.token_ttl
+        self.access_tokens[access_token] = (character_id, expires)
+        self.refresh_tokens[refresh_token] = character_id
+        return {
+            'access_token': access_token,
+            'refresh_token': refresh_token,
+            'token_type': 'Bearer',
+            'expires_in': options.token_ttl,
+        }
+
+
+class FakeHandler(RequestHandler):
+    async def delay(self):
+        await gen.sleep(max(0, uniform(
+            options.latency - options.jitter,
+            options.latency + options.jitter
+        )))
+
+    def bearer(self):
+        """
+        :return: id of the character the access token was issued to
+        """
+        header = self.request.headers.get('Authorization', '')
+        token = header.partition('Bearer ')[2]
+        character_id, expires = self.application.access_tokens.get(
+            token, (None, 0)
+        )
+        if character_id is None or expires < time():
+            raise HTTPError(401)
+        return character_id
+
+
+class AuthorizeHandler(FakeHandler):
+    def get(self):
+        # Log in as the given or as a random character
+        character_id = self.get_argument('character', None)
+        if character_id is None:
+            character_id = str(int(random() * 10 ** 8))
+        query = urlencode({
+            'code': character_id,
+            'state': self.get_argument('state'),
+        })
+        self.redirect(self.get_argument('redirect_uri') + '?' + query)
+
+
+class TokenHandler(FakeHandler):
+    async def post(self):
+        await self.delay()
+        body = json_decode(self.request.body)
+        if body['grant_type'] == 'authorization_code':
+            character_id = int(body['code'])
+        else:
+            character_id = self.application.refresh_tokens.get(
+                body['refresh_token']
+            )
+            if character_id is None:
+                raise HTTPError(400)
+        self.write(self.application.issue(character_id))
+
+
+class VerifyHandler(FakeHandler):
+    async def get(self):
+        await self.delay()
+        character_id = self.bearer()
+        self.write({
+            'CharacterID': character_id,
+            'CharacterName': f"Pilot {character_id}",
+            'Scopes': 'characterBookmarksRead characterLocationRead',
+            'TokenType': 'Character',
+            'CharacterOwnerHash': str(character_id),
+        })
+
+
+class LocationHandler(FakeHandler):
+    async def get(self, character_id):
+        await self.delay()
+        if random() < options.error_rate:
+            raise HTTPError(503)
+        if random() < options.unauthorized_rate:
+            raise HTTPError(401)
+        if self.bearer() != int(character_id):
+            raise HTTPError(403)
+
+        index = jump_index(
+            int(character_id), time(),
+            self.application.epoch, options.jump_interval
+        )
+        name = system_name(index, options.route_length)
+        if options.max_age:
+            self.set_header('Cache-Control', f"max-age={options.max_age}")
+        self.set_header('ETag', f'"{name}"')
+        if self.request.headers.get('If-None-Match') == f'"{name}"':
+            self.set_status(304)
+            return
+        self.write({'solarSystem': {'name': name}})
+
+
+class ClockHandler(FakeHandler):
+    def get(self):
+        self.write({
+            'epoch': self.application.epoch,
+            'jump_interval': options.jump_interval,
+            'route_length': options.route_length,
+        })
+
+
+def main():
+    parse_command_line()
+    FakeEve().listen(options.port)
+    logging.info(f"Fake EVE API is listening on {options.port}")
+    IOLoop.current().start()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,201 @@
+#!/usr/bin/env python3.6
+# -*- coding: utf-8 -*-
+#
+# This file is part of wormhole-tracker package released under
+# the GNU GPLv3 license. See the LICENSE file for more information.
+
+"""
+Load generator for the tracker running against benchmarks/fake_eve.py.
+
+Signs `characters` characters in, opens `connections` /poll websockets
+spread evenly between them, sends "track" on each one and listens for
+`duration` seconds. Reports:
+
+  - update latency: time from the scripted jump on the fake API to the
+    `update` message on the websocket, p50 and p99;
+  - event loop lag: response time of the tiny /sign page, probed
+    every `probe_interval` seconds, p50 and p99;
+  - memory per connection: tracker's RSS growth divided by the amount
+    of connections, if `server_pid` is given.
+
+    python benchmarks/fake_eve.py --jump_interval=10 &
+    wormhole-tracker --sso_url=http://127.0.0.1:8888 \\
+                     --api_url=http://127.0.0.1:8888 ... &
+    python benchmarks/load.py --connections=5000 --characters=500 \\
+                              --server_pid=$!
+"""
+
+from time import time
+from urllib.parse import parse_qs, urlencode, urlsplit
+
+from tornado import gen
+from tornado.escape import json_decode, json_encode
+from tornado.httpclient import AsyncHTTPClient, HTTPRequest
+from tornado.ioloop import IOLoop
+from tornado.options import define, options, parse_command_line
+from tornado.websocket import websocket_connect
+
+from fake_eve import jump_time, system_name
+
+define('url', 'http://127.0.0.1:13131')
+define('fake_url', 'http://127.0.0.1:8888')
+define('connections', 1000, int)
+define('characters', 100, int)
+define('duration', 120, int)
+define('ramp', 200, int)
+define('probe_interval', 0.5, float)
+define('server_pid', 0, int)
+
+
+def percentile(values, share):
+    if not values:
+        return float('nan')
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * share))]
+
+
+def rss(pid):
+    """
+    :return: resident memory of the process, in kilobytes
+    """
+    with open(f"/proc/{pid}/status") as status:
+        for line in status:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1])
+
+
+class Load(object):
+    def __init__(self):
+        self.http_client = AsyncHTTPClient(max_clients=100)
+        self.clock = None
+        self.latencies = []
+        self.lags = []
+        self.updates = 0
+        self.warnings = 0
+        self.opened = 0
+        self.failed = 0
+        self.closed = 0
+        self.done = False
+
+    async def sign_in(self, character_id):
+        """
+        Go through /signin and /auth/ like a browser coming back
+        from the SSO would do.
+
+        :return: auth cookie of the character
+        """
+        response = await self.http_client.fetch(
+            options.url + '/signin', follow_redirects=False, raise_error=False
+        )
+        query = parse_qs(urlsplit(response.headers['Location']).query)
+        query = urlencode({'code': character_id, 'state': query['state'][0]})
+        response = await self.http_client.fetch(
+            options.url + '/auth/?' + query,
+            follow_redirects=False, raise_error=False
+        )
+        for cookie in response.headers.get_list('Set-Cookie'):
+            if cookie.startswith('auth_cookie='):
+                return cookie.split(';')[0]
+
+    def latency(self, character_id, name):
+        """
+        :return: seconds passed since character has jumped to the `name`
+        """
+        epoch = self.clock['epoch']
+        interval = self.clock['jump_interval']
+        length = self.clock['route_length']
+        now = time()
+        index = int((now - jump_time(character_id, 0, epoch, interval))
+                    // interval)
+        # Find the latest jump which has led to the system
+        while index >= 0 and system_name(index, length) != name:
+            index -= 1
+        return now - jump_time(character_id, index, epoch, interval)
+
+    async def connect(self, character_id, cookie):
+        url = options.url.replace('http', 'ws', 1) + '/poll'
+        try:
+            connection = await websocket_connect(
+                HTTPRequest(url, headers={'Cookie': cookie})
+            )
+        except Exception:
+            self.failed += 1
+            return
+        self.opened += 1
+        connection.write_message(json_encode('track'))
+        first = True
+        while not self.done:
+            message = await connection.read_message()
+            if message is None:
+                self.closed += 1
+                return
+            kind, data = json_decode(message)
+            if kind == 'update':
+                self.updates += 1
+                # The first update is the location character had before
+                if data.get('current') and not first:
+                    self.latencies.append(
+                        self.latency(character_id, data['current'])
+                    )
+                first = False
+            elif kind == 'warning':
+                self.warnings += 1
+        connection.close()
+
+    async def probe(self):
+        while not self.done:
+            start = time()
+            await self.http_client.fetch(options.url + '/sign')
+            self.lags.append(time() - start)
+            await gen.sleep(options.probe_interval)
+
+    async def run(self):
+        response = await self.http_client.fetch(options.fake_url + '/fake/clock')
+        self.clock = json_decode(response.body)
+
+        print(f"Signing in {options.characters} characters...")
+        character_ids = list(range(1, options.characters + 1))
+        cookies = await gen.multi([
+            self.sign_in(character_id) for character_id in character_ids
+        ])
+        before = rss(options.server_pid) if options.server_pid else None
+
+        print(f"Opening {options.connections} connections...")
+        IOLoop.current().spawn_callback(self.probe)
+        for i in range(options.connections):
+            character_id = character_ids[i % len(character_ids)]
+            IOLoop.current().spawn_callback(
+                self.connect, character_id, cookies[i % len(cookies)]
+            )
+            if i % options.ramp == options.ramp - 1:
+                await gen.sleep(1)
+
+        await gen.sleep(options.duration)
+        self.done = True
+        after = rss(options.server_pid) if options.server_pid else None
+        self.report(before, after)
+
+    def report(self, before, after):
+        print(f"connections opened:  {self.opened}")
+        print(f"connections failed:  {self.failed}")
+        print(f"connections closed:  {self.closed}")
+        print(f"updates received:    {self.updates}")
+        print(f"warnings received:   {self.warnings}")
+        print(f"update latency p50:  {percentile(self.latencies, .5):.3f} s")
+        print(f"update latency p99:  {percentile(self.latencies, .99):.3f} s")
+        print(f"loop lag p50:        {percentile(self.lags, .5) * 1000:.1f} ms")
+        print(f"loop lag p99:        {percentile(self.lags, .99) * 1000:.1f} ms")
+        if before is not None and self.opened:
+            per_connection = (after - before) / self.opened
+            print(f"memory before:       {before} kB")
+            print(f"memory after:        {after} kB")
+            print(f"memory / connection: {per_connection:.1f} kB")
+
+
+def main():
+    parse_command_line()
+    IOLoop.current().run_sync(Load().run)
+
+
+if __name__ == '__main__':
+    main()
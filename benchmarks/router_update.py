@@ -0,0 +1,68 @@
+#!/usr/bin/env python3.6
+# -*- coding: utf-8 -*-
+#
+# This file is part of wormhole-tracker package released under
+# the GNU GPLv3 license. See the LICENSE file for more information.
+
+"""
+Micro-benchmark for `Router.update`.
+
+Fills router with a chain of N systems, then measures the average cost
+of a jump to a new system and of a jump back to an already known one.
+Both should stay flat as N grows.
+
+    python benchmarks/router_update.py
+"""
+
+from time import perf_counter
+
+from tornado.ioloop import IOLoop
+
+from wormhole_tracker.auxiliaries import Router
+from wormhole_tracker.storage import Storage, Users
+
+
+SIZES = [10, 100, 1000, 10000, 100000]
+JUMPS = 10000
+
+
+class App(object):
+    link_lifetime = 0
+
+    def __init__(self):
+        self.users = Users(self, Storage())
+
+
+async def fill(router, size):
+    for i in range(size):
+        await router.update(f"J{i:06d}")
+
+
+async def measure(size):
+    router = Router('0', App())
+    await fill(router, size)
+
+    # Jumps into unknown systems, every one adds a node and a link
+    start = perf_counter()
+    for i in range(JUMPS):
+        await router.update(f"N{i:06d}")
+    new = (perf_counter() - start) / JUMPS
+
+    # Jumps between already known systems, nothing is added
+    start = perf_counter()
+    for i in range(JUMPS):
+        await router.update(f"N{i % 2:06d}")
+    known = (perf_counter() - start) / JUMPS
+
+    return new, known
+
+
+async def main():
+    print(f"{'systems':>10} {'new, us':>10} {'known, us':>10}")
+    for size in SIZES:
+        new, known = await measure(size)
+        print(f"{size:>10} {new * 1e6:>10.2f} {known * 1e6:>10.2f}")
+
+
+if __name__ == '__main__':
+    IOLoop.current().run_sync(main)
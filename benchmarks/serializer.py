@@ -0,0 +1,132 @@
+#!/usr/bin/env python3.6
+# -*- coding: utf-8 -*-
+#
+# This file is part of wormhole-tracker package released under
+# the GNU GPLv3 license. See the LICENSE file for more information.
+
+"""
+Micro-benchmark for `wormhole_tracker.serializer.Serializer` thresholds.
+
+Builds map messages of N nodes and as many links, and measures how long
+the IOLoop is busy with every one of them: encoding and decoding it right
+away with the standard library, with orjson if it is installed, and with
+the compact format, or handing it to the process pool, which costs the
+IOLoop pickling of the message and unpickling of the result. Pool only
+pays off past the size where it costs the IOLoop less than the encoding
+itself, the last column shows the whole round trip through the pool.
+
+    python benchmarks/serializer.py
+"""
+
+import json
+import pickle
+from concurrent.futures import ProcessPoolExecutor
+from time import perf_counter
+
+from wormhole_tracker.protocol import encode_compact
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+SIZES = [100, 500, 1000, 2000, 5000, 20000, 100000]
+REPEAT = 20
+
+
+def message(size):
+    nodes = [{'name': f"J{i:06d}"} for i in range(size)]
+    links = [
+        {'source': {'name': f"J{i:06d}"}, 'target': {'name': f"J{i + 1:06d}"}}
+        for i in range(size)
+    ]
+    return ['recover', {
+        'current': "J000000", 'nodes': nodes, 'links': links, 'version': 1
+    }]
+
+
+def measure(function, *args):
+    """
+    :return: average duration of the call, in milliseconds
+    """
+    start = perf_counter()
+    for _ in range(REPEAT):
+        function(*args)
+    return (perf_counter() - start) / REPEAT * 1000
+
+
+def offloaded(result, *args):
+    """
+    IOLoop's share of the pool: arguments are pickled on submit,
+    the result is unpickled when it comes back.
+    """
+    pickle.dumps(args)
+    pickle.loads(result)
+
+
+def encoding(pool, size):
+    value = message(size)
+    data = json.dumps(value).encode()
+    binary = encode_compact(*value)
+    row = [
+        measure(json.dumps, value),
+        measure(orjson.dumps, value) if orjson else None,
+        measure(encode_compact, *value),
+        measure(offloaded, pickle.dumps(data), value),
+        measure(offloaded, pickle.dumps(binary), value),
+        measure(lambda: pool.submit(encode_compact, *value).result()),
+    ]
+    return row, len(data)
+
+
+def decoding(pool, size):
+    data = json.dumps(message(size))
+    value = json.loads(data)
+    return [
+        measure(json.loads, data),
+        measure(orjson.loads, data) if orjson else None,
+        measure(offloaded, pickle.dumps(value), data),
+        measure(lambda: pool.submit(json.loads, data).result()),
+    ]
+
+
+def table(title, columns, rows):
+    print(title)
+    print(' '.join(f"{column:>10}" for column in columns))
+    for row in rows:
+        print(' '.join(
+            f"{'-':>10}" if value is None else
+            f"{value:>10}" if isinstance(value, int) else
+            f"{value:>10.3f}"
+            for value in row
+        ))
+    print()
+
+
+def main():
+    with ProcessPoolExecutor(1) as pool:
+        # Start the worker before measuring
+        pool.submit(len, '').result()
+        rows = []
+        for size in SIZES:
+            row, length = encoding(pool, size)
+            rows.append([2 * size, length] + row)
+        table(
+            "Encoding, ms of the IOLoop time per message",
+            ['items', 'bytes', 'json', 'orjson', 'compact',
+             'pool json', 'pool bin', 'round trip'],
+            rows
+        )
+        rows = []
+        for size in SIZES:
+            length = len(json.dumps(message(size)))
+            rows.append([length] + decoding(pool, size))
+        table(
+            "Decoding, ms of the IOLoop time per message",
+            ['bytes', 'json', 'orjson', 'pool', 'round trip'],
+            rows
+        )
+
+
+if __name__ == '__main__':
+    main()
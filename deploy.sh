@@ -10,6 +10,7 @@
 # - Adds user which will run the daemon
 # - Installs virtualenv python package
 # - Sets up the venv for the application
+# - Builds static assets
 # - Installs application itself
 # - Copies configuration template
 # - Installs application daemon
@@ -70,6 +71,14 @@ else
     fi
 fi
 
+print "Building static assets..."
+if python${py_version} -m ${package_dir}.assets; then
+    print "Static assets built."
+else
+    print "Failed to build static assets, aborting."
+    exit 1
+fi
+
 print "Installing virtualenv..."
 if pip install virtualenv; then
     # Create vitrualenv for the app
@@ -120,6 +129,15 @@ else
     exit 1
 fi
 
+print "Copying static files..."
+rm -rf /home/${app_name}/static
+if cp -r ${package_dir}/static /home/${app_name}/static; then
+    print "Static files copied."
+else
+    print "Failed to copy static files, aborting."
+    exit 1
+fi
+
 print "Setting up access rights..."
 if chown -R ${app_name}:${app_name} /home/${app_name}; then
     print "Rights given."
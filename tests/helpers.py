@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of wormhole-tracker package released under
+# the GNU GPLv3 license. See the LICENSE file for more information.
+
+"""
+Stand-ins and helpers shared by the tests.
+"""
+
+import random
+import unittest
+from functools import partial, wraps
+from unittest import mock
+
+from tornado.ioloop import IOLoop
+
+from wormhole_tracker import auxiliaries
+from wormhole_tracker.storage import Storage, Users
+from wormhole_tracker.sweeper import Sweeper
+
+
+class App(object):
+    """
+    Just enough of the application for routers and users.
+    """
+    link_lifetime = 100
+    channel = None
+
+    def __init__(self, storage=None):
+        self.users = Users(self, storage or Storage())
+        self.sweeper = Sweeper(self)
+
+
+def sync(test):
+    """
+    Run the coroutine test on the IOLoop.
+    """
+    @wraps(test)
+    def wrapper(self):
+        IOLoop.current().run_sync(partial(test, self))
+    return wrapper
+
+
+def state(snapshot):
+    """
+    :return: comparable map state of the snapshot, or of the snapshot
+    patched by `patch`
+    """
+    return (
+        snapshot['current'],
+        {
+            node['name']: (node.get('x'), node.get('y'))
+            for node in snapshot['nodes']
+        },
+        {
+            frozenset((link['source']['name'], link['target']['name']))
+            for link in snapshot['links']
+        },
+        snapshot['version'],
+    )
+
+
+def patch(snapshot, changes):
+    """
+    Apply merged changes to the snapshot the way front-end does.
+    """
+    current, nodes, links, _ = state(snapshot)
+    for node in changes['nodes']:
+        nodes.setdefault(node['name'], (None, None))
+    for position in changes['positions']:
+        nodes[position['name']] = (position['x'], position['y'])
+    for link in changes['links']:
+        links.add(frozenset((link['source']['name'],
+                             link['target']['name'])))
+    for link in changes['removed']:
+        links.discard(frozenset((link['source']['name'],
+                                 link['target']['name'])))
+    return changes['current'], nodes, links, changes['version']
+
+
+class MapTest(unittest.TestCase):
+    """
+    Routers are changed on the mocked clock, see `change`.
+    """
+    def setUp(self):
+        self.now = 1000
+        clock = mock.patch.object(auxiliaries, 'time', lambda: self.now)
+        clock.start()
+        self.addCleanup(clock.stop)
+        self.rng = random.Random(2)
+        self.names = [f"J{i:03d}" for i in range(30)]
+
+    async def change(self, router):
+        """
+        Make a random change of the map.
+
+        :return: the change, None if nothing has changed
+        """
+        self.now += self.rng.randint(1, 40)
+        roll = self.rng.random()
+        if roll < 0.6:
+            pilot = self.rng.choice(['1', '2'])
+            return await router.update(self.rng.choice(self.names), pilot)
+        if roll < 0.8:
+            nodes = [
+                {'name': name, 'x': self.rng.random(), 'y': self.rng.random()}
+                for name in self.rng.sample(router.graph.names,
+                                            min(3, len(router.graph)))
+            ]
+            return await router.move(nodes)
+        return await router.expire(list(router.lifetimes), self.now)
@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of wormhole-tracker package released under
+# the GNU GPLv3 license. See the LICENSE file for more information.
+
+import gzip
+import json
+import re
+import shutil
+import tempfile
+import unittest
+from os import makedirs
+from os.path import exists, join
+from unittest import mock
+
+from wormhole_tracker import assets
+from wormhole_tracker.assets import (
+    BUNDLES, FILES, STATIC_PATH, Build, fingerprint, minify_css, minify_js
+)
+
+SCRIPT = """// This file is part of wormhole-tracker package released under
+// the GNU GPLv3 license.
+
+var url = "http://example.com/*";  // Not a comment
+/* Block comment */
+var pattern = /\\/\\/[a-z]+/g;
+function f(a) {
+    return a + 1;
+}
+"""
+
+STYLESHEET = """/* Copyright, keep me */
+
+/* Drop me */
+a  >  b {
+    content: "/* kept */";
+    color : red;
+}
+"""
+
+
+class MinifyTest(unittest.TestCase):
+    def check_js(self):
+        code = minify_js(SCRIPT)
+        self.assertTrue(code.startswith("// This file is part of"))
+        self.assertIn('"http://example.com/*"', code)
+        self.assertIn('/\\/\\/[a-z]+/g', code)
+        self.assertNotIn('Block comment', code)
+        self.assertNotIn('Not a comment', code)
+        self.assertLess(len(code), len(SCRIPT))
+
+    def check_css(self):
+        code = minify_css(STYLESHEET)
+        self.assertTrue(code.startswith("/* Copyright, keep me */\n"))
+        self.assertIn('"/* kept */"', code)
+        self.assertNotIn('Drop me', code)
+        self.assertIn('a>b{', code)
+
+    def test_fallback_minifiers(self):
+        with mock.patch.object(assets, 'rjsmin', None), \
+                mock.patch.object(assets, 'rcssmin', None):
+            self.check_js()
+            self.check_css()
+
+    @unittest.skipIf(assets.rjsmin is None or assets.rcssmin is None,
+                     "rjsmin and rcssmin are not installed")
+    def test_installed_minifiers(self):
+        self.check_js()
+        self.check_css()
+
+    def test_fingerprint(self):
+        self.assertRegex(fingerprint('js/app.js', b'a'),
+                         r'^js/app\.[0-9a-f]{12}\.js$')
+        self.assertNotEqual(fingerprint('app.js', b'a'),
+                            fingerprint('app.js', b'b'))
+
+
+class BuildTest(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.static_path = join(directory, 'static')
+        shutil.copytree(STATIC_PATH, self.static_path,
+                        ignore=shutil.ignore_patterns('dist'))
+        self.manifest = Build(self.static_path).run()
+
+    def read(self, name):
+        with open(join(self.static_path, self.manifest[name]), 'rb') as f:
+            return f.read()
+
+    def test_manifest(self):
+        for name in list(BUNDLES) + FILES:
+            built = self.manifest[name]
+            self.assertTrue(built.startswith('dist/'))
+            self.assertEqual(built,
+                             'dist/' + fingerprint(name, self.read(name)))
+        self.assertTrue(exists(join(self.static_path, 'dist/manifest.json')))
+
+    def test_compressed_copies(self):
+        content = self.read('app.js')
+        path = join(self.static_path, self.manifest['app.js'])
+        with open(path + '.gz', 'rb') as f:
+            self.assertEqual(gzip.decompress(f.read()), content)
+        self.assertFalse(exists(join(
+            self.static_path, self.manifest[FILES[0]] + '.gz'
+        )))
+
+    def test_bundle_content(self):
+        content = self.read('app.js').decode()
+        for name in ('ForceLayout', 'Protocol'):
+            self.assertIn(name, content)
+        self.assertIn('GNU GPLv3 license', content)
+        self.assertNotIn('sourceMappingURL', self.read('vendor.js').decode())
+
+    def test_stylesheet_urls(self):
+        urls = []
+        for name in ('vendor.css', 'main.css', 'sign.css'):
+            content = self.read(name).decode()
+            urls += re.findall(r'url\("/static/([^"?#]+)', content)
+        self.assertTrue(urls)
+        for url in urls:
+            self.assertTrue(url.startswith('dist/'))
+            self.assertTrue(exists(join(self.static_path, url)))
+
+
+class Handler(object):
+    def __init__(self, static_path):
+        self.settings = {'static_path': static_path}
+
+    def static_url(self, path):
+        return '/static/' + path + '?v=source'
+
+
+class UrlsTest(unittest.TestCase):
+    def setUp(self):
+        self.static_path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.static_path)
+        self.addCleanup(assets._manifest.pop, self.static_path, None)
+
+    def test_sources_until_built(self):
+        urls = assets.urls(Handler(self.static_path), 'app.js')
+        self.assertEqual(len(urls), len(BUNDLES['app.js']))
+        self.assertEqual(urls[0], '/static/js/auxiliaries.js?v=source')
+
+    def test_built(self):
+        makedirs(join(self.static_path, 'dist'))
+        with open(join(self.static_path, 'dist/manifest.json'), 'w') as f:
+            json.dump({'app.js': 'dist/app.0123456789ab.js'}, f)
+        handler = Handler(self.static_path)
+        self.assertEqual(assets.urls(handler, 'app.js'),
+                         ['/static/dist/app.0123456789ab.js'])
+        # Files which are not built are served as they are
+        self.assertEqual(assets.urls(handler, 'favicon.ico'),
+                         ['/static/favicon.ico?v=source'])
+
+
+if __name__ == '__main__':
+    unittest.main()
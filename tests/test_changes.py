@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of wormhole-tracker package released under
+# the GNU GPLv3 license. See the LICENSE file for more information.
+
+import unittest
+from unittest import mock
+
+from helpers import App, MapTest, patch, state, sync
+from wormhole_tracker.auxiliaries import Router
+
+
+class ChangesTest(MapTest):
+    @sync
+    async def test_changes_match_snapshot(self):
+        router = Router('1', App())
+        snapshots = [router.snapshot('1')]
+        for _ in range(300):
+            await self.change(router)
+            snapshots.append(router.snapshot('1'))
+        expected = state(router.snapshot('1'))
+        for snapshot in snapshots[-router.history_size:]:
+            changes = router.changes(snapshot['version'], '1')
+            if changes.get('nodes') is None:
+                # Up to date
+                self.assertEqual(snapshot['version'], router.version)
+                continue
+            self.assertEqual(patch(snapshot, changes), expected)
+
+    @sync
+    async def test_changes_too_old(self):
+        with mock.patch.object(Router, 'history_size', 5):
+            router = Router('1', App())
+        for name in self.names[:10]:
+            await router.update(name)
+        self.assertIsNone(router.changes(3, '1'))
+        self.assertEqual(router.changes(router.version)['version'], 10)
+        self.assertEqual(len(router.since(5)), 5)
+
+
+if __name__ == '__main__':
+    unittest.main()
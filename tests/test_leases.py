@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of wormhole-tracker package released under
+# the GNU GPLv3 license. See the LICENSE file for more information.
+
+import sqlite3
+import tempfile
+import unittest
+from os import getpid, path
+from unittest import mock
+
+import helpers
+from wormhole_tracker import leases
+from wormhole_tracker.leases import Leases
+from wormhole_tracker.storage import SQLiteStorage, Storage
+
+
+class LeaseStorage(Storage):
+    """
+    Storage which counts the leases taken from it.
+    """
+    def __init__(self):
+        super(LeaseStorage, self).__init__()
+        self.taken = []
+        self.released = []
+        self.busy = False
+
+    def lease(self, user_id, owner, ttl):
+        self.taken.append(user_id)
+        return not self.busy
+
+    def release(self, user_id, owner):
+        self.released.append(user_id)
+
+
+class LeasesTest(unittest.TestCase):
+    def setUp(self):
+        self.now = 1000
+        clock = mock.patch.object(leases, 'time', lambda: self.now)
+        clock.start()
+        self.addCleanup(clock.stop)
+        self.storage = LeaseStorage()
+        self.leases = Leases(helpers.App(self.storage))
+
+    def test_held_lease_stays_in_memory(self):
+        self.assertTrue(self.leases.hold('1', 30))
+        self.now += 15
+        self.assertTrue(self.leases.hold('1', 30))
+        self.assertEqual(self.storage.taken, ['1'])
+        self.assertIn('1', self.leases)
+        # Renewal is overdue, storage is asked again
+        self.now += 6
+        self.assertTrue(self.leases.hold('1', 30))
+        self.assertEqual(self.storage.taken, ['1', '1'])
+
+    def test_renewal(self):
+        self.leases.hold('used', 30)
+        self.leases.hold('unused', 30)
+        self.now += 5
+        self.leases.renew()
+        self.assertEqual(len(self.storage.taken), 2)
+        # Both have been used within the half of their lifetime
+        self.now += 6
+        self.leases.renew()
+        self.assertEqual(len(self.storage.taken), 4)
+        self.leases.hold('used', 30)
+        self.now += 11
+        self.leases.renew()
+        self.assertEqual(self.storage.taken[4:], ['used'])
+        self.assertNotIn('unused', self.leases)
+        self.assertIn('used', self.leases)
+
+    def test_busy_storage(self):
+        self.storage.busy = True
+        self.assertFalse(self.leases.hold('1', 30))
+        self.assertNotIn('1', self.leases)
+        self.storage.busy = False
+        self.leases.hold('1', 30)
+        # Lease which failed to renew is still held until it is due
+        self.storage.busy = True
+        self.now += 11
+        self.leases.hold('1', 30)
+        self.leases.renew()
+        self.assertIn('1', self.leases)
+        self.now += 10
+        self.assertFalse(self.leases.hold('1', 30))
+
+    def test_release(self):
+        self.leases.hold('1', 30)
+        self.leases.release('1')
+        self.assertNotIn('1', self.leases)
+        self.assertEqual(self.storage.released, ['1'])
+
+
+class SQLiteLeaseTest(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = path.join(directory.name, 'leases.db')
+        self.storage = SQLiteStorage(self.path)
+        self.addCleanup(self.storage.close)
+
+    def test_owner(self):
+        self.assertTrue(self.storage.lease('1', getpid(), 30))
+        self.assertTrue(self.storage.lease('1', getpid(), 30))
+        self.assertFalse(self.storage.lease('1', getpid() + 1, 30))
+        self.assertEqual(self.storage.holder('1'), getpid())
+        self.storage.release('1', getpid())
+        self.assertTrue(self.storage.lease('1', getpid() + 1, 30))
+
+    def test_busy_database_is_not_waited_for(self):
+        other = sqlite3.connect(self.path, isolation_level=None)
+        self.addCleanup(other.close)
+        other.execute("BEGIN IMMEDIATE")
+        try:
+            self.assertFalse(self.storage.lease('1', getpid(), 30))
+        finally:
+            other.execute("ROLLBACK")
+        self.assertTrue(self.storage.lease('1', getpid(), 30))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of wormhole-tracker package released under
+# the GNU GPLv3 license. See the LICENSE file for more information.
+
+import random
+import unittest
+from collections import deque
+
+from helpers import App, MapTest, sync
+from wormhole_tracker.auxiliaries import Graph, Router
+
+
+def distance(graph, source, target):
+    """
+    Plain breadth-first search over the adjacency sets.
+    """
+    a, b = graph.ids[source], graph.ids[target]
+    distances = {a: 0}
+    queue = deque([a])
+    while queue:
+        system_id = queue.popleft()
+        if system_id == b:
+            return distances[b]
+        for neighbour in graph.adjacency[system_id]:
+            if neighbour not in distances:
+                distances[neighbour] = distances[system_id] + 1
+                queue.append(neighbour)
+    return None
+
+
+class PathsTest(unittest.TestCase):
+    def check(self, graph, source, target):
+        path = graph.paths.path(source, target)
+        expected = distance(graph, source, target)
+        if expected is None:
+            self.assertIsNone(path)
+            return
+        self.assertEqual(len(path) - 1, expected)
+        self.assertEqual((path[0], path[-1]), (source, target))
+        for a, b in zip(path, path[1:]):
+            self.assertTrue(graph.has_link(a, b))
+
+    def test_matches_plain_search(self):
+        rng = random.Random(1)
+        graph = Graph()
+        names = [f"J{i:03d}" for i in range(60)]
+        for step in range(1500):
+            a, b = rng.sample(names, 2)
+            if rng.random() < 0.3 and graph.has_link(a, b):
+                graph.remove_link(graph.ids[a], graph.ids[b])
+            elif rng.random() < 0.05:
+                graph.add_system(a)
+            else:
+                graph.add_link(a, b)
+            # Trees built earlier are reused between the changes
+            for _ in range(3):
+                a, b = rng.sample(names, 2)
+                if a in graph and b in graph:
+                    self.check(graph, a, b)
+
+    def test_unknown_systems(self):
+        graph = Graph()
+        graph.add_link('A', 'B')
+        self.assertIsNone(graph.paths.path('A', 'C'))
+        self.assertEqual(graph.paths.path('A', 'A'), ['A'])
+
+    def test_removed_link_drops_tree(self):
+        graph = Graph()
+        for a, b in [('A', 'B'), ('B', 'C'), ('A', 'D'), ('D', 'E'),
+                     ('E', 'C')]:
+            graph.add_link(a, b)
+        self.assertEqual(graph.paths.path('A', 'C'), ['A', 'B', 'C'])
+        graph.remove_link(graph.ids['B'], graph.ids['C'])
+        self.assertEqual(graph.paths.path('A', 'C'), ['A', 'D', 'E', 'C'])
+        graph.remove_link(graph.ids['E'], graph.ids['C'])
+        self.assertIsNone(graph.paths.path('A', 'C'))
+
+
+class RouteTest(MapTest):
+    @sync
+    async def test_route_from_pilot(self):
+        router = Router('1', App())
+        for name in ('A', 'B', 'C'):
+            await router.update(name, '1')
+        for name in ('D', 'B'):
+            await router.update(name, '2')
+        self.assertEqual(router.route('A', pilot='1'), {
+            'from': 'C', 'to': 'A', 'jumps': 2, 'path': ['C', 'B', 'A']
+        })
+        self.assertEqual(router.route('D', pilot='2')['path'], ['B', 'D'])
+        self.assertEqual(router.route('D', 'A')['jumps'], 2)
+        self.assertIsNone(router.route('J123456', pilot='1'))
+        # Pilot who is not on the map has no route
+        self.assertIsNone(router.route('A', pilot='3'))
+
+    @sync
+    async def test_route_follows_map_changes(self):
+        router = Router('1', App())
+        for name in ('A', 'B', 'C', 'A'):
+            await router.update(name, '1')
+        self.assertEqual(router.route('C', pilot='1')['jumps'], 1)
+        edge = Graph.edge(router.graph.ids['A'], router.graph.ids['C'])
+        await router.expire([edge], self.now + App.link_lifetime)
+        self.assertEqual(router.route('C', pilot='1')['path'],
+                         ['A', 'B', 'C'])
+
+
+if __name__ == '__main__':
+    unittest.main()
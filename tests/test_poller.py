@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of wormhole-tracker package released under
+# the GNU GPLv3 license. See the LICENSE file for more information.
+
+import json
+import unittest
+from email.utils import formatdate
+from time import time
+
+from tornado.ioloop import IOLoop
+
+from helpers import sync
+from wormhole_tracker.poller import Poller, Schedule
+
+
+class Response(object):
+    def __init__(self, code, system=None, headers=None):
+        self.code = code
+        self.headers = headers or {}
+        self.body = json.dumps({'solarSystem': {'name': system}}).encode()
+
+
+class Histogram(object):
+    def observe(self, *args):
+        pass
+
+
+class Metrics(object):
+    router_update = Histogram()
+
+
+class Users(object):
+    def __init__(self):
+        self.jumps = []
+
+    def append_jump(self, user_id, timestamp, system):
+        self.jumps.append(system)
+
+
+class Maps(object):
+    def __init__(self):
+        self.changes = []
+
+    async def change(self, key, method, *args):
+        self.changes.append((key, method) + args)
+
+
+class App(object):
+    channel = None
+    metrics = Metrics()
+
+    def __init__(self):
+        self.users = Users()
+        self.maps = Maps()
+        self.responses = []
+        self.requests = []
+
+    def map_key(self, user_id):
+        return user_id
+
+    async def character_response(self, user_id, uri, method, headers=None):
+        self.requests.append(headers)
+        return self.responses.pop(0)
+
+
+class PollerTest(unittest.TestCase):
+    def setUp(self):
+        self.app = App()
+        self.poller = Poller(self.app, interval=5, min_interval=2,
+                             max_interval=60, backoff=2)
+        self.schedule = Schedule('1', 5, 0)
+        self.poller.schedules['1'] = self.schedule
+
+    async def poll(self, *responses):
+        """
+        :return: intervals of the character after every poll
+        """
+        self.app.responses.extend(responses)
+        intervals = []
+        for _ in responses:
+            await self.poller.poll(self.schedule)
+            intervals.append(self.schedule.interval)
+        return intervals
+
+    @sync
+    async def test_backoff(self):
+        intervals = await self.poll(
+            Response(200, 'A'), Response(200, 'A'), Response(200, 'A'),
+            Response(200, 'A'), Response(200, 'A'), Response(200, 'A'),
+            Response(200, 'B'), Response(200, 'B'),
+        )
+        self.assertEqual(intervals, [2, 4, 8, 16, 32, 60, 2, 4])
+        self.assertEqual(self.app.users.jumps, ['A', 'B'])
+        self.assertEqual(len(self.app.maps.changes), 8)
+        self.assertEqual(len(self.poller.queue), 8)
+
+    @sync
+    async def test_etag(self):
+        await self.poll(
+            Response(200, 'A', {'ETag': '"a"'}), Response(304)
+        )
+        self.assertEqual(self.app.requests, [{}, {'If-None-Match': '"a"'}])
+        # Not modified location is still the last one
+        self.assertEqual(self.schedule.location['solarSystem']['name'], 'A')
+        self.assertEqual(self.schedule.etag, '"a"')
+        self.assertEqual(self.app.maps.changes[-1], ('1', 'update', 'A', '1'))
+
+    @sync
+    async def test_upstream_cache(self):
+        for max_age, delay in [(30, 30), (300, 60), (1, 8)]:
+            start = IOLoop.current().time()
+            await self.poll(Response(200, 'A', {
+                'Cache-Control': f"max-age={max_age}"
+            }))
+            # Cache expiry is honoured up to the longest interval
+            self.assertAlmostEqual(self.schedule.due - start, delay, delta=1)
+
+    def test_expires(self):
+        self.assertEqual(Poller.expires(Response(
+            200, headers={'Cache-Control': 'public, max-age=15'}
+        )), 15)
+        expires = Poller.expires(Response(
+            200, headers={'Expires': formatdate(time() + 20, usegmt=True)}
+        ))
+        self.assertAlmostEqual(expires, 20, delta=2)
+        self.assertEqual(Poller.expires(Response(
+            200, headers={'Expires': 'never'}
+        )), 0)
+        self.assertEqual(Poller.expires(Response(200)), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
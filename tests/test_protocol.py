@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of wormhole-tracker package released under
+# the GNU GPLv3 license. See the LICENSE file for more information.
+
+import json
+import unittest
+from struct import unpack_from
+
+from helpers import App, sync
+from wormhole_tracker.auxiliaries import Router
+from wormhole_tracker.protocol import NONE, TYPES, encode, encode_compact
+
+
+def decode(frame):
+    """
+    Decode binary frame the way static/js/protocol.js does.
+    """
+    offset = 0
+
+    def read(fmt):
+        nonlocal offset
+        values = unpack_from('<' + fmt, frame, offset)
+        offset += sum(
+            {'B': 1, 'H': 2, 'I': 4, 'f': 4}[char] for char in fmt
+        )
+        return values if len(values) > 1 else values[0]
+
+    def string():
+        index = read('I')
+        return '' if index == NONE else strings[index]
+
+    kinds = {code: kind for kind, code in TYPES.items()}
+    kind, version = kinds[read('B')], read('I')
+    strings = []
+    for _ in range(read('I')):
+        length = read('H')
+        strings.append(frame[offset:offset + length].decode())
+        offset += length
+    data = {'version': version, 'current': string()}
+    pilot = string()
+    if pilot:
+        data['pilot'] = pilot
+    data['nodes'] = []
+    for _ in range(read('I')):
+        node = {'name': string()}
+        if read('B'):
+            node['x'], node['y'] = read('ff')
+            node['fixed'] = True
+        data['nodes'].append(node)
+    data['links'] = [
+        {'source': {'name': string()}, 'target': {'name': string()}}
+        for _ in range(read('I'))
+    ]
+    data['positions'] = [
+        {'name': string(), 'x': read('f'), 'y': read('f')}
+        for _ in range(read('I'))
+    ]
+    data['removed'] = [
+        {'source': {'name': string()}, 'target': {'name': string()}}
+        for _ in range(read('I'))
+    ]
+    assert offset == len(frame)
+    return [kind, data]
+
+
+def normalized(message):
+    """
+    :return: message as the front-end sees it, decoded from JSON
+    """
+    kind, data = json.loads(json.dumps(message))
+    for key in ('nodes', 'links', 'positions', 'removed'):
+        data.setdefault(key, [])
+    data.setdefault('current', '')
+    for node in data['nodes']:
+        if not node.get('fixed'):
+            for key in ('x', 'y', 'fixed'):
+                node.pop(key, None)
+    return [kind, data]
+
+
+class ProtocolTest(unittest.TestCase):
+    def assertRoundTrip(self, message):
+        frame, binary = encode(message, compact=True)
+        self.assertTrue(binary)
+        self.assertEqual(decode(frame), normalized(message))
+
+    @sync
+    async def test_map_messages(self):
+        router = Router('1', App())
+        updates = [
+            await router.update(name, pilot)
+            for name, pilot in [('A', '1'), ('B', '1'), ('Ω-1', '2'),
+                                ('A', '1')]
+        ]
+        await router.move([{'name': 'B', 'x': 0.5, 'y': -2.25}])
+        for update in updates:
+            self.assertRoundTrip(['update', update])
+        self.assertRoundTrip(['sync', router.changes(1, '1')])
+        snapshot = router.snapshot('1')
+        self.assertRoundTrip(['recover', snapshot])
+        fixed = [node for node in snapshot['nodes'] if node.get('fixed')]
+        self.assertEqual(len(fixed), 1)
+
+    def test_removed_links(self):
+        self.assertRoundTrip(['update', {
+            'current': 'A', 'version': 7, 'removed': [
+                {'source': {'name': 'A'}, 'target': {'name': 'B'}}
+            ]
+        }])
+
+    def test_names_sent_once(self):
+        links = [
+            {'source': {'name': 'J123456'}, 'target': {'name': 'J654321'}}
+        ] * 10
+        frame = encode_compact('sync', {'links': links, 'version': 1})
+        self.assertEqual(frame.count(b'J123456'), 1)
+
+    def test_other_messages_stay_json(self):
+        for compact in (False, True):
+            frame, binary = encode(['warning', 'Log in'], compact)
+            self.assertFalse(binary)
+            self.assertEqual(json.loads(frame), ['warning', 'Log in'])
+        frame, binary = encode(['update', {'version': 1}])
+        self.assertFalse(binary)
+
+
+if __name__ == '__main__':
+    unittest.main()
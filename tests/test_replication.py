@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of wormhole-tracker package released under
+# the GNU GPLv3 license. See the LICENSE file for more information.
+
+import shutil
+import tempfile
+import unittest
+from os import getpid
+from unittest import mock
+
+from tornado import gen
+from tornado.escape import json_decode, json_encode
+from tornado.ioloop import IOLoop
+
+import helpers
+from helpers import MapTest, state, sync
+from wormhole_tracker.auxiliaries import Router
+from wormhole_tracker.channel import Channel
+from wormhole_tracker.maps import Maps
+
+
+class Notes(object):
+    """
+    Channel stand-in, notifications told to other processes are kept
+    as they would arrive, through JSON.
+    """
+    def __init__(self):
+        self.told = []
+
+    def tell(self, pid, notification):
+        self.told.append((pid, json_decode(json_encode(notification))))
+        return True
+
+
+class App(helpers.App):
+    def __init__(self):
+        super(App, self).__init__()
+        self.channel = Notes()
+        self.maps = Maps(self)
+
+    def router(self, user_id=None, key=None):
+        return self.users[key]['router']
+
+
+class ChannelTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    @sync
+    async def test_notifications_come_whole_and_in_order(self):
+        received = []
+        channel = Channel(self.directory, received.append)
+        try:
+            # Larger than a single read of the stream
+            large = {'nodes': ['J%06d' % i for i in range(100000)]}
+            notifications = [{'n': 1}, large, {'n': 2}, {'n': 3}]
+            for notification in notifications:
+                self.assertTrue(channel.tell(getpid(), notification))
+            deadline = IOLoop.current().time() + 5
+            while len(received) < len(notifications):
+                self.assertLess(IOLoop.current().time(), deadline)
+                await gen.sleep(0.01)
+            self.assertEqual(received, notifications)
+        finally:
+            channel.close()
+
+    def test_too_large_notification(self):
+        with mock.patch.object(Channel, 'max_size', 16):
+            self.assertIsNone(Channel.encode({'nodes': ['J000001'] * 4}))
+        data = Channel.encode({'n': 1})
+        self.assertEqual(data[4:], b'{"n": 1}')
+        self.assertEqual(int.from_bytes(data[:4], 'big'), 8)
+
+    @sync
+    async def test_dead_process(self):
+        channel = Channel(self.directory, None)
+        try:
+            self.assertFalse(channel.tell(getpid() + 1, {'n': 1}))
+        finally:
+            channel.close()
+
+
+class ReplicationTest(MapTest):
+    @sync
+    async def test_apply_replicates_owner(self):
+        owner, copy = Router('1', App()), Router('1', App())
+        for _ in range(300):
+            change = await self.change(owner)
+            if change:
+                self.assertTrue(copy.apply(change))
+        self.assertEqual(state(copy.snapshot('2')),
+                         state(owner.snapshot('2')))
+        self.assertEqual(copy.locations, owner.locations)
+        self.assertEqual(copy.lifetimes, owner.lifetimes)
+
+    @sync
+    async def test_apply_detects_gap(self):
+        owner, copy = Router('1', App()), Router('1', App())
+        changes = [await owner.update(name) for name in self.names[:5]]
+        self.assertTrue(copy.apply(changes[0]))
+        self.assertFalse(copy.apply(changes[2]))
+        self.assertEqual(copy.version, 1)
+        # Missing changes come from the owner's history
+        for change in owner.since(copy.version):
+            self.assertTrue(copy.apply(change))
+        self.assertEqual(state(copy.snapshot()), state(owner.snapshot()))
+        # Already applied changes are ignored
+        self.assertTrue(copy.apply(changes[1]))
+        self.assertEqual(copy.version, owner.version)
+
+    async def replicate(self, count):
+        """
+        Make `count` changes of the owner's map, the copy only gets
+        the first and the last one, and asks the owner for the rest.
+
+        :return: owner and copy applications
+        """
+        owner, copy = App(), App()
+        for app in (owner, copy):
+            app.users['map'] = {'router': Router('map', app)}
+        router = owner.router(key='map')
+        changes = [await router.update(name) for name in self.names[:count]]
+        copy.maps.apply('map', ['update', changes[0]], getpid())
+        copy.maps.apply('map', ['update', changes[-1]], getpid())
+        # Gap is noticed, and only asked about once
+        copy.maps.apply('map', ['update', changes[-1]], getpid())
+        self.assertEqual(copy.channel.told, [
+            (getpid(), {'missing': ['map', 1, getpid()]})
+        ])
+        owner.maps.receive(copy.channel.told[0][1])
+        (_, replica), = owner.channel.told
+        copy.maps.receive(replica)
+        self.assertEqual(copy.maps.requested, {})
+        self.assertEqual(state(copy.router(key='map').snapshot()),
+                         state(router.snapshot()))
+        return replica
+
+    @sync
+    async def test_missing_changes_from_history(self):
+        replica = await self.replicate(5)
+        key, changes, data = replica['replica']
+        self.assertEqual(len(changes), 4)
+        self.assertIsNone(data)
+
+    @sync
+    async def test_whole_map_past_history(self):
+        with mock.patch.object(Router, 'history_size', 3):
+            replica = await self.replicate(10)
+        key, changes, data = replica['replica']
+        self.assertIsNone(changes)
+        self.assertEqual(data['version'], 10)
+
+    @sync
+    async def test_stale_replica_ignored(self):
+        app = App()
+        app.users['map'] = {'router': Router('map', app)}
+        router = app.router(key='map')
+        for name in self.names[:3]:
+            await router.update(name)
+        stale = Router('map', App())
+        await stale.update(self.names[0])
+        app.maps.replica('map', None, stale.dump())
+        self.assertIs(app.router(key='map'), router)
+
+
+if __name__ == '__main__':
+    unittest.main()
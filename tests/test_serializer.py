@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of wormhole-tracker package released under
+# the GNU GPLv3 license. See the LICENSE file for more information.
+
+import json
+import unittest
+from unittest import mock
+
+from helpers import sync
+from wormhole_tracker import serializer
+from wormhole_tracker.protocol import encode
+from wormhole_tracker.serializer import Serializer, size
+
+
+def recover(count):
+    return ['recover', {
+        'current': 'J000000', 'version': 1,
+        'nodes': [{'name': f"J{i:06d}"} for i in range(count)],
+    }]
+
+
+class SerializerTest(unittest.TestCase):
+    def make(self, **kwargs):
+        pool = Serializer(workers=1, **kwargs)
+        self.addCleanup(pool.close)
+        return pool
+
+    def test_size(self):
+        self.assertEqual(size(recover(5)), 5)
+        self.assertEqual(size(['replay', {'jumps': [1, 2], 'done': True}]), 2)
+        self.assertEqual(size(['fleet', [1, 2, 3]]), 3)
+        self.assertEqual(size(['warning', 'text']), 0)
+        self.assertEqual(size('sync'), 0)
+
+    def test_thresholds_without_orjson(self):
+        with mock.patch.object(serializer, 'orjson', None):
+            pool = self.make(encode_threshold=100)
+            self.assertEqual(pool.decode_threshold, 64 * 1024)
+            for compact in (False, True):
+                self.assertTrue(pool.inline(recover(99), compact))
+                self.assertFalse(pool.inline(recover(100), compact))
+
+    def test_thresholds_with_orjson(self):
+        with mock.patch.object(serializer, 'orjson', object()):
+            pool = self.make(encode_threshold=100)
+            self.assertEqual(pool.decode_threshold, float('inf'))
+            # JSON is encoded faster than pickled for the pool
+            self.assertTrue(pool.inline(recover(100)))
+            self.assertTrue(pool.inline(['replay', {'jumps': [0] * 100}],
+                                        compact=True))
+            self.assertFalse(pool.inline(recover(100), compact=True))
+
+    @sync
+    async def test_offloaded(self):
+        pool = self.make(encode_threshold=100, decode_threshold=1000)
+        message = recover(100)
+        frame = await pool.encode(message, compact=True)
+        self.assertEqual(frame, encode(message, compact=True))
+        data = json.dumps(message)
+        self.assertEqual(await pool.decode(data), message)
+        self.assertEqual(pool.offloaded, 2)
+        # Small messages never reach the pool
+        await pool.encode(recover(1), compact=True)
+        await pool.decode('["sync", 1]')
+        self.assertEqual(pool.offloaded, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
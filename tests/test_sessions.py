@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of wormhole-tracker package released under
+# the GNU GPLv3 license. See the LICENSE file for more information.
+
+import unittest
+
+from wormhole_tracker.sessions import Session, Sessions
+
+
+class Users(dict):
+    def __init__(self):
+        super(Users, self).__init__()
+        self.saved = []
+
+    def save(self, user_id):
+        self.saved.append(user_id)
+
+
+class Socket(object):
+    def __init__(self, session):
+        self.current_user = session
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+class Connections(object):
+    def __init__(self):
+        self.by_user = {}
+
+    def sockets(self, user_id):
+        return self.by_user.get(user_id, ())
+
+
+class App(object):
+    def __init__(self):
+        self.users = Users()
+        self.users['1'] = {}
+        self.connections = Connections()
+        self.evicted = []
+
+    def notify(self, evict=None):
+        self.evicted.append(evict)
+
+
+class SessionsTest(unittest.TestCase):
+    def setUp(self):
+        self.app = App()
+        self.sessions = Sessions(self.app, max_sessions=3)
+
+    def test_start_and_resolve(self):
+        cookie = self.sessions.start('1')
+        session = self.sessions.resolve(cookie.encode())
+        self.assertEqual(session.user_id, '1')
+        self.assertEqual(f"1:{session.token}", cookie)
+        # Other processes reload the user
+        self.assertEqual(self.app.evicted, ['1'])
+        self.assertEqual(self.app.users.saved, ['1'])
+
+    def test_unknown_sessions(self):
+        self.sessions.start('1')
+        self.assertIsNone(self.sessions.resolve(None))
+        self.assertIsNone(self.sessions.resolve(b'1:forged'))
+        self.assertIsNone(self.sessions.resolve(b'2:token'))
+        self.assertIsNone(self.sessions.resolve(b'garbage'))
+
+    def test_oldest_sessions_forgotten(self):
+        cookies = [self.sessions.start('1') for _ in range(4)]
+        self.assertIsNone(self.sessions.resolve(cookies[0]))
+        for cookie in cookies[1:]:
+            self.assertIsNotNone(self.sessions.resolve(cookie))
+        self.assertEqual(len(self.app.users['1']['sessions']), 3)
+
+    def test_end_closes_sockets(self):
+        ended = self.sessions.resolve(self.sessions.start('1'))
+        other = self.sessions.resolve(self.sessions.start('1'))
+        sockets = [Socket(ended), Socket(other)]
+        self.app.connections.by_user['1'] = sockets
+        self.sessions.end(ended)
+        self.assertFalse(self.sessions.valid(ended))
+        self.assertTrue(self.sessions.valid(other))
+        self.assertEqual([socket.closed for socket in sockets], [True, False])
+        # Ending it again changes nothing
+        self.sessions.end(ended)
+        self.assertEqual(self.app.users.saved, ['1', '1', '1'])
+
+    def test_invalid_session(self):
+        self.assertFalse(self.sessions.valid(Session('2', 'token')))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,251 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of wormhole-tracker package released under
+# the GNU GPLv3 license. See the LICENSE file for more information.
+
+import json
+import unittest
+from unittest import mock
+
+from tornado import gen
+from tornado.concurrent import Future
+from tornado.httputil import HTTPServerRequest
+from tornado.web import Application
+
+import helpers
+from helpers import state, sync
+from wormhole_tracker import auxiliaries
+from wormhole_tracker.handlers.base_socket import BaseSocketHandler
+from wormhole_tracker.protocol import encode
+from wormhole_tracker.serializer import Serializer
+
+
+class Counter(object):
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, *labels, amount=1):
+        self.value += amount
+
+
+class Metrics(object):
+    def __init__(self):
+        self.sent = Counter()
+        self.skipped = Counter()
+        self.slow_closed = Counter()
+
+
+class StubRouter(object):
+    """
+    Router which has changed since every version, but the first one.
+    """
+    def changes(self, version, user_id):
+        if version == 1:
+            return None
+        return {'version': 10, 'nodes': []}
+
+
+class App(Application):
+    def __init__(self):
+        super(App, self).__init__()
+        self.metrics = Metrics()
+        self.serializer = Serializer()
+        self.map = StubRouter()
+        self.spawned = []
+
+    def router(self, user_id=None, key=None):
+        return self.map
+
+    def spawn(self, callback, *args):
+        self.spawned.append(callback)
+
+
+class Socket(BaseSocketHandler):
+    """
+    Socket without connection, frames it writes are kept in `written`,
+    and are flushed by `flush_all`.
+    """
+    user_id = '1'
+
+    def __init__(self):
+        request = HTTPServerRequest(uri='/poll', connection=mock.Mock())
+        request.remote_ip = '127.0.0.1'
+        super(Socket, self).__init__(App(), request)
+        self.ws_connection = True
+        self.written = []
+        self.futures = []
+        self.closed = False
+
+    def write_message(self, message, binary=False):
+        self.written.append(message)
+        future = Future()
+        self.futures.append(future)
+        return future
+
+    def flush_all(self):
+        for future in list(self.futures):
+            if not future.done():
+                future.set_result(None)
+
+    def close(self, code=None, reason=None):
+        self.closed = True
+        self.ws_connection = None
+
+    def kinds(self):
+        return [frame.split(b'"')[1].decode() for frame in self.written]
+
+
+def send(socket, message):
+    socket.safe_send(encode(message), message)
+
+
+class BackpressureTest(unittest.TestCase):
+    def setUp(self):
+        self.socket = Socket()
+        self.socket.buffer_threshold = 100
+        self.socket.buffer_limit = 1000
+
+    def update(self, version, size=10):
+        return ['update', {'version': version, 'nodes': ['J' * size]}]
+
+    def test_updates_skipped_past_threshold(self):
+        socket = self.socket
+        send(socket, self.update(2, size=200))
+        self.assertFalse(socket.drained.is_set())
+        send(socket, self.update(3))
+        send(socket, ['warning', 'Log into game'])
+        self.assertTrue(socket.behind)
+        self.assertEqual(socket.kinds(), ['update', 'warning'])
+        self.assertEqual(socket.application.metrics.skipped.value, 1)
+        self.assertEqual(socket.version, 2)
+        # Skipped updates come at once, when the buffer is flushed
+        socket.flush_all()
+        self.assertFalse(socket.behind)
+        self.assertEqual(socket.kinds(), ['update', 'warning', 'sync'])
+        self.assertEqual(socket.version, 10)
+        self.assertEqual(socket.pending, len(socket.written[-1]))
+        socket.flush_all()
+        self.assertTrue(socket.drained.is_set())
+        self.assertEqual(socket.pending, 0)
+
+    def test_too_old_version_recovered(self):
+        socket = self.socket
+        send(socket, self.update(1, size=200))
+        send(socket, self.update(2))
+        socket.flush_all()
+        # Changes are not in the history anymore
+        self.assertTrue(socket.holding)
+        self.assertEqual(socket.application.spawned, [socket.recover])
+
+    def test_slow_client_closed(self):
+        socket = self.socket
+        for version in range(20):
+            send(socket, ['sync', {'version': version, 'nodes': ['J' * 90]}])
+        self.assertTrue(socket.closed)
+        self.assertLessEqual(socket.pending, socket.buffer_limit)
+        self.assertEqual(socket.application.metrics.slow_closed.value, 1)
+
+    @sync
+    async def test_writer_waits_for_client(self):
+        socket = self.socket
+        writing = gen.convert_yielded(
+            socket.safe_write(['replay', {'jumps': ['J' * 200]}])
+        )
+        await gen.moment
+        self.assertFalse(writing.done())
+        socket.flush_all()
+        await writing
+        await socket.safe_write(['replay', {'jumps': []}])
+        self.assertEqual(socket.kinds(), ['replay', 'replay'])
+
+
+class RecoveryTest(unittest.TestCase):
+    async def chain(self, length):
+        """
+        :return: router of the map with `length` systems in a row
+        """
+        router = auxiliaries.Router('1', helpers.App())
+        for i in range(length):
+            await router.update(f"J{i:03d}", '1')
+        return router
+
+    @sync
+    async def test_chunks(self):
+        router = await self.chain(25)
+        await router.update('J012', '1')
+        chunks = list(router.recovery('1', 10))
+        self.assertEqual([len(chunk['nodes']) for chunk in chunks],
+                         [10, 10, 5])
+        self.assertEqual(chunks[0]['current'], 'J012')
+        self.assertEqual(chunks[0]['nodes'][0]['name'], 'J012')
+        # Every link comes with or after both of its nodes
+        nodes, links = set(), set()
+        for chunk in chunks:
+            nodes.update(node['name'] for node in chunk['nodes'])
+            for link in chunk['links']:
+                link = link['source']['name'], link['target']['name']
+                self.assertTrue(nodes.issuperset(link))
+                links.add(frozenset(link))
+        _, expected_nodes, expected_links, _ = state(router.snapshot('1'))
+        self.assertEqual(nodes, set(expected_nodes))
+        self.assertEqual(links, expected_links)
+
+    @sync
+    async def test_updates_wait_for_the_last_chunk(self):
+        socket = Socket()
+        socket.recovery_chunk = 10
+        router = socket.application.map = await self.chain(25)
+        recovering = gen.convert_yielded(socket.recover())
+        await gen.moment
+        change = await router.update('J100', '1')
+        send(socket, ['update', change])
+        await recovering
+        self.assertFalse(socket.holding)
+        messages = [json.loads(frame) for frame in socket.written]
+        self.assertEqual([kind for kind, _ in messages],
+                         ['recover', 'sync', 'sync', 'sync'])
+        # Skipped update comes after the last chunk
+        self.assertEqual(messages[-1][1]['version'], router.version)
+        self.assertEqual(messages[-1][1]['current'], 'J100')
+        self.assertEqual(socket.version, router.version)
+
+
+class SlowSerializer(Serializer):
+    """
+    Serializer which encodes 'big' messages on the next IOLoop
+    iterations, and fails to encode 'broken' ones.
+    """
+    def inline(self, message, compact=False):
+        return message[0] not in ('big', 'broken')
+
+    async def run(self, function, *args):
+        await gen.moment
+        await gen.moment
+        if args[0][0] == 'broken':
+            raise ValueError("Failed to encode")
+        return function(*args)
+
+
+class OrderTest(unittest.TestCase):
+    @sync
+    async def test_messages_keep_order(self):
+        socket = Socket()
+        socket.application.serializer = SlowSerializer()
+        big = gen.convert_yielded(socket.safe_write(['big', 1]))
+        broken = gen.convert_yielded(socket.safe_write(['broken', 2]))
+        await gen.moment
+        # Broadcast to the room while the big one is being encoded
+        send(socket, ['recover', {'version': 3}])
+        await socket.safe_write(['warning', 4])
+        self.assertEqual(socket.written, [])
+        await big
+        with self.assertRaises(ValueError):
+            await broken
+        self.assertEqual(socket.kinds(), ['big', 'recover', 'warning'])
+        self.assertEqual(len(socket.outbox), 0)
+        send(socket, ['warning', 5])
+        self.assertEqual(len(socket.written), 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of wormhole-tracker package released under
+# the GNU GPLv3 license. See the LICENSE file for more information.
+
+import tempfile
+import unittest
+from datetime import datetime
+from os import path
+from unittest import mock
+
+from wormhole_tracker import storage
+from wormhole_tracker.storage import ExpiringStates, SQLiteStorage, States
+
+
+class StatesCases(object):
+    """
+    Both state storages behave the same way, see `make`.
+    """
+    def setUp(self):
+        self.now = 1000
+        clock = mock.patch.object(storage, 'time', lambda: self.now)
+        clock.start()
+        self.addCleanup(clock.stop)
+
+    def make(self, ttl, max_size):
+        return ExpiringStates(ttl=ttl, max_size=max_size)
+
+    def issue(self, states, *tokens):
+        for token in tokens:
+            states[token] = datetime.fromtimestamp(self.now)
+
+    def test_pop(self):
+        states = self.make(ttl=10, max_size=5)
+        self.issue(states, 'a', 'b')
+        self.assertEqual(states.pop('a'), datetime.fromtimestamp(1000))
+        self.assertIsNone(states.pop('a'))
+        self.assertIsNone(states.pop('unknown'))
+        self.assertEqual(len(states), 1)
+
+    def test_expiry(self):
+        states = self.make(ttl=10, max_size=5)
+        self.issue(states, 'a', 'b')
+        self.now += 5
+        self.issue(states, 'c')
+        self.now += 5
+        # Expired token can not be used even before it is swept
+        self.assertIsNone(states.pop('a'))
+        self.issue(states, 'd')
+        self.assertEqual(len(states), 2)
+        self.assertEqual((states.expired, states.evicted), (2, 0))
+        self.assertIsNotNone(states.pop('c'))
+
+    def test_bounds(self):
+        states = self.make(ttl=10, max_size=3)
+        for token in 'abcde':
+            self.issue(states, token)
+            self.now += 1
+        self.assertEqual(len(states), 3)
+        self.assertEqual(states.evicted, 2)
+        self.assertIsNone(states.pop('b'))
+        self.assertIsNotNone(states.pop('c'))
+
+
+class ExpiringStatesTest(StatesCases, unittest.TestCase):
+    def test_popped_tokens_leave_queue(self):
+        states = self.make(ttl=10, max_size=10)
+        for i in range(3000):
+            self.issue(states, str(i))
+            states.pop(str(i))
+        self.assertEqual(len(states), 0)
+        self.assertLess(len(states.queue), 1100)
+
+    def test_reissued_token(self):
+        states = self.make(ttl=10, max_size=10)
+        self.issue(states, 'a')
+        self.now += 8
+        self.issue(states, 'a')
+        self.now += 5
+        self.issue(states, 'b')
+        self.assertEqual(states.expired, 0)
+        self.assertIsNotNone(states.pop('a'))
+
+
+class SharedStatesTest(StatesCases, unittest.TestCase):
+    def make(self, ttl, max_size):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        backend = SQLiteStorage(path.join(directory.name, 'states.db'))
+        self.addCleanup(backend.close)
+        return States(backend, ttl=ttl, max_size=max_size)
+
+    def test_count_kept_by_triggers(self):
+        states = self.make(ttl=10, max_size=3)
+        self.issue(states, b'a', 'a', 'b')
+        states.pop('b')
+        self.assertEqual(len(states), 1)
+        count = states.storage.connection.execute(
+            "SELECT COUNT(*) FROM states"
+        ).fetchone()[0]
+        self.assertEqual(count, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
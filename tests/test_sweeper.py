@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of wormhole-tracker package released under
+# the GNU GPLv3 license. See the LICENSE file for more information.
+
+import unittest
+from os import getpid
+from unittest import mock
+
+from tornado.ioloop import IOLoop
+
+import helpers
+from helpers import MapTest, sync
+from wormhole_tracker import sweeper
+from wormhole_tracker.auxiliaries import Graph, Router
+from wormhole_tracker.sweeper import Sweeper
+
+
+class Maps(object):
+    def __init__(self):
+        self.changes = []
+
+    def owner(self, key):
+        return getpid()
+
+    async def change(self, key, method, *args):
+        self.changes.append((key, method) + args)
+
+
+class App(object):
+    def __init__(self):
+        self.maps = Maps()
+        self.expired = []
+
+    def spawn(self, callback, key, entries):
+        # Run right away, ticks are checked one by one
+        self.expired.append((key, sorted(entry[0] for entry in entries)))
+        IOLoop.current().run_sync(lambda: callback(key, entries))
+
+
+class SweeperTest(unittest.TestCase):
+    def setUp(self):
+        self.now = 10000
+        clock = mock.patch.object(sweeper, 'time', lambda: self.now)
+        clock.start()
+        self.addCleanup(clock.stop)
+        self.app = App()
+        # Ten seconds per slot, the whole turn is a minute
+        self.sweeper = Sweeper(self.app, resolution=10, slots=6)
+
+    def tick(self, now):
+        self.now = now
+        self.app.expired = []
+        self.sweeper.tick()
+        return self.app.expired
+
+    def test_expiry_order(self):
+        for expires in (10035, 10012, 10021, 10028, 10150):
+            self.sweeper.schedule('map', (0, 1), expires)
+        self.assertEqual(self.tick(10010), [])
+        self.assertEqual(self.tick(10020), [('map', [10012])])
+        self.assertEqual(self.tick(10030), [('map', [10021, 10028])])
+        # Missed ticks are processed at once
+        self.assertEqual(self.tick(10059), [('map', [10035])])
+        # Link expiring a few turns later waits in its slot
+        for now in range(10060, 10150, 10):
+            self.assertEqual(self.tick(now), [])
+        self.assertEqual(self.tick(10150), [('map', [10150])])
+        self.assertEqual(self.sweeper.scheduled, set())
+
+    def test_expired_link_goes_to_next_tick(self):
+        self.sweeper.schedule('map', (0, 1), 9000)
+        self.assertEqual(self.tick(10010), [('map', [9000])])
+        self.assertEqual(
+            self.app.maps.changes, [('map', 'expire', [(0, 1)])]
+        )
+
+    def test_maps_expire_separately(self):
+        self.sweeper.schedule('a', (0, 1), 10015)
+        self.sweeper.schedule('b', (2, 3), 10016)
+        self.sweeper.schedule('b', (2, 3), 10016)
+        expired = self.tick(10020)
+        self.assertEqual(sorted(expired), [('a', [10015]), ('b', [10016])])
+
+    def test_other_owner_keeps_links(self):
+        self.app.maps.owner = lambda key: getpid() + 1
+        self.sweeper.schedule('map', (0, 1), 10015)
+        self.tick(10020)
+        self.assertEqual(self.app.maps.changes, [])
+
+
+class LifetimeTest(MapTest):
+    @sync
+    async def test_link_lifetime_restarts_on_jump(self):
+        router = Router('1', helpers.App())
+        await router.update('A')
+        await router.update('B')
+        self.now += 80
+        await router.update('A')
+        edge = Graph.edge(router.graph.ids['A'], router.graph.ids['B'])
+        self.assertIsNone(await router.expire([edge], 1150))
+        self.assertTrue(router.graph.has_link('A', 'B'))
+        self.assertIsNotNone(await router.expire([edge], 1180))
+        self.assertFalse(router.graph.has_link('A', 'B'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of wormhole-tracker package released under
+# the GNU GPLv3 license. See the LICENSE file for more information.
+
+import unittest
+
+from tornado.ioloop import IOLoop
+
+from wormhole_tracker.handlers.polling import PollingHandler, merge_moves
+from wormhole_tracker.tasks import Tasks
+
+
+def drain(q):
+    """
+    :return: list of all tasks waiting in the queue, in the order
+    they are taken
+    """
+    tasks = []
+
+    async def take():
+        while q.qsize():
+            tasks.append(await q.get())
+    IOLoop.current().run_sync(take)
+    return tasks
+
+
+class TasksTest(unittest.TestCase):
+    def test_lanes_priority(self):
+        q = Tasks(lanes=3)
+        q.put('move', 2)
+        q.put('sync', 1)
+        q.put('track', 0)
+        q.put('recover', 1)
+        self.assertEqual(drain(q), ['track', 'sync', 'recover', 'move'])
+
+    def test_coalescing_keeps_place(self):
+        q = Tasks(lanes=1)
+        q.put('track', 0, 'tracking')
+        q.put(['sync', 1], 0, 'sync')
+        q.put('stop', 0, 'tracking')
+        q.put(['sync', 2], 0, 'sync')
+        self.assertEqual(q.coalesced, 2)
+        self.assertEqual(drain(q), ['stop', ['sync', 2]])
+        # Taken task is not coalesced anymore
+        q.put('track', 0, 'tracking')
+        self.assertEqual(drain(q), ['track'])
+
+    def test_tasks_without_key(self):
+        q = Tasks(lanes=1)
+        q.put(['route', {'to': 'A'}], 0)
+        q.put(['route', {'to': 'B'}], 0)
+        self.assertEqual(q.coalesced, 0)
+        self.assertEqual(len(drain(q)), 2)
+
+    def test_full_lane_drops(self):
+        q = Tasks(lanes=2, limit=2)
+        self.assertTrue(q.put('a', 0))
+        self.assertTrue(q.put('b', 0))
+        self.assertFalse(q.put('c', 0))
+        self.assertTrue(q.put('d', 1))
+        # Waiting task is still coalesced into when the lane is full
+        q.put('e', 1, 'key')
+        self.assertTrue(q.put('f', 1, 'key'))
+        self.assertEqual(q.dropped, 1)
+        self.assertEqual(drain(q), ['a', 'b', 'd', 'f'])
+
+    def test_merge_moves(self):
+        q = Tasks(lanes=1)
+        older = [{'name': 'A', 'x': 1, 'y': 1}, {'name': 'B', 'x': 2, 'y': 2}]
+        newer = [{'name': 'B', 'x': 3, 'y': 3}, {'name': 'C', 'x': 4, 'y': 4}]
+        q.put((['move', older], 'room'), 0, 'move', merge_moves)
+        q.put((['move', newer], 'room'), 0, 'move', merge_moves)
+        (kind, nodes), room = drain(q)[0]
+        self.assertEqual((kind, room), ('move', 'room'))
+        self.assertEqual(
+            sorted((node['name'], node['x']) for node in nodes),
+            [('A', 1), ('B', 3), ('C', 4)]
+        )
+
+    def test_moves_of_other_maps_kept_apart(self):
+        older = [{'name': 'A', 'x': 1, 'y': 1}]
+        newer = [{'name': 'B', 'x': 2, 'y': 2}]
+        self.assertEqual(
+            merge_moves((['move', older], 'own'), (['move', newer], 'fleet')),
+            (['move', newer], 'fleet')
+        )
+        q = Tasks(lanes=1)
+        q.put((['move', older], 'own'), 0, ('move', 'own'), merge_moves)
+        q.put((['move', newer], 'fleet'), 0, ('move', 'fleet'), merge_moves)
+        self.assertEqual(drain(q), [
+            (['move', older], 'own'), (['move', newer], 'fleet')
+        ])
+
+    def test_merge_moves_limit(self):
+        many = [{'name': str(i), 'x': i, 'y': i} for i in range(3000)]
+        (_, nodes), _ = merge_moves((['move', many], None),
+                                    (['move', many[:10]], None))
+        self.assertEqual(len(nodes), PollingHandler.max_moved)
+        self.assertEqual(nodes[:10], many[:10])
+
+    def test_close_stops_iteration(self):
+        q = Tasks()
+        q.put('track')
+        seen = []
+
+        async def run():
+            async for task in q:
+                seen.append(task)
+                q.close()
+        IOLoop.current().run_sync(run)
+        self.assertEqual(seen, ['track'])
+        self.assertFalse(q.put('stop'))
+
+
+if __name__ == '__main__':
+    unittest.main()
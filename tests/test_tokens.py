@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of wormhole-tracker package released under
+# the GNU GPLv3 license. See the LICENSE file for more information.
+
+import unittest
+
+from tornado import gen
+from tornado.locks import Event
+
+from helpers import sync
+from wormhole_tracker.tokens import TokenManager
+
+
+class Poller(object):
+    def __init__(self):
+        self.subscribers = {}
+        self.leased = True
+
+    def lease(self, user_id):
+        return self.leased
+
+
+class App(object):
+    def __init__(self):
+        self.users = {'1': {'refresh_token': 'refresh', 'expires_at': 0}}
+        self.poller = Poller()
+        self.authorized = []
+        self.notified = []
+        self.spawned = []
+        self.done = Event()
+        self.result = '1'
+
+    async def authorize(self, token, refresh=False):
+        self.authorized.append((token, refresh))
+        await self.done.wait()
+        if isinstance(self.result, Exception):
+            raise self.result
+        return self.result
+
+    def notify(self, evict=None):
+        self.notified.append(evict)
+
+    def spawn(self, callback, *args):
+        self.spawned.append((callback, args))
+
+
+class TokenManagerTest(unittest.TestCase):
+    def setUp(self):
+        self.app = App()
+        self.tokens = TokenManager(self.app)
+
+    async def refresh_all(self, count):
+        """
+        :return: results of `count` concurrent refreshes
+        """
+        refreshes = [self.tokens.refresh('1') for _ in range(count)]
+        waiting = gen.multi(refreshes)
+        await gen.moment
+        self.app.done.set()
+        return await waiting
+
+    @sync
+    async def test_single_flight(self):
+        self.assertEqual(await self.refresh_all(5), ['1'] * 5)
+        self.assertEqual(self.app.authorized, [('refresh', True)])
+        self.assertEqual(self.app.notified, ['1'])
+        self.assertEqual(self.tokens.refreshing, {})
+        # Next refresh goes to the SSO again
+        self.assertEqual(await self.tokens.refresh('1'), '1')
+        self.assertEqual(len(self.app.authorized), 2)
+
+    @sync
+    async def test_failure_is_shared(self):
+        self.app.result = ValueError("SSO is down")
+        self.assertEqual(await self.refresh_all(3), [None] * 3)
+        self.assertEqual(len(self.app.authorized), 1)
+        self.assertEqual(self.app.notified, [])
+        self.assertEqual(self.tokens.refreshing, {})
+
+    @sync
+    async def test_renewal(self):
+        self.tokens.timeouts['1'] = None
+        self.tokens._renew('1')
+        # Nobody tracks the character
+        self.assertEqual(self.app.spawned, [])
+        self.app.poller.subscribers['1'] = {'socket'}
+        self.app.poller.leased = False
+        self.tokens.timeouts['1'] = None
+        self.tokens._renew('1')
+        # The other process renews it, checked again later
+        self.assertEqual(self.app.spawned, [])
+        self.assertIn('1', self.tokens.timeouts)
+        self.tokens.cancel('1')
+        self.app.poller.leased = True
+        self.tokens.timeouts['1'] = None
+        self.tokens._renew('1')
+        self.assertEqual(self.app.spawned, [(self.tokens.refresh, ('1',))])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of wormhole-tracker package released under
+# the GNU GPLv3 license. See the LICENSE file for more information.
+
+import unittest
+
+import helpers
+from wormhole_tracker.auxiliaries import Router
+from wormhole_tracker.storage import Storage
+
+
+class MemoryStorage(Storage):
+    """
+    Storage keeping stored users and maps in dicts.
+    """
+    def __init__(self):
+        super(MemoryStorage, self).__init__()
+        self.users = {}
+        self.maps = {}
+        self.batches = []
+        self.failing = False
+
+    def load(self, user_id):
+        return self.users.get(user_id)
+
+    def load_map(self, key):
+        return self.maps.get(key)
+
+    def store(self, users, maps=(), jumps=()):
+        if self.failing:
+            raise IOError("Disk is full")
+        self.batches.append((sorted(dict(users)), sorted(dict(maps))))
+        self.users.update(users)
+        self.maps.update(maps)
+
+
+class Rooms(object):
+    def __init__(self):
+        self.viewers = {}
+
+
+class Poller(object):
+    def __init__(self):
+        self.subscribers = {}
+
+
+class App(helpers.App):
+    def __init__(self, storage):
+        super(App, self).__init__(storage)
+        self.rooms = Rooms()
+        self.poller = Poller()
+
+
+class UsersTest(unittest.TestCase):
+    def setUp(self):
+        self.storage = MemoryStorage()
+        self.app = App(self.storage)
+        self.users = self.app.users
+
+    def add(self, user_id):
+        self.users[user_id] = {
+            'name': user_id, 'router': Router(user_id, self.app)
+        }
+        self.users.save(user_id)
+        self.users.save_map(user_id)
+
+    def test_flush_batches_writes(self):
+        for user_id in '123':
+            self.add(user_id)
+        self.users.save('1')
+        self.users.flush()
+        self.assertEqual(self.storage.batches,
+                         [(['1', '2', '3'], ['1', '2', '3'])])
+        self.assertNotIn('router', self.storage.users['1'])
+        # Nothing has changed since
+        self.users.flush()
+        self.assertEqual(len(self.storage.batches), 1)
+
+    def test_failed_flush_is_retried(self):
+        self.add('1')
+        self.storage.failing = True
+        self.users.flush()
+        self.assertEqual(self.users.dirty, {'1'})
+        self.assertEqual(self.users.dirty_maps, {'1'})
+        self.storage.failing = False
+        self.users.flush()
+        self.assertEqual(self.storage.batches, [(['1'], ['1'])])
+
+    def test_eviction(self):
+        self.users.max_size = 2
+        for user_id in '1234':
+            self.add(user_id)
+        self.users.touch('1')
+        self.app.rooms.viewers['2'] = set()
+        self.users.flush()
+        # The least recently active ones, but the viewed one stays
+        self.assertEqual(set(self.users.activity), {'1', '2'})
+        self.assertEqual(self.users.evicted, 2)
+        self.assertIsNone(self.users.cached('3'))
+        # Evicted user comes back from the storage
+        user = self.users.touch('3')
+        self.assertEqual(user['name'], '3')
+        self.assertIsInstance(user['router'], Router)
+        self.assertIsNone(self.users.get('5'))
+
+    def test_dirty_users_are_not_evicted(self):
+        self.users.max_size = 1
+        for user_id in '12':
+            self.add(user_id)
+        self.users.shrink()
+        self.assertEqual(len(self.users.activity), 2)
+        self.users.flush()
+        self.assertEqual(len(self.users.activity), 1)
+
+    def test_evict_keeps_router(self):
+        self.add('1')
+        router = self.users['1']['router']
+        self.users.flush()
+        self.storage.users['1'] = {'name': 'renamed'}
+        self.users.evict('1')
+        self.assertEqual(self.users['1']['name'], 'renamed')
+        self.assertIs(self.users['1']['router'], router)
+
+
+if __name__ == '__main__':
+    unittest.main()
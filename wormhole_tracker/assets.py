@@ -0,0 +1,304 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of wormhole-tracker package released under
+# the GNU GPLv3 license. See the LICENSE file for more information.
+
+"""
+Static assets build.
+
+    python -m wormhole_tracker.assets [static directory]
+
+Scripts and stylesheets of every page are minified and joined into the
+`BUNDLES`, which are written into the `dist` directory along with the
+images and fonts they refer to, with the hash of the content in every
+file name. So the files never change under the same name, and can be
+cached by browsers forever. Text files also get `.gz` siblings, and `.br`
+ones if the brotli package is installed, for the web server to send
+them as they are, without compressing on every request.
+
+`dist/manifest.json` maps bundle and file names to the built ones, see
+`urls`. Until the build is run templates refer to the source files.
+
+Only the standard library is required, so the build can be run by the
+deploy script before the application and its dependencies are installed.
+rjsmin and rcssmin minify the sources when installed, otherwise simple
+minifiers are used, which only drop comments and extra whitespace.
+License header comments of the sources are kept either way.
+"""
+
+import gzip
+import json
+import logging
+import re
+import sys
+from hashlib import md5
+from os import makedirs
+from os.path import dirname, exists, join, normpath, relpath, splitext
+from shutil import rmtree
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import rcssmin
+except ImportError:
+    rcssmin = None
+
+try:
+    import rjsmin
+except ImportError:
+    rjsmin = None
+
+STATIC_PATH = join(dirname(__file__), 'static')
+
+BUNDLES = {
+    'vendor.js': [
+        'vendor/jquery-3.1.1.min.js',
+        'vendor/bootstrap/js/bootstrap.min.js',
+    ],
+    'vendor.css': ['vendor/bootstrap/css/bootstrap.min.css'],
+    'app.js': [
+        'js/auxiliaries.js',
+        'js/graph.js',
+        'js/protocol.js',
+        'js/main.js',
+    ],
+    'main.css': ['css/main.css'],
+    'sign.css': ['css/sign.css'],
+}
+
+# Files templates refer to directly
+FILES = ['images/sso_login.png']
+
+COMPRESSIBLE = ('.js', '.css', '.svg', '.ttf', '.eot', '.ico', '.json')
+
+# License comments, strings and regular expression literals, which have
+# to be passed as they are, and comments, which are dropped as a whole
+_js_tokens = re.compile(r"""
+    (?P<license>/\*!.*?\*/)
+  | (?P<string>"(?:\\.|[^"\\\n])*"|'(?:\\.|[^'\\\n])*'|`(?:\\.|[^`\\])*`)
+  | (?P<comment>/\*.*?\*/|//[^\n]*)
+  | (?P<regex>(?<=[(,=:\[!&|?{};])\s*/(?![*/])
+               (?:\\.|\[(?:\\.|[^\]])*\]|[^/\\\n])+/)
+""", re.DOTALL | re.VERBOSE)
+
+_css_tokens = re.compile(r"""
+    (?P<license>/\*!.*?\*/)
+  | (?P<string>"(?:\\.|[^"\\])*"|'(?:\\.|[^'\\])*')
+  | (?P<comment>/\*.*?\*/)
+""", re.DOTALL | re.VERBOSE)
+
+# Comment lines or the comment block the source starts with
+_header = re.compile(
+    r'\A\s*(?:(?://[^\n]*(?:\n|\Z)\s*)+|/\*.*?\*/)', re.DOTALL
+)
+
+_license = re.compile(r'licen[cs]e|copyright', re.IGNORECASE)
+
+_css_url = re.compile(r"""url\(\s*(['"]?)([^'")]+)\1\s*\)""")
+
+_manifest = {}
+
+
+def _minify(source, tokens, squeeze):
+    """
+    Apply `squeeze` to the code between the `tokens`, dropping comments.
+    """
+    result = []
+    code = []
+    position = 0
+    for match in tokens.finditer(source):
+        code.append(source[position:match.start()])
+        if match.lastgroup != 'comment':
+            # Code around the dropped comments is squeezed as a whole
+            result.append(squeeze(''.join(code)))
+            result.append(match.group())
+            code = []
+        position = match.end()
+    code.append(source[position:])
+    result.append(squeeze(''.join(code)))
+    return ''.join(result)
+
+
+def _squeeze_js(code):
+    # Line breaks are kept, since semicolons may rely on them
+    return re.sub(r'[ \t]*\n\s*', '\n', code)
+
+
+def _squeeze_css(code):
+    code = re.sub(r'\s+', ' ', code)
+    # Space before the colon may be a descendant combinator
+    code = re.sub(r' ?([{};,>]) ?', r'\1', code).replace(': ', ':')
+    return code.replace(';}', '}')
+
+
+def split_header(source):
+    """
+    :argument source: script or stylesheet
+    :return: tuple with the license header comment of the `source`, empty
+    if it has none, and the rest of the `source`
+    """
+    match = _header.match(source)
+    if match and _license.search(match.group()):
+        return match.group().strip() + '\n', source[match.end():]
+    return '', source
+
+
+def minify_js(source):
+    header, source = split_header(source)
+    if rjsmin is not None:
+        code = rjsmin.jsmin(source, keep_bang_comments=True)
+    else:
+        code = _minify(source, _js_tokens, _squeeze_js)
+    return header + code.strip() + '\n'
+
+
+def minify_css(source):
+    header, source = split_header(source)
+    if rcssmin is not None:
+        code = rcssmin.cssmin(source, keep_bang_comments=True)
+    else:
+        code = _minify(source, _css_tokens, _squeeze_css)
+    return header + code.strip() + '\n'
+
+
+def fingerprint(name, content):
+    """
+    :argument name:    file name
+    :argument content: file content bytes
+    :return: file name with the content hash before the extension
+    """
+    root, extension = splitext(name)
+    return f"{root}.{md5(content).hexdigest()[:12]}{extension}"
+
+
+class Build(object):
+    """
+    Writes built files into `static_path/dist`, see the module docstring.
+
+    Attributes:
+        manifest: dict mapping source names to the built ones,
+            relative to the `static_path`.
+    """
+    def __init__(self, static_path=STATIC_PATH):
+        self.static_path = static_path
+        self.output = join(static_path, 'dist')
+        self.manifest = {}
+
+    def run(self):
+        if exists(self.output):
+            rmtree(self.output)
+        makedirs(self.output)
+        if brotli is None:
+            logging.warning("brotli is not installed, .br files are skipped")
+        for name in FILES:
+            self.copy(name)
+        for name, sources in sorted(BUNDLES.items()):
+            self.bundle(name, sources)
+        with open(join(self.output, 'manifest.json'), 'w') as manifest:
+            json.dump(self.manifest, manifest, indent=2, sort_keys=True)
+        return self.manifest
+
+    def bundle(self, name, sources):
+        parts = []
+        for source in sources:
+            with open(join(self.static_path, source), encoding='utf-8') as f:
+                content = f.read()
+            # Source maps are not shipped
+            content = re.sub(
+                r'/[*/]# sourceMappingURL=\S+( \*/)?', '', content
+            )
+            if name.endswith('.css'):
+                if not source.endswith('.min.css'):
+                    content = minify_css(content)
+                content = self.rewrite(content, source)
+            elif not source.endswith('.min.js'):
+                content = minify_js(content)
+            parts.append(content.strip())
+        # Scripts which do not end with semicolon must not run together
+        separator = ';\n' if name.endswith('.js') else '\n'
+        content = (separator.join(parts) + '\n').encode('utf-8')
+        return self.write(name, content)
+
+    def rewrite(self, content, source):
+        """
+        Point urls of the stylesheet to the built files.
+        """
+        def replace(match):
+            url = match.group(2)
+            if url.startswith('/static/'):
+                path = url[len('/static/'):]
+            elif re.match(r'^([a-z]+:|/|#)', url):
+                return match.group()
+            else:
+                path = normpath(join(dirname(source), url))
+            path, suffix = re.match(r'^([^?#]*)(.*)$', path).groups()
+            if not exists(join(self.static_path, path)):
+                return match.group()
+            return f'url("/static/{self.copy(path)}{suffix}")'
+        return _css_url.sub(replace, content)
+
+    def copy(self, name):
+        """
+        :argument name: static file name
+        :return: name of the built file
+        """
+        if name not in self.manifest:
+            with open(join(self.static_path, name), 'rb') as f:
+                self.write(name, f.read())
+        return self.manifest[name]
+
+    def write(self, name, content):
+        path = join(self.output, fingerprint(name, content))
+        makedirs(dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(content)
+        if path.endswith(COMPRESSIBLE):
+            with open(path + '.gz', 'wb') as f:
+                f.write(gzip.compress(content, 9))
+            if brotli is not None:
+                with open(path + '.br', 'wb') as f:
+                    f.write(brotli.compress(content))
+        self.manifest[name] = relpath(path, self.static_path)
+        return self.manifest[name]
+
+
+def manifest(static_path):
+    """
+    :return: dict with built names of the assets in the `static_path`,
+    empty if they have not been built
+    """
+    if static_path not in _manifest:
+        try:
+            with open(join(static_path, 'dist', 'manifest.json')) as f:
+                _manifest[static_path] = json.load(f)
+        except FileNotFoundError:
+            _manifest[static_path] = {}
+    return _manifest[static_path]
+
+
+def urls(handler, name):
+    """
+    Template function, see `settings`.
+
+    :argument name: bundle or static file name
+    :return: list with the url of the built file, or urls of the
+    bundle's source files if assets have not been built
+    """
+    built = manifest(handler.settings['static_path']).get(name)
+    if built is not None:
+        return ['/static/' + built]
+    return [handler.static_url(path) for path in BUNDLES.get(name, [name])]
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    static_path = sys.argv[1] if len(sys.argv) > 1 else STATIC_PATH
+    for name, built in sorted(Build(static_path).run().items()):
+        logging.info(f"{name} -> {built}")
+
+
+if __name__ == '__main__':
+    main()
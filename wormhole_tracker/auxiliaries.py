@@ -4,9 +4,15 @@
 # the GNU GPLv3 license. See the LICENSE file for more information.
 
 import logging
+from array import array
 from base64 import b64encode
+from bisect import bisect_left
+from collections import OrderedDict, deque
 from functools import wraps
+from itertools import islice
 from os import urandom
+from sys import byteorder, intern
+from time import time
 
 
 def a(string):
@@ -35,80 +41,790 @@ def authenticated(func):
     """
     @wraps(func)
     def wrapper(handler, *args, **kwargs):
-        cookie = handler.get_secure_cookie("auth_cookie")
-        if cookie:
+        if handler.current_user:
             return func(handler, *args, **kwargs)
         return handler.redirect('/sign')
     return wrapper
 
 
+class Graph(object):
+    """
+    Undirected graph of visited star systems.
+
+    System names are interned and mapped to sequential integer ids, every
+    id owns a set of its neighbours ids, and every link is kept once in
+    the canonical (lesser id, greater id) order, so membership checks,
+    additions and neighbour queries are all done in constant time.
+    """
+    def __init__(self):
+        self.ids = {}        # System name to system id mapping
+        self.names = []      # System names, indexed by system id
+        self.adjacency = []  # Sets of neighbour ids, indexed by system id
+        self.edges = set()   # Canonically ordered tuples of linked ids
+        self.paths = Paths(self)  # Shortest paths between systems
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, name):
+        return name in self.ids
+
+    @staticmethod
+    def edge(a, b):
+        return (a, b) if a < b else (b, a)
+
+    def add_system(self, name):
+        """
+        Add star system to the graph.
+
+        :argument name: star system name
+        :return: True if system is new, False otherwise
+        """
+        if name in self.ids:
+            return False
+        name = intern(name)
+        self.ids[name] = len(self.names)
+        self.names.append(name)
+        self.adjacency.append(set())
+        return True
+
+    def has_link(self, source, target):
+        a, b = self.ids.get(source), self.ids.get(target)
+        if a is None or b is None:
+            return False
+        return self.edge(a, b) in self.edges
+
+    def add_link(self, source, target):
+        """
+        Link two star systems, adding them to the graph if required.
+
+        :argument source: star system name
+        :argument target: star system name
+        :return: True if link is new, False otherwise
+        """
+        self.add_system(source)
+        self.add_system(target)
+        a, b = self.ids[source], self.ids[target]
+        edge = self.edge(a, b)
+        if edge in self.edges:
+            return False
+        self.edges.add(edge)
+        self.adjacency[a].add(b)
+        self.adjacency[b].add(a)
+        self.paths.link_added(a, b)
+        return True
+
+    def remove_link(self, a, b):
+        """
+        :argument a: star system id
+        :argument b: star system id
+        :return: True if link has been removed, False if there was none
+        """
+        edge = self.edge(a, b)
+        if edge not in self.edges:
+            return False
+        self.edges.discard(edge)
+        self.adjacency[a].discard(b)
+        self.adjacency[b].discard(a)
+        self.paths.link_removed(a, b)
+        return True
+
+    def neighbours(self, name):
+        """
+        :argument name: star system name
+        :return: list with names of directly linked star systems
+        """
+        system_id = self.ids.get(name)
+        if system_id is None:
+            return []
+        return [self.names[i] for i in self.adjacency[system_id]]
+
+    def order(self, start=None):
+        """
+        Breadth-first order of the systems, so the nearer to the `start`
+        system comes first, followed by systems it is not linked with.
+
+        :argument start: star system id, None to start from the first one
+        :return: list of all star system ids
+        """
+        seen = bytearray(len(self.names))
+        order = []
+        roots = [] if start is None else [start]
+        for root in roots + list(range(len(self.names))):
+            if seen[root]:
+                continue
+            seen[root] = 1
+            order.append(root)
+            head = len(order) - 1
+            while head < len(order):
+                for neighbour in self.adjacency[order[head]]:
+                    if not seen[neighbour]:
+                        seen[neighbour] = 1
+                        order.append(neighbour)
+                head += 1
+        return order
+
+    def dump(self):
+        """
+        :return: JSON-serializable dict with graph data
+        """
+        return {
+            'systems': list(self.names),
+            'edges': [list(edge) for edge in self.edges],
+        }
+
+    @classmethod
+    def restore(cls, data):
+        """
+        Build graph from the data produced by `Graph.dump`.
+
+        :argument data: dict with `systems` and `edges` lists
+        :return: Graph object
+        """
+        graph = cls()
+        for name in data['systems']:
+            graph.add_system(name)
+        for a, b in data['edges']:
+            graph.add_link(graph.names[a], graph.names[b])
+        return graph
+
+    @property
+    def systems(self):
+        return list(self.names)
+
+    @property
+    def connections(self):
+        return [(self.names[a], self.names[b]) for a, b in self.edges]
+
+
+class Paths(object):
+    """
+    Shortest paths between the systems of the graph.
+
+    Paths are found by breadth-first search over the compressed sparse
+    row copy of the graph: neighbours of the system `i` are `targets`
+    from `offsets[i]` to `offsets[i + 1]`, both arrays of unsigned 32-bit
+    integers. The copy is made when the first search after the graph
+    change needs it.
+
+    Every search builds the whole tree of the shortest paths from its
+    source, and up to `max_trees` recently used trees are kept, so the
+    path between any two systems is found by walking the tree of either
+    of them, in the time proportional to the path's length.
+
+    Trees are only dropped when the change of the graph affects them:
+    new link makes a tree outdated if it connects systems which are
+    more than one jump away in it, or connects a new part of the graph
+    to it, and removed link does it if the link was a part of the tree.
+
+    Attributes:
+        trees: OrderedDict with source system ids as keys and
+            (distances, parents) tuples as values, both arrays of
+            signed integers indexed by system id, -1 if unreachable.
+
+        searches: amount of trees built.
+    """
+    def __init__(self, graph, max_trees=64):
+        self.graph = graph
+        self.max_trees = max_trees
+        self.offsets = None
+        self.targets = None
+        self.trees = OrderedDict()
+        self.searches = 0
+
+    def link_added(self, a, b):
+        self.offsets = self.targets = None
+        for source, (distances, _) in list(self.trees.items()):
+            da = distances[a] if a < len(distances) else -1
+            db = distances[b] if b < len(distances) else -1
+            if (da < 0) != (db < 0) or abs(da - db) > 1:
+                del self.trees[source]
+
+    def link_removed(self, a, b):
+        self.offsets = self.targets = None
+        for source, (_, parents) in list(self.trees.items()):
+            if (b < len(parents) and parents[b] == a) or (
+              a < len(parents) and parents[a] == b):
+                del self.trees[source]
+
+    def compress(self):
+        offsets = array('I', [0])
+        targets = array('I')
+        for neighbours in self.graph.adjacency:
+            targets.extend(neighbours)
+            offsets.append(len(targets))
+        self.offsets, self.targets = offsets, targets
+
+    def tree(self, source):
+        """
+        :argument source: star system id
+        :return: (distances, parents) tuple, see `trees`
+        """
+        tree = self.trees.get(source)
+        if tree is not None:
+            self.trees.move_to_end(source)
+            return tree
+        # Systems may have been added without links
+        if self.offsets is None or len(self.offsets) <= len(self.graph):
+            self.compress()
+        offsets, targets = self.offsets, self.targets
+        distances = array('i', [-1]) * (len(offsets) - 1)
+        parents = array('i', [-1]) * (len(offsets) - 1)
+        distances[source] = 0
+        queue = [source]
+        for system_id in queue:
+            distance = distances[system_id] + 1
+            for target in targets[offsets[system_id]:offsets[system_id + 1]]:
+                if distances[target] < 0:
+                    distances[target] = distance
+                    parents[target] = system_id
+                    queue.append(target)
+        self.searches += 1
+        tree = self.trees[source] = (distances, parents)
+        if len(self.trees) > self.max_trees:
+            self.trees.popitem(last=False)
+        return tree
+
+    def path(self, source, target):
+        """
+        :argument source: star system name
+        :argument target: star system name
+        :return: list with names of the systems on the shortest path
+        from the `source` to the `target`, both included,
+        None if there is no path or no such systems
+        """
+        a, b = self.graph.ids.get(source), self.graph.ids.get(target)
+        if a is None or b is None:
+            return None
+        # Paths are the same both ways, use the tree which is there
+        reverse = b in self.trees and a not in self.trees
+        if reverse:
+            a, b = b, a
+        distances, parents = self.tree(a)
+        if b >= len(distances) or distances[b] < 0:
+            return None
+        path = [b]
+        while path[-1] != a:
+            path.append(parents[path[-1]])
+        if not reverse:
+            path.reverse()
+        return [self.graph.names[system_id] for system_id in path]
+
+
+class Jumps(object):
+    """
+    Append-only time series of the character's jumps.
+
+    Jump times, in whole seconds since the epoch, and ids of the systems,
+    interned by the series itself, are kept in two parallel arrays of
+    unsigned 32-bit integers, so every jump takes 8 bytes, and jumps made
+    within the time range are found by binary search over the sorted times.
+    Arrays are stored as they are, packed into little-endian bytes.
+    """
+    def __init__(self):
+        self.times = array('I')
+        self.systems = array('I')
+        self.names = []  # System names, indexed by system id
+        self.ids = {}    # System ids, by system name
+
+    def __len__(self):
+        return len(self.times)
+
+    def last(self):
+        """
+        :return: name of the system of the latest jump, None if there is none
+        """
+        return self.names[self.systems[-1]] if self.systems else None
+
+    def append(self, timestamp, system):
+        timestamp = int(timestamp)
+        # Keep times sorted even if the clock goes backwards
+        if self.times and timestamp < self.times[-1]:
+            timestamp = self.times[-1]
+        system_id = self.ids.get(system)
+        if system_id is None:
+            system_id = self.ids[system] = len(self.names)
+            self.names.append(intern(system))
+        self.times.append(timestamp)
+        self.systems.append(system_id)
+
+    def dump(self):
+        """
+        :return: dict with jump times and system ids, packed into bytes,
+        and names of the systems
+        """
+        times, systems = self.times, self.systems
+        if byteorder == 'big':
+            times, systems = array('I', times), array('I', systems)
+            times.byteswap()
+            systems.byteswap()
+        return {
+            'times': times.tobytes(),
+            'systems': systems.tobytes(),
+            'names': list(self.names),
+        }
+
+    @classmethod
+    def restore(cls, data):
+        """
+        :argument data: dict with jumps data, see `dump`
+        :return: Jumps object
+        """
+        jumps = cls()
+        jumps.times.frombytes(data['times'])
+        jumps.systems.frombytes(data['systems'])
+        if byteorder == 'big':
+            jumps.times.byteswap()
+            jumps.systems.byteswap()
+        jumps.names = [intern(name) for name in data['names']]
+        jumps.ids = {name: i for i, name in enumerate(jumps.names)}
+        return jumps
+
+    def between(self, start=0, end=None):
+        """
+        :argument start: timestamp, inclusive
+        :argument end:   timestamp, exclusive, no limit if not provided
+        :return: range of indices of jumps made within the time range
+        """
+        first = bisect_left(self.times, start)
+        if end is None:
+            return range(first, len(self.times))
+        return range(first, bisect_left(self.times, end))
+
+    def journey(self, start=0, end=None):
+        """
+        :argument start: timestamp, inclusive
+        :argument end:   timestamp, exclusive, no limit if not provided
+        :return: iterator over [timestamp, system name] pairs of the jumps
+        made within the time range, the oldest first
+        """
+        times, systems, names = self.times, self.systems, self.names
+        return (
+            [times[i], names[systems[i]]] for i in self.between(start, end)
+        )
+
+
 class Router(object):
     """
     Keeps movement states, such as previous location,
     map tree and system interconnections. Builds and
     updates map tree, updates system interconnections.
+
+    Router is the authoritative owner of the user's map: every change
+    bumps its `version` and is recorded in the bounded `history`, so
+    front-end can ask for the changes since the version it has already
+    seen instead of uploading and downloading the whole map.
+
+    Map can be shared by the fleet, in that case router is stored under
+    the fleet's key instead of the user's id, and is fed by several pilots,
+    each of them having own location.
+
+    When application runs in several processes, only the process owning
+    the map changes it, copies of the map kept by the other processes
+    `apply` the changes it sends, see `wormhole_tracker.maps.Maps`.
     """
+    history_size = 1000  # How many last changes to keep for delta sync
+
     def __init__(self, user_id, app):
         self.user_id = user_id  # User's id, will be used to get user object
         self.application = app  # Application object
         self.previous = ""      # Player's location fetched on the last API call
-        self.connections = []   # List with tuples of system interconnections
-        self.systems = []       # List with all visited systems
-        self.recovery = {       # Storage for front-end data, for recovery
-            'nodes': [], 'links': [], 'current': ''
-        }
+        self.locations = {}     # Last locations of every pilot on the map
+        self.graph = Graph()    # Visited systems and their interconnections
+        self.positions = {}     # Positions of the nodes user has moved
+        self.version = 0        # Map version, increases on every change
+        self.history = deque(maxlen=self.history_size)  # Last changes
+        self.lifetimes = {}     # Last jump time and lifetime of every link
 
     async def _save(self):
         """
-        Save self to the user's object
+        Save self to the user's object, schedule saving to the storage
         """
         self.application.users.get(
             self.user_id, {}).update(
             {'router': self}
         )
+        self.application.users.save_map(self.user_id)
+
+    def dump(self):
+        """
+        :return: JSON-serializable dict with router state
+        """
+        return {
+            'previous': self.previous,
+            'locations': self.locations,
+            'graph': self.graph.dump(),
+            'positions': self.positions,
+            'version': self.version,
+            'lifetimes': [
+                [a, b, seen, lifetime]
+                for (a, b), (seen, lifetime) in self.lifetimes.items()
+            ],
+        }
+
+    @classmethod
+    def restore(cls, user_id, app, data):
+        """
+        Build router from the data produced by `Router.dump`.
+        Change history is not stored, so every front-end
+        will receive the full snapshot on the first sync.
+
+        :argument user_id: user's id
+        :argument app:     application object
+        :argument data:    dict with router state
+        :return: Router object
+        """
+        router = cls(user_id, app)
+        router.previous = data['previous']
+        router.locations = data.get('locations', {user_id: router.previous})
+        router.graph = Graph.restore(data['graph'])
+        router.positions = {
+            name: tuple(position)
+            for name, position in data['positions'].items()
+        }
+        router.version = data['version']
+        for a, b, seen, lifetime in data.get('lifetimes', ()):
+            router.lifetimes[(a, b)] = (seen, lifetime)
+        router.schedule()
+        return router
+
+    def schedule(self):
+        """
+        Schedule expiry of all links which have a lifetime.
+        """
+        for edge, (seen, lifetime) in self.lifetimes.items():
+            if lifetime:
+                self.application.sweeper.schedule(
+                    self.user_id, edge, seen + lifetime
+                )
 
-    async def update(self, current):
+    def _commit(self, change):
+        """
+        Stamp the `change` with the next map version and record it.
+
+        :argument change: dict with changed map data
+        :return: the same `change`
+        """
+        self.version += 1
+        change['version'] = self.version
+        self.history.append(change)
+        return change
+
+    async def update(self, current, pilot=None):
         """
         Check current location, update internal state if it
         is changed, return data for front-end graph drawing.
         
         :argument current: users's current in-game location
-        :return:  dict with `current` location, node and link info for D3.js
-
+        :argument pilot:   id of the user who is there, router's owner
+        if not provided
+        :return:  dict with `current` location of the `pilot`, node and link
+        info for D3.js and the new map `version`
         """
-        if self.previous != current:
-            result = {'current': current}
+        pilot = pilot or self.user_id
+        previous = self.locations.get(pilot, "")
+        if previous != current:
+            result = {'current': current, 'pilot': pilot}
 
             # Create star system `node`
-            if current not in self.systems:
-                self.systems.append(current)
+            if self.graph.add_system(current):
                 result['nodes'] = [{'name': current}]
 
-            # Create `link` between two systems
-            if self.previous:
-                if (self.previous, current) not in self.connections:
-                    if (current, self.previous) not in self.connections:
-                        self.connections.append((self.previous, current))
-                        result['links'] = [{
-                            'source': {'name': self.previous},
-                            'target': {'name': current}
-                        }]
+            # Create `link` between two systems, or keep the known one
+            # for its whole lifetime since this jump
+            if previous:
+                if self.graph.add_link(previous, current):
+                    result['links'] = [{
+                        'source': {'name': previous},
+                        'target': {'name': current}
+                    }]
+                self.track_link(previous, current)
+            self.locations[pilot] = current
             self.previous = current
+            self._commit(result)
             # Since router object has changed we need to update user data
             await self._save()
             return result
 
-    async def backup(self, data):
-        self.recovery = data
-        self.recovery['current'] = self.previous
-        await self._save()
+    def track_link(self, source, target):
+        """
+        Remember when the link has been jumped through for the last time,
+        schedule its expiry if links have a lifetime.
+        """
+        edge = Graph.edge(self.graph.ids[source], self.graph.ids[target])
+        seen = int(time())
+        lifetime = self.application.link_lifetime
+        self.lifetimes[edge] = (seen, lifetime)
+        if lifetime:
+            self.application.sweeper.schedule(
+                self.user_id, edge, seen + lifetime
+            )
+
+    async def expire(self, edges, now=None):
+        """
+        Remove links which lifetime has passed.
+
+        :argument edges: list of (system id, system id) tuples
+        :argument now:   timestamp, current time if not provided
+        :return: dict with `removed` links and the new map `version`,
+        None if nothing has changed
+        """
+        now = now or time()
+        removed = []
+        for edge in map(tuple, edges):
+            seen, lifetime = self.lifetimes.get(edge, (0, 0))
+            # Link may have been jumped through again meanwhile
+            if lifetime and seen + lifetime <= now:
+                del self.lifetimes[edge]
+                self.graph.remove_link(*edge)
+                source, target = (self.graph.names[i] for i in edge)
+                removed.append({
+                    'source': {'name': source}, 'target': {'name': target}
+                })
+        if removed:
+            result = self._commit({'removed': removed})
+            await self._save()
+            return result
+
+    async def move(self, nodes):
+        """
+        Save positions of the nodes user has moved on the front-end.
+
+        :argument nodes: list of dicts with `name`, `x` and `y` of moved nodes
+        :return: dict with accepted `positions` and the new map `version`,
+        None if nothing has changed
+        """
+        if not isinstance(nodes, list):
+            return
+        positions = []
+        for node in nodes:
+            try:
+                name = node['name']
+                position = (float(node['x']), float(node['y']))
+            except (KeyError, TypeError, ValueError):
+                continue
+            if name in self.graph and self.positions.get(name) != position:
+                self.positions[name] = position
+                positions.append({
+                    'name': name, 'x': position[0], 'y': position[1]
+                })
+        if positions:
+            result = self._commit({'positions': positions})
+            await self._save()
+            return result
+
+    def apply(self, change):
+        """
+        Apply the change made by the process owning the map.
+
+        :argument change: dict with changed map data, made by `update`,
+        `expire` or `move`
+        :return: False if the changes made before it are missing,
+        True otherwise
+        """
+        version = change['version']
+        if version <= self.version:
+            return True
+        if version > self.version + 1:
+            return False
+        graph = self.graph
+        for node in change.get('nodes', ()):
+            graph.add_system(node['name'])
+        for link in change.get('links', ()):
+            source, target = link['source']['name'], link['target']['name']
+            graph.add_link(source, target)
+        for link in change.get('removed', ()):
+            edge = Graph.edge(graph.ids[link['source']['name']],
+                              graph.ids[link['target']['name']])
+            self.lifetimes.pop(edge, None)
+            graph.remove_link(*edge)
+        for position in change.get('positions', ()):
+            self.positions[position['name']] = (position['x'], position['y'])
+        if 'pilot' in change:
+            pilot, current = change['pilot'], change['current']
+            previous = self.locations.get(pilot, "")
+            if previous:
+                self.track_link(previous, current)
+            self.locations[pilot] = self.previous = current
+        self.version = version
+        self.history.append(change)
+        return True
+
+    def since(self, version):
+        """
+        :argument version: map version
+        :return: list of changes made after the `version`, None if they
+        are not in the history anymore
+        """
+        if version >= self.version:
+            return []
+        if not self.history or version < self.history[0]['version'] - 1:
+            return None
+        start = version - self.history[0]['version'] + 1
+        return list(islice(self.history, start, None))
+
+    def changes(self, version, pilot=None):
+        """
+        Merge all changes made after the `version`.
+
+        :argument version: the last map version front-end has seen
+        :argument pilot:   id of the user front-end belongs to
+        :return: dict with `pilot`'s `current` location, new `nodes`,
+        `links`, `removed` links, `positions` and the actual map `version`,
+        None if the `version` is too old to be restored from the history
+        and full snapshot is needed
+        """
+        changes = self.since(version)
+        if changes is None:
+            return None
+        if not changes:
+            return {'version': self.version}
+
+        result = {'nodes': [], 'version': self.version}
+        positions = {}
+        links = {}
+        removed = {}
+        for change in changes:
+            result['nodes'].extend(change.get('nodes', ()))
+            # Only the last add or remove of the link matters
+            for link in change.get('links', ()):
+                key = frozenset((link['source']['name'],
+                                 link['target']['name']))
+                removed.pop(key, None)
+                links[key] = link
+            for link in change.get('removed', ()):
+                key = frozenset((link['source']['name'],
+                                 link['target']['name']))
+                links.pop(key, None)
+                removed[key] = link
+            for position in change.get('positions', ()):
+                positions[position['name']] = position
+        result['current'] = self.location(pilot)
+        result['links'] = list(links.values())
+        result['removed'] = list(removed.values())
+        result['positions'] = list(positions.values())
+        return result
+
+    def route(self, target, source=None, pilot=None):
+        """
+        :argument target: star system name
+        :argument source: star system name, `pilot`'s location if
+                          not provided
+        :argument pilot:  user id
+        :return: dict with `from` and `to` systems, the amount of `jumps`
+        and the `path` between them, None if there is no known path
+        """
+        source = source or self.location(pilot)
+        path = self.graph.paths.path(source, target)
+        if path is None:
+            return None
+        return {
+            'from': source,
+            'to': target,
+            'jumps': len(path) - 1,
+            'path': path,
+        }
+
+    def location(self, pilot=None):
+        """
+        :argument pilot: user id
+        :return: `pilot`'s last location on this map, the last location
+        of anybody if `pilot` is not provided
+        """
+        if pilot is None:
+            return self.previous
+        return self.locations.get(pilot, "")
+
+    def snapshot(self, pilot=None):
+        """
+        :argument pilot: id of the user front-end belongs to
+        :return: dict with the whole map for front-end recovery
+        """
+        nodes = [self._node(name) for name in self.graph.names]
+        links = [
+            {'source': {'name': source}, 'target': {'name': target}}
+            for source, target in self.graph.connections
+        ]
+        return {
+            'current': self.location(pilot),
+            'nodes': nodes,
+            'links': links,
+            'version': self.version,
+        }
+
+    def recovery(self, pilot=None, size=500):
+        """
+        The same map as `snapshot`, split into chunks of at most `size`
+        nodes, ordered by the distance from the pilot's current system,
+        so front-end can draw the nearest part of the map first.
+
+        Order is found and links are split between the chunks at once,
+        so every link comes with or after both of its nodes, but chunks
+        are only built when they are taken from the generator.
+
+        :argument pilot: id of the user front-end belongs to
+        :argument size:  maximum amount of nodes in a chunk
+        :return: generator of dicts, the first one has `current` location,
+        all have `nodes`, `links` and the map `version` they belong to
+        """
+        graph, version = self.graph, self.version
+        current = self.location(pilot)
+        order = graph.order(graph.ids.get(current))
+        rank = [0] * len(order)
+        for position, system_id in enumerate(order):
+            rank[system_id] = position
+        chunks = [[] for _ in range(max(len(order) - 1, 0) // size + 1)]
+        for a, b in graph.edges:
+            chunks[max(rank[a], rank[b]) // size].append((a, b))
+
+        for number, edges in enumerate(chunks):
+            chunk = {
+                'nodes': [
+                    self._node(graph.names[system_id])
+                    for system_id in order[number * size:(number + 1) * size]
+                ],
+                'links': [
+                    {
+                        'source': {'name': graph.names[a]},
+                        'target': {'name': graph.names[b]},
+                    }
+                    for a, b in edges
+                ],
+                'version': version,
+            }
+            if number == 0:
+                chunk['current'] = current
+            yield chunk
+
+    def _node(self, name):
+        node = {'name': name}
+        if name in self.positions:
+            node['x'], node['y'] = self.positions[name]
+            node['fixed'] = True
+        return node
 
     async def reset(self):
         """
         Reset routing info
+
+        :return: dict with the empty map for front-end recovery
         """
-        self.previous = ""
-        self.connections = []
-        self.systems = []
-        self.recovery = {}
+        # Keep version monotonic
+        self.clear(self.version + 1)
         await self._save()
+        return self.snapshot()
+
+    def clear(self, version):
+        """
+        Forget the whole map, and the history too, so every outdated
+        front-end will get the full snapshot.
+
+        :argument version: version of the empty map
+        """
+        self.previous = ""
+        self.locations = {}
+        self.graph = Graph()
+        self.positions = {}
+        self.lifetimes = {}
+        self.version = version
+        self.history.clear()
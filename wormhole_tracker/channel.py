@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of wormhole-tracker package released under
+# the GNU GPLv3 license. See the LICENSE file for more information.
+
+import logging
+import socket
+from os import getpid, listdir, makedirs, path, unlink
+from struct import Struct
+
+from tornado.escape import json_decode, json_encode, utf8
+from tornado.ioloop import IOLoop
+from tornado.iostream import (
+    IOStream, StreamBufferFullError, StreamClosedError
+)
+from tornado.netutil import add_accept_handler, bind_unix_socket
+
+_header = Struct('!I')  # Length of the notification which follows
+
+
+class Channel(object):
+    """
+    Cross-process notification channel.
+
+    Every worker process listens on its own Unix stream socket inside the
+    shared `directory`, publishing a notification means writing it to the
+    connection to every other socket found there. Connections are opened
+    on the first notification and kept, so every process receives
+    notifications of the other one in the order they were published.
+
+    Notifications are JSON documents prefixed with their length, so they
+    are never truncated, no matter how large the map change is. Received
+    notifications are decoded and passed to the `callback`.
+
+    Attributes:
+        peers: dict with socket addresses of other processes as keys and
+            IOStreams connected to them as values.
+
+        streams: set of IOStreams other processes have connected with.
+    """
+    max_size = 64 * 1024 * 1024  # Maximum notification size, in bytes
+    # Peer which does not read is disconnected past that many unsent bytes
+    max_buffer = 64 * 1024 * 1024
+
+    def __init__(self, directory, callback):
+        makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.callback = callback
+        self.address = self.locate(getpid())
+        self.peers = {}
+        self.streams = set()
+        # Stale socket file of the process with the same pid is replaced
+        self.socket = bind_unix_socket(self.address)
+        add_accept_handler(self.socket, self._on_accept)
+
+    def locate(self, pid):
+        """
+        :argument pid: id of the worker process
+        :return: address of the process' socket
+        """
+        return path.join(self.directory, f"{pid}.sock")
+
+    def _on_accept(self, connection, address):
+        stream = IOStream(connection, max_buffer_size=self.max_size)
+        self.streams.add(stream)
+        IOLoop.current().spawn_callback(self._receive, stream)
+
+    async def _receive(self, stream):
+        try:
+            while True:
+                size, = _header.unpack(await stream.read_bytes(_header.size))
+                if size > self.max_size:
+                    logging.error(f"Notification of {size} bytes is too large")
+                    stream.close()
+                    return
+                data = await stream.read_bytes(size)
+                try:
+                    self.callback(json_decode(data))
+                except Exception as e:
+                    logging.error(f"Failed to handle notification: {e}")
+        except StreamClosedError:
+            pass
+        finally:
+            self.streams.discard(stream)
+
+    def connect(self, address):
+        """
+        :argument address: socket address of the other process
+        :return: IOStream connected to it, None if it does not listen
+        """
+        connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        connection.setblocking(False)
+        try:
+            connection.connect(address)
+        except ConnectionRefusedError:
+            # Nobody listens there anymore, worker has died
+            logging.warning(f"Removing stale channel socket {address}")
+            connection.close()
+            try:
+                unlink(address)
+            except FileNotFoundError:
+                pass
+            return None
+        except BlockingIOError:
+            logging.warning(f"Channel socket {address} is busy")
+            connection.close()
+            return None
+        except OSError as e:
+            logging.warning(f"Failed to connect to {address}: {e}")
+            connection.close()
+            return None
+        stream = IOStream(connection, max_write_buffer_size=self.max_buffer)
+        stream.set_close_callback(lambda: self.forget(address, stream))
+        self.peers[address] = stream
+        return stream
+
+    def forget(self, address, stream):
+        if self.peers.get(address) is stream:
+            del self.peers[address]
+
+    def send(self, address, data):
+        """
+        Write the encoded notification to the other process.
+
+        :argument address: socket address of the other process
+        :argument data:    notification, prefixed with its length
+        :return: False if the process does not listen anymore
+        """
+        stream = self.peers.get(address) or self.connect(address)
+        if stream is None:
+            return path.exists(address)
+        try:
+            stream.write(data)
+        except StreamBufferFullError:
+            logging.warning(f"Disconnecting from {address}, it does not read")
+            stream.close()
+        except StreamClosedError:
+            self.forget(address, stream)
+            return False
+        return True
+
+    @classmethod
+    def encode(cls, notification):
+        """
+        :argument notification: JSON-serializable object
+        :return: encoded notification, prefixed with its length, None if
+        it is too large
+        """
+        data = utf8(json_encode(notification))
+        if len(data) > cls.max_size:
+            logging.error(f"Notification of {len(data)} bytes is too large")
+            return None
+        return _header.pack(len(data)) + data
+
+    def tell(self, pid, notification):
+        """
+        Send the `notification` to the single worker process.
+
+        :argument pid:          id of the worker process
+        :argument notification: JSON-serializable object
+        :return: False if the process does not listen anymore
+        """
+        data = self.encode(notification)
+        if data is None:
+            return True
+        return self.send(self.locate(pid), data)
+
+    def publish(self, notification):
+        """
+        Send the `notification` to all other worker processes.
+
+        :argument notification: JSON-serializable object
+        """
+        data = self.encode(notification)
+        if data is None:
+            return
+        for name in listdir(self.directory):
+            address = path.join(self.directory, name)
+            if address == self.address or not name.endswith('.sock'):
+                continue
+            self.send(address, data)
+
+    def close(self):
+        IOLoop.current().remove_handler(self.socket.fileno())
+        self.socket.close()
+        for stream in list(self.peers.values()) + list(self.streams):
+            stream.close()
+        if path.exists(self.address):
+            unlink(self.address)
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of wormhole-tracker package released under
+# the GNU GPLv3 license. See the LICENSE file for more information.
+
+from tornado.ioloop import IOLoop
+
+
+class Connections(object):
+    """
+    Registry of open websocket connections, indexed by character.
+
+    Both adding and removing the connection take constant time, and all
+    connections of the character can be found without scanning the rest.
+
+    Attributes:
+        users: dict with user ids as keys and sets of websocket handlers
+            as values.
+
+        opened: dict with websocket handlers as keys and (user id,
+            IOLoop time of opening) tuples as values, in opening order.
+    """
+    def __init__(self, app):
+        self.application = app
+        self.users = {}
+        self.opened = {}
+
+    def __len__(self):
+        return len(self.opened)
+
+    def __iter__(self):
+        return iter(self.opened)
+
+    def add(self, user_id, socket):
+        self.users.setdefault(user_id, set()).add(socket)
+        self.opened[socket] = (user_id, IOLoop.current().time())
+
+    def remove(self, socket):
+        """
+        Does nothing if the `socket` has never been added,
+        e.g. if it has been closed as unauthorized.
+        """
+        entry = self.opened.pop(socket, None)
+        if entry is not None:
+            sockets = self.users[entry[0]]
+            sockets.discard(socket)
+            if not sockets:
+                del self.users[entry[0]]
+
+    def sockets(self, user_id):
+        """
+        :argument user_id: user id
+        :return: set of the character's websocket handlers
+        """
+        return self.users.get(user_id, set())
+
+    def per_user(self):
+        """
+        :return: dict with user ids as keys and amounts of
+        their connections as values
+        """
+        return {
+            user_id: len(sockets) for user_id, sockets in self.users.items()
+        }
+
+    def tracking(self):
+        """
+        :return: amount of connections tracking their characters
+        """
+        return sum(map(len, self.application.poller.subscribers.values()))
+
+    def idle(self):
+        """
+        :return: amount of connections which are not tracking
+        """
+        return len(self) - self.tracking()
+
+    def oldest(self):
+        """
+        :return: tuple with the oldest websocket handler, its user id and
+        IOLoop time of opening, None if there are no connections
+        """
+        for socket, (user_id, opened) in self.opened.items():
+            return socket, user_id, opened
+        return None
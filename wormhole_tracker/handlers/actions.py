@@ -20,7 +20,7 @@ class SigninHandler(BaseHandler):
         Redirects user to app's authorization page at EVE Online site;
         After providing credentials there, user being redirected to our /auth.
         """
-        login_eveonline = "https://login.eveonline.com/oauth/authorize/?"
+        login_eveonline = self.application.sso_url + "/oauth/authorize/?"
 
         # Generate state token and store it in the `state_storage`, this
         # way we will accept only our redirected users (CSRF protection)
@@ -59,7 +59,9 @@ class AuthHandler(BaseHandler):
             # user object from all handlers
             user_id = await self.authorize(code)
             if user_id:
-                self.set_secure_cookie("auth_cookie", user_id)
+                self.set_secure_cookie(
+                    "auth_cookie", self.application.sessions.start(user_id)
+                )
             self.redirect('/')
         else:
             # Restrict access if not.
@@ -69,5 +71,8 @@ class AuthHandler(BaseHandler):
 
 class SignoutHandler(BaseHandler):
     async def get(self, *args, **kwargs):
+        # Sign out other tabs with the same session too
+        if self.current_user:
+            self.application.sessions.end(self.current_user)
         self.clear_cookie("auth_cookie")
         self.redirect('/sign')
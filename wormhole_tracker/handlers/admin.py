@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of wormhole-tracker package released under
+# the GNU GPLv3 license. See the LICENSE file for more information.
+
+from os import getpid
+from time import time
+
+from tornado.options import options
+from tornado.web import HTTPError
+
+from wormhole_tracker.auxiliaries import authenticated
+from wormhole_tracker.handlers.base_request import BaseHandler
+
+
+class ProfileHandler(BaseHandler):
+    @authenticated
+    async def get(self, *args, **kwargs):
+        """
+        Profile the worker process handling the request for the given
+        amount of `seconds` and return collapsed stacks, admins only.
+        """
+        if self.user_id not in options.admins:
+            raise HTTPError(403)
+        try:
+            seconds = float(self.get_argument('seconds', '10'))
+        except ValueError:
+            raise HTTPError(400)
+        try:
+            stacks = await self.application.profiler.profile(seconds)
+        except RuntimeError as e:
+            self.set_status(409)
+            self.write(str(e))
+            return
+        filename = f"wormhole-tracker-{getpid()}-{int(time())}.collapsed"
+        self.set_header('Content-Type', 'text/plain')
+        self.set_header(
+            'Content-Disposition', f'attachment; filename="{filename}"'
+        )
+        self.write(stacks)
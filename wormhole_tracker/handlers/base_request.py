@@ -5,8 +5,6 @@
 
 from tornado.web import RequestHandler
 
-from wormhole_tracker.auxiliaries import s
-
 
 class BaseHandler(RequestHandler):
     @property
@@ -18,8 +16,8 @@ class BaseHandler(RequestHandler):
         return self.application.client_key
 
     @property
-    def vagrants(self):
-        return self.application.vagrants
+    def connections(self):
+        return self.application.connections
 
     @property
     def state_storage(self):
@@ -29,13 +27,24 @@ class BaseHandler(RequestHandler):
     def crud(self):
         return self.application.crud
 
+    def get_current_user(self):
+        """
+        Verify the auth cookie only once per request, see `current_user`.
+
+        :return: Session object, None if user is not signed in
+        """
+        return self.application.sessions.resolve(
+            self.get_secure_cookie("auth_cookie")
+        )
+
     @property
     def user_id(self):
-        return s(self.get_secure_cookie("auth_cookie"))
+        session = self.current_user
+        return session.user_id if session else None
 
     @property
     def user(self):
-        return self.application.users.get(self.user_id)
+        return self.application.users.touch(self.user_id)
 
     @property
     def authorize(self):
@@ -48,3 +57,19 @@ class BaseHandler(RequestHandler):
     @property
     def spawn(self):
         return self.application.spawn
+
+    @property
+    def poller(self):
+        return self.application.poller
+
+    @property
+    def notify(self):
+        return self.application.notify
+
+    @property
+    def rooms(self):
+        return self.application.rooms
+
+    @property
+    def metrics(self):
+        return self.application.metrics
@@ -4,14 +4,76 @@
 # the GNU GPLv3 license. See the LICENSE file for more information.
 
 import logging
+from collections import deque
 
-from tornado.escape import json_encode
-from tornado.websocket import WebSocketHandler
+from tornado import gen
+from tornado.iostream import StreamClosedError
+from tornado.locks import Event
+from tornado.websocket import WebSocketClosedError, WebSocketHandler
 
-from wormhole_tracker.auxiliaries import s
+from wormhole_tracker.protocol import COMPACT, encode
 
 
 class BaseSocketHandler(WebSocketHandler):
+    """
+    Attributes:
+        compact: True if the client has negotiated the compact binary
+            protocol, see `wormhole_tracker.protocol`.
+
+        pending: amount of bytes written since the write buffer was
+            flushed the last time.
+
+        flushing: Future of the latest write, resolved when the
+            whole write buffer is flushed.
+
+        drained: tornado.locks.Event set while the buffer is flushed.
+
+        version: version of the last map sent to the client.
+
+        behind: True if map updates were skipped, since the client
+            did not manage to receive the earlier ones.
+
+        holding: True while the map is being sent in chunks, or a large
+            message is being encoded, map updates are skipped meanwhile
+            too, since they would overtake it.
+
+        outbox: deque of [frame, message] entries waiting for the large
+            message at its head, which is still being encoded and has no
+            frame yet, so messages are written in the order they are sent.
+
+    Updates are only written while the client keeps up with them, past
+    the `buffer_threshold` they are skipped and the client gets all of
+    them at once, as a single 'sync' message, when the buffer is
+    flushed. Client which does not receive anything is disconnected
+    once its buffer would grow past the `buffer_limit`, so a slow
+    connection can not make the server hold more than that.
+    """
+    compact = False
+    buffer_threshold = 256 * 1024
+    buffer_limit = 4 * 1024 * 1024
+    recovery_chunk = 500  # How many nodes to send in a single map chunk
+
+    def __init__(self, *args, **kwargs):
+        super(BaseSocketHandler, self).__init__(*args, **kwargs)
+        self.pending = 0
+        self.flushing = None
+        self.drained = Event()
+        self.drained.set()
+        self.version = None
+        self.behind = False
+        self.holding = False
+        self.outbox = deque()
+
+    def select_subprotocol(self, subprotocols):
+        """
+        Clients which do not ask for the compact protocol keep receiving
+        plain JSON messages.
+        """
+        if COMPACT in subprotocols:
+            self.compact = True
+            return COMPACT
+        return None
+
     @property
     def client_id(self):
         return self.application.client_id
@@ -21,8 +83,8 @@ class BaseSocketHandler(WebSocketHandler):
         return self.application.client_key
 
     @property
-    def vagrants(self):
-        return self.application.vagrants
+    def connections(self):
+        return self.application.connections
 
     @property
     def state_storage(self):
@@ -32,13 +94,24 @@ class BaseSocketHandler(WebSocketHandler):
     def crud(self):
         return self.application.crud
 
+    def get_current_user(self):
+        """
+        Verify the auth cookie only once per connection, see `current_user`.
+
+        :return: Session object, None if user is not signed in
+        """
+        return self.application.sessions.resolve(
+            self.get_secure_cookie("auth_cookie")
+        )
+
     @property
     def user_id(self):
-        return s(self.get_secure_cookie("auth_cookie"))
+        session = self.current_user
+        return session.user_id if session else None
 
     @property
     def user(self):
-        return self.application.users.get(self.user_id)
+        return self.application.users.touch(self.user_id)
 
     @property
     def authorize(self):
@@ -52,8 +125,175 @@ class BaseSocketHandler(WebSocketHandler):
     def spawn(self):
         return self.application.spawn
 
+    @property
+    def poller(self):
+        return self.application.poller
+
+    @property
+    def notify(self):
+        return self.application.notify
+
+    @property
+    def rooms(self):
+        return self.application.rooms
+
+    @property
+    def maps(self):
+        return self.application.maps
+
+    @property
+    def metrics(self):
+        return self.application.metrics
+
+    @property
+    def serializer(self):
+        return self.application.serializer
+
+    @property
+    def map_key(self):
+        return self.application.map_key(self.user_id)
+
+    @property
+    def router(self):
+        return self.application.router(self.user_id)
+
     async def safe_write(self, message):
+        """
+        Write the `message`, and wait until the client receives it if
+        the client is falling behind, so the tasks writing a lot, like
+        the replay, go at the client's pace.
+
+        Large messages are encoded outside of the IOLoop, see
+        `wormhole_tracker.serializer.Serializer`.
+        """
+        if self.serializer.inline(message, self.compact):
+            self.safe_send(encode(message, self.compact), message)
+        else:
+            # Messages sent meanwhile wait for this one in the outbox
+            entry = [None, message]
+            self.outbox.append(entry)
+            holding, self.holding = self.holding, True
+            try:
+                entry[0] = await self.serializer.encode(message, self.compact)
+            except Exception:
+                self.outbox.remove(entry)
+                raise
+            finally:
+                self.holding = holding
+                self.send_encoded()
+        if self.behind and not self.holding and (
+          self.pending <= self.buffer_threshold):
+            self.catch_up()
+        if self.pending > self.buffer_threshold:
+            await self.drained.wait()
+
+    def safe_send(self, frame, message=None):
+        """
+        Write already encoded message, see `wormhole_tracker.protocol.encode`.
+
+        :argument frame:   tuple with encoded message and the binary flag
+        :argument message: the message itself, map updates are skipped
+                           while the client is behind
+        """
+        if self.outbox:
+            # Earlier message is still being encoded
+            self.outbox.append([frame, message])
+            return
+        self._send(frame, message)
+
+    def send_encoded(self):
+        """
+        Write messages waiting in the outbox, up to the next one which
+        is still being encoded.
+        """
+        while self.outbox and self.outbox[0][0] is not None:
+            self._send(*self.outbox.popleft())
+
+    def _send(self, frame, message=None):
         if self.ws_connection is None:
             logging.error('Connection is already closed.')
+            return
+        kind, content = message if message is not None else (None, None)
+        if kind == 'update' and (self.behind or self.holding or
+                                 self.pending > self.buffer_threshold):
+            if not self.behind:
+                logging.info(f"{self.request.remote_ip} is behind, "
+                             f"skipping map updates.")
+                self.behind = True
+            self.metrics.skipped.inc()
+            return
+        data, binary = frame
+        if self.pending and self.pending + len(data) > self.buffer_limit:
+            logging.warning(f"Closing connection of {self.request.remote_ip}, "
+                            f"{self.pending} bytes are not received.")
+            self.metrics.slow_closed.inc()
+            self.close()
+            return
+        if isinstance(content, dict) and 'version' in content:
+            self.version = content['version']
+        try:
+            future = self.write_message(data, binary=binary)
+        except (StreamClosedError, WebSocketClosedError):
+            logging.error('Connection is already closed.')
+            return
+        self.metrics.sent.inc(amount=len(data))
+        self.pending += len(data)
+        self.drained.clear()
+        # Only the latest write's future is resolved by the stream,
+        # once everything written before is flushed too
+        self.flushing = future
+        future.add_done_callback(self.on_flushed)
+
+    def on_flushed(self, future):
+        if future is not self.flushing:
+            return
+        self.flushing = None
+        self.pending = 0
+        self.drained.set()
+        if future.exception() is None and self.behind and (
+          not self.holding):
+            self.catch_up()
+
+    def catch_up(self):
+        """
+        Send all map changes skipped while the client was behind, or
+        the whole map, see `recover`, if they are not in the history
+        anymore.
+        """
+        self.behind = False
+        changes = None
+        if self.version is not None:
+            changes = self.router.changes(self.version, self.user_id)
+        if changes is None:
+            # Updates coming before the first chunk would overtake it
+            self.holding = True
+            self.spawn(self.recover)
         else:
-            self.write_message(json_encode(message))
+            message = ['sync', changes]
+            self.safe_send(encode(message, self.compact), message)
+
+    async def recover(self):
+        """
+        Send the whole map in chunks, nearest to the current system first,
+        see `Router.recovery`. The first chunk is the 'recover' message,
+        which makes front-end clear the old map and draw right away, the
+        rest come as 'sync' messages on the next IOLoop iterations.
+
+        Map updates are skipped while chunks are being sent, and come
+        all at once after the last chunk, see `catch_up`.
+        """
+        self.holding = True
+        try:
+            kind = 'recover'
+            chunks = self.router.recovery(self.user_id, self.recovery_chunk)
+            for chunk in chunks:
+                if self.ws_connection is None:
+                    return
+                await self.safe_write([kind, chunk])
+                kind = 'sync'
+                # Let other callbacks run between chunks
+                await gen.moment
+        finally:
+            self.holding = False
+        if self.behind and self.pending <= self.buffer_threshold:
+            self.catch_up()
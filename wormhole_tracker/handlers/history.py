@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of wormhole-tracker package released under
+# the GNU GPLv3 license. See the LICENSE file for more information.
+
+from tornado.web import HTTPError
+
+from wormhole_tracker.auxiliaries import authenticated
+from wormhole_tracker.handlers.base_request import BaseHandler
+
+
+class HistoryHandler(BaseHandler):
+    @authenticated
+    async def get(self, *args, **kwargs):
+        """
+        Jumps of the pilot made since the `since` and before the `until`
+        timestamps, whichever maps they were made on. Pilot is the signed
+        in user if not provided, otherwise has to be on the map user is
+        viewing.
+        """
+        pilot = self.get_argument('pilot', self.user_id)
+        try:
+            start = float(self.get_argument('since', '0'))
+            end = self.get_argument('until', None)
+            end = None if end is None else float(end)
+        except ValueError:
+            raise HTTPError(400)
+        router = self.application.router(self.user_id)
+        if pilot != self.user_id and pilot not in router.locations:
+            raise HTTPError(403)
+        jumps = self.application.jumps(pilot)
+        journey = jumps.journey(start, end) if jumps is not None else ()
+        self.write({'pilot': pilot, 'jumps': list(journey)})
@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of wormhole-tracker package released under
+# the GNU GPLv3 license. See the LICENSE file for more information.
+
+from ipaddress import ip_address
+
+from tornado.options import options
+from tornado.web import HTTPError
+
+from wormhole_tracker.handlers.base_request import BaseHandler
+
+
+class MetricsHandler(BaseHandler):
+    def get(self):
+        """
+        Metrics of the worker process handling the request,
+        in the Prometheus text format, for local scrapers and admins only.
+        """
+        if not self.local and self.user_id not in options.admins:
+            raise HTTPError(403)
+        self.set_header('Content-Type', 'text/plain; version=0.0.4')
+        self.write(self.metrics.render())
+
+    @property
+    def local(self):
+        """
+        :return: True if the request comes from the same host
+        """
+        try:
+            return ip_address(self.request.remote_ip).is_loopback
+        except ValueError:
+            return False
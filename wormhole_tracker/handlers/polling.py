@@ -4,12 +4,36 @@
 # the GNU GPLv3 license. See the LICENSE file for more information.
 
 import logging
+from itertools import islice
+from secrets import compare_digest, token_hex
 
-from tornado.escape import json_decode
-from tornado.ioloop import PeriodicCallback
-from tornado.queues import Queue
+from tornado import gen
+from tornado.locks import Lock
 
+from wormhole_tracker.auxiliaries import Router
 from wormhole_tracker.handlers.base_socket import BaseSocketHandler
+from wormhole_tracker.protocol import encode, loads
+from wormhole_tracker.tasks import Tasks
+
+
+def merge_moves(waiting, task):
+    """
+    Merge two 'move' tasks of the same map, newer positions of the same
+    nodes win. Tasks of different maps are never merged, see
+    `PollingHandler.task`.
+    """
+    (_, older), room = waiting
+    (_, newer), new_room = task
+    if room != new_room:
+        return task
+    if not isinstance(older, list) or not isinstance(newer, list):
+        return task
+    names = {node.get('name') for node in newer if isinstance(node, dict)}
+    nodes = newer + [
+        node for node in older
+        if isinstance(node, dict) and node.get('name') not in names
+    ]
+    return ['move', nodes[:PollingHandler.max_moved]], room
 
 
 class PollingHandler(BaseSocketHandler):
@@ -17,49 +41,49 @@ class PollingHandler(BaseSocketHandler):
     This class represents separate websocket connection.
     
     Attributes:
-        tracker: tornado.ioloop.PeriodicCallback with get_location method as a
-            callback. Starts when user pushes "track" button. When started, it
-            runs every 5 seconds to find out and update character's location.
-            
-        q: tornado.queues.Queue used for running tasks successively.
-        
-        updating: A flag indicates if router is being updated or not. Required
-            to avoid race conditions.
+        q: wormhole_tracker.tasks.Tasks used for running tasks
+            successively, see `lanes`.
+
+        room: key of the map this connection is viewing, either user's own
+            or fleet's one.
+
+        decoding: amount of received messages waiting to be decoded
+            outside of the IOLoop, see `receive`.
+
+    Location polling itself is done by the application-wide `self.poller`,
+    connection only subscribes to its character's updates when user pushes
+    "track" button, and unsubscribes on "stop".
     """
+    replay_chunk = 500  # How many jumps to send in a single replay message
+    max_moved = 1000  # How many node positions a merged 'move' may keep
+
+    # Lane and coalescing key of every command. Tracking commands jump
+    # ahead of everything, map requests go before positions of dragged
+    # nodes, which are sent by the front-end in bulk. Waiting command
+    # with the same key is replaced by the newer one, so only the latest
+    # of "track" and "stop" is done, and only one 'sync' is ever waiting.
+    # Every 'replay' and 'route' is answered, since they ask different
+    # questions.
+    lanes = {
+        'track': (0, 'tracking'),
+        'stop': (0, 'tracking'),
+        'reset': (0, 'reset'),
+        'recover': (1, 'recover'),
+        'sync': (1, 'sync'),
+        'fleet': (1, 'fleet'),
+        'replay': (1, None),
+        'route': (1, None),
+        'move': (2, 'move'),
+    }
+
+    plain = ('track', 'stop', 'reset', 'recover')
+
     def __init__(self, *args, **kwargs):
         super(PollingHandler, self).__init__(*args, **kwargs)
-        # Set Tornado PeriodicCallback with our self.track, we
-        # will use launch it later on track/untrack commands
-        self.tracker = PeriodicCallback(self.get_location, 5000)
-        self.q = Queue(maxsize=5)
-        self.updating = False
-
-    async def get_location(self):
-        """
-        The callback for the `self.tracker`.
-        
-        Makes an API call, updates router and sends updated data to the
-        front-end.
-        """
-        # Call API to find out current character location
-        location = await self.character(self.user_id, '/location/', 'GET')
-
-        if location:
-            # Set `updating` flag to not accept periodic updates
-            # from front-end, to not overwrite new data
-            self.updating = True
-            user = self.user
-            graph_data = await user['router'].update(
-                location['solarSystem']['name']
-            )
-            if graph_data:
-                message = ['update', graph_data]
-                logging.warning(graph_data)
-                await self.safe_write(message)
-            self.updating = False
-        else:
-            message = ['warning', 'Log into game to track your route']
-            await self.safe_write(message)
+        self.q = Tasks(lanes=3, limit=8)
+        self.room = None
+        self.decoding = 0
+        self.decoding_lock = Lock()
 
     async def scheduler(self):
         """
@@ -71,67 +95,246 @@ class PollingHandler(BaseSocketHandler):
         Since we have no guarantee of the order of the incoming messages
         (new message from front-end can come before current is done),
         we need to ensure all tasks to run successively.
-        Here comes the asynchronous generator.
+        Here comes the asynchronous generator, it ends when the
+        connection is closed.
+
+        Every task comes with the room it was sent for, since the
+        "fleet" command can switch the map before the earlier commands
+        are done.
         """
         logging.info(f"Scheduler started for {self.request.remote_ip}")
 
         # Wait on each iteration until there's actually an item available
-        async for item in self.q:
+        async for item, room in self.q:
             logging.debug(f"Started resolving task for {item}...")
-            user = self.user
+            if not self.application.sessions.valid(self.current_user):
+                # Signed out meanwhile
+                self.close()
+                break
+            router = self.router
             try:
                 if item == 'recover':
                     # Send saved route
-                    await self.safe_write(['recover', user['router'].recovery])
+                    await self.recover()
 
                 elif item == 'track':
-                    # Start the PeriodicCallback
-                    if not self.tracker.is_running():
-                        self.tracker.start()
+                    # Subscribe to the character's location updates
+                    self.poller.subscribe(self.user_id, self)
 
                 elif item in ['stop', 'reset']:
-                    # Stop the PeriodicCallback
-                    if self.tracker.is_running():
-                        self.tracker.stop()
+                    # Unsubscribe from the character's location updates
+                    self.poller.unsubscribe(self.user_id, self)
                     # Clear all saved data
                     if item == 'reset':
-                        await user['router'].reset()
+                        if not self.may_reset():
+                            await self.safe_write(['warning', (
+                                'Only the pilot who has shared '
+                                'the map can reset it'
+                            )])
+                            # Front-end has cleared the map already
+                            await self.recover()
+                            continue
+                        # Everybody viewing the map has to clear it
+                        await self.maps.change(
+                            self.room, 'reset', kind='recover'
+                        )
+
+                elif item[0] == 'move':
+                    # Save positions of the nodes user has dragged, send
+                    # them to everybody viewing the map with the new version
+                    if room != self.room:
+                        continue
+                    await self.maps.change(self.room, 'move', item[1])
+
+                elif item[0] == 'sync':
+                    # Send changes made since the front-end's map version,
+                    # or the whole map if they are not in the history anymore
+                    version = item[1] if isinstance(item[1], int) else 0
+                    if room != self.room:
+                        version = 0
+                    changes = router.changes(version, self.user_id)
+                    if changes is None:
+                        await self.recover()
+                    else:
+                        await self.safe_write(['sync', changes])
 
-                elif item[0] == 'backup':
-                    # Do not overwrite user object while it's updating,
-                    # just in case, to avoid race conditions.
-                    if not self.updating:
-                        await user['router'].backup(item[1])
+                elif item[0] == 'replay':
+                    # Stream pilot's jumps made within the time range in
+                    # chunks, the last one is marked as done
+                    query = item[1] if isinstance(item[1], dict) else {}
+                    pilot = str(query.get('pilot', self.user_id))
+                    start, end = query.get('since', 0), query.get('until')
+                    if pilot != self.user_id and (
+                      pilot not in router.locations):
+                        continue
+                    if isinstance(start, (int, float)) and (
+                      end is None or isinstance(end, (int, float))):
+                        jumps = self.application.jumps(pilot)
+                        journey = iter(
+                            jumps.journey(start, end) if jumps else ()
+                        )
+                        while True:
+                            jumps = list(islice(journey, self.replay_chunk))
+                            done = len(jumps) < self.replay_chunk
+                            await self.safe_write(['replay', {
+                                'pilot': pilot, 'jumps': jumps, 'done': done
+                            }])
+                            if done:
+                                break
+                            # Let other callbacks run between chunks
+                            await gen.moment
+
+                elif item[0] == 'route':
+                    # Shortest known path to the system, from the pilot's
+                    # location unless the other start is given
+                    query = item[1] if isinstance(item[1], dict) else {}
+                    target, source = query.get('to'), query.get('from')
+                    if isinstance(target, str) and (
+                      source is None or isinstance(source, str)):
+                        route = router.route(target, source, self.user_id)
+                        await self.safe_write(['route', route or {
+                            'from': source or router.location(self.user_id),
+                            'to': target,
+                            'jumps': None,
+                            'path': None,
+                        }])
+
+                elif item[0] == 'fleet':
+                    # Switch to the fleet's shared map, or back to own one
+                    invite = item[1]
+                    if invite is None or (
+                      isinstance(invite, str) and len(invite) <= 64):
+                        await self.fleet(invite)
             finally:
-                self.q.task_done()
                 logging.debug(f'Task "{item}" done.')
 
-    async def task(self, item):
+    async def fleet(self, invite):
+        """
+        Start the new fleet, join the fleet, or leave it.
+
+        Fleet map is shared by the invite, which only the pilot starting
+        the fleet gets at first, so the map can only be viewed and fed by
+        the pilots this one has passed the invite to, and only this one
+        can reset it. Fleet's owner and invite are kept in the fleet's
+        entry of the users storage, along with the map.
+
+        :argument invite: "<fleet id>:<secret>" string to join the fleet,
+        empty string to start the new one, None to go back to own map
+        """
+        users = self.application.users
+        user = self.user
+        if invite is None:
+            user.pop('fleet', None)
+        elif not invite:
+            fleet_id = token_hex(8)
+            key = 'fleet:' + fleet_id
+            users[key] = {
+                'router': Router(key, self.application),
+                'owner': self.user_id,
+                'invite': f"{fleet_id}:{token_hex(16)}",
+            }
+            users.save(key)
+            user['fleet'] = fleet_id
+        else:
+            fleet_id = invite.partition(':')[0]
+            fleet = users.get('fleet:' + fleet_id) if fleet_id else None
+            if fleet is None or not compare_digest(
+                    fleet.get('invite', '').encode(), invite.encode()):
+                await self.safe_write(['warning', 'Invalid fleet invite'])
+                return
+            user['fleet'] = fleet_id
+        users.save(self.user_id)
+        self.notify(evict=self.user_id)
+        self.join()
+        self.send_fleet()
+        await self.recover()
+
+    def send_fleet(self):
+        """
+        Let the front-end know the invite of the fleet user is in, if any.
+        """
+        fleet = self.application.users.get(self.room) or {}
+        message = ['fleet', {'invite': fleet.get('invite')}]
+        self.safe_send(encode(message, self.compact), message)
+
+    def may_reset(self):
+        """
+        :return: True if user may reset the map user is viewing, either
+        own one or the fleet's one user has shared
+        """
+        if self.room == self.user_id:
+            return True
+        fleet = self.application.users.get(self.room) or {}
+        return fleet.get('owner') == self.user_id
+
+    def task(self, item):
         """
         Intermediary between `self.on_message` and `self.scheduler`.
         
-        Since we cannot do anything asynchronous in the `self.on_message`,
-        this method can handle any additional non-blocking stuff if we need it.
-        
+        Puts the item into its lane of the queue, see `lanes`. Unknown
+        commands and items coming while their lane is full are dropped,
+        instead of piling up for the flooding front-end.
+
         :argument item: item to pass to the `self.scheduler`.
         """
-        await self.q.put(item)
-        #await self.q.join()
+        if isinstance(item, str):
+            # Commands without arguments
+            command = item if item in self.plain else None
+        elif isinstance(item, list) and len(item) == 2 and (
+          isinstance(item[0], str) and item[0] not in self.plain):
+            command = item[0]
+        else:
+            command = None
+        if command not in self.lanes:
+            self.metrics.dropped.inc('unknown')
+            logging.warning(f'Task "{item}" dropped, unknown command.')
+            return
+        lane, key = self.lanes[command]
+        coalesced = self.q.coalesced
+        merge = None
+        if command == 'move':
+            # Moves are merged per map, moves made before
+            # switching the map are still done on their own
+            key, merge = (key, self.room), merge_moves
+        if not self.q.put((item, self.room), lane, key, merge):
+            self.metrics.dropped.inc('full')
+            logging.warning(f'Task "{item}" dropped, queue is full.')
+        elif self.q.coalesced > coalesced:
+            self.metrics.coalesced.inc(command)
+
+    def get_compression_options(self):
+        """
+        Negotiate permessage-deflate with clients which support it,
+        map messages are highly repetitive and compress well.
+        """
+        return {}
+
+    def join(self):
+        """
+        Start receiving updates of the map user is viewing now.
+        """
+        if self.room is not None:
+            self.rooms.leave(self.room, self)
+        self.room = self.map_key
+        self.rooms.join(self.room, self)
 
     def open(self):
         """
         Triggers on successful websocket connection.
         
         Ensures user is authorized, spawns `self.scheduler` for user
-        tasks, adds this websocket object to the connections pool,
-        spawns the recovery of the saved route.
+        tasks, adds this websocket object to the connections pool and
+        to the room of the map user is viewing, spawns the recovery of
+        the saved route.
         """
         logging.info(f"Connection received from {self.request.remote_ip}")
-        if self.user_id:
+        if self.user:
             self.spawn(self.scheduler)
-            self.vagrants.append(self)
+            self.connections.add(self.user_id, self)
+            self.join()
+            self.send_fleet()
 
-            self.spawn(self.task, 'recover')
+            self.task('recover')
         else:
             self.close()
 
@@ -144,17 +347,39 @@ class PollingHandler(BaseSocketHandler):
         Receives user commands and passes them
         to the `self.scheduler` via `self.task`.
         """
-        self.spawn(self.task, json_decode(message))
+        self.metrics.received.inc(amount=len(message))
+        if self.decoding or len(message) >= self.serializer.decode_threshold:
+            self.decoding += 1
+            self.spawn(self.receive, message)
+        else:
+            self.task(loads(message))
+
+    async def receive(self, message):
+        """
+        Decode large message outside of the IOLoop. Messages coming
+        meanwhile wait for it, so commands are queued in the order
+        front-end has sent them.
+
+        :argument message: front-end message.
+        """
+        try:
+            async with self.decoding_lock:
+                self.task(await self.serializer.decode(message))
+        finally:
+            self.decoding -= 1
 
     def on_close(self):
         """
         Triggers on closed websocket connection.
         
-        Removes this websocket object from the connections pool,
-        stops `self.tracker` if it is running.
+        Removes this websocket object from the connections pool and
+        from the map's room, unsubscribes it from the character's
+        location updates.
         """
-        self.vagrants.remove(self)
-        if self.tracker.is_running():
-            self.tracker.stop()
+        self.connections.remove(self)
+        self.q.close()
+        if self.room is not None:
+            self.rooms.leave(self.room, self)
+        self.poller.unsubscribe(self.user_id, self)
         logging.info("Connection closed, " + self.request.remote_ip)
 
@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of wormhole-tracker package released under
+# the GNU GPLv3 license. See the LICENSE file for more information.
+
+from tornado.web import HTTPError
+
+from wormhole_tracker.auxiliaries import authenticated
+from wormhole_tracker.handlers.base_request import BaseHandler
+
+
+class RouteHandler(BaseHandler):
+    @authenticated
+    async def get(self, *args, **kwargs):
+        """
+        Shortest known path on the map user is viewing, from the `from`
+        system to the `to` one. Path starts at the pilot's location if
+        `from` is not provided, pilot is the signed in user if not
+        provided either.
+        """
+        target = self.get_argument('to')
+        source = self.get_argument('from', None)
+        pilot = self.get_argument('pilot', self.user_id)
+        router = self.application.router(self.user_id)
+        route = router.route(target, source, pilot)
+        if route is None:
+            raise HTTPError(404)
+        self.write(route)
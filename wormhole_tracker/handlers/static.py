@@ -0,0 +1,21 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of wormhole-tracker package released under
+# the GNU GPLv3 license. See the LICENSE file for more information.
+
+from tornado.web import StaticFileHandler
+
+
+class StaticHandler(StaticFileHandler):
+    """
+    Static files, for the deployments without nginx in front.
+
+    Built assets (see `wormhole_tracker.assets`) have their content hash
+    in the names, so they are cached forever like the versioned files.
+    """
+    def get_cache_time(self, path, modified, mime_type):
+        if path.startswith('dist/'):
+            return self.CACHE_MAX_AGE
+        return super(StaticHandler, self).get_cache_time(
+            path, modified, mime_type
+        )
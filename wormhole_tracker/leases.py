@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of wormhole-tracker package released under
+# the GNU GPLv3 license. See the LICENSE file for more information.
+
+import logging
+from os import getpid
+from time import time
+
+from tornado.ioloop import PeriodicCallback
+
+
+class Leases(object):
+    """
+    Leases held by this process, polling leases of characters and
+    ownership leases of maps, kept in memory.
+
+    Storage is only asked for the lease this process does not hold yet,
+    or whose renewal is overdue. Held leases are renewed in the background
+    once a third of their lifetime has passed, so neither polls nor map
+    changes wait for the storage while the lease is held. Leases which
+    have not been used for half of their lifetime are not renewed, and
+    are let to lapse, so other processes can take them over.
+
+    Attributes:
+        held: dict with lease names as keys and [renewal timestamp,
+            lifetime, last use timestamp] lists as values.
+
+        timer: tornado.ioloop.PeriodicCallback with `renew` method as
+            a callback.
+    """
+    def __init__(self, app, period=5):
+        self.application = app
+        self.held = {}
+        self.timer = PeriodicCallback(self.renew, period * 1000)
+
+    @property
+    def storage(self):
+        return self.application.users.storage
+
+    def __contains__(self, name):
+        return name in self.held
+
+    def hold(self, name, ttl):
+        """
+        Take the lease, if it is free, or make sure it is still held.
+
+        :argument name: lease name
+        :argument ttl:  lease lifetime, in seconds
+        :return: True if this process holds the lease, False otherwise
+        """
+        now = time()
+        lease = self.held.get(name)
+        if lease is not None and now < lease[0] + ttl * 2 / 3:
+            lease[2] = now
+            return True
+        if not self.storage.lease(name, getpid(), ttl):
+            self.held.pop(name, None)
+            return False
+        self.held[name] = [now, ttl, now]
+        return True
+
+    def renew(self):
+        """
+        Renew leases which are due, and forget the unused ones.
+        """
+        now = time()
+        for name, lease in list(self.held.items()):
+            renewed, ttl, used = lease
+            if now < renewed + ttl / 3:
+                continue
+            if used < now - ttl / 2:
+                del self.held[name]
+            elif self.storage.lease(name, getpid(), ttl):
+                lease[0] = now
+            else:
+                # Storage is busy, `hold` retries before the lease expires
+                logging.debug(f"Failed to renew lease {name}")
+
+    def release(self, name):
+        """
+        Give the lease up, so any other process can take it right away.
+
+        :argument name: lease name
+        """
+        self.held.pop(name, None)
+        self.storage.release(name, getpid())
@@ -0,0 +1,209 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of wormhole-tracker package released under
+# the GNU GPLv3 license. See the LICENSE file for more information.
+
+import logging
+from os import getpid
+from time import time
+
+from wormhole_tracker.auxiliaries import Router
+
+
+class Maps(object):
+    """
+    Keeps every map changed by a single process.
+
+    When application runs in several processes, the map is only changed
+    by the process holding the map's lease, its owner, so changes never
+    conflict and every one of them gets the next version of the same
+    router. Other processes forward changes to the owner, which sends
+    every change it has made to all of them. Processes which have the map
+    loaded apply the change to their copy, others just pass it to the
+    map viewers, so the map is never reloaded from the storage on change.
+
+    Copy of the map which has missed some changes, e.g. loaded from the
+    storage before the owner has saved the latest ones, asks the owner
+    for them, and gets either the changes from its history or the whole
+    map. Changes come through the same connection, so the answer is
+    never overtaken by the changes made after it.
+
+    Owner keeps the lease while it changes the map, and saves the map
+    long before the lease expires, so other process taking the lease
+    over can load the map from the storage. Lease is held in memory
+    between the changes, see `wormhole_tracker.leases.Leases`, and the
+    map is refreshed from the storage whenever it is taken again.
+
+    Attributes:
+        owned: set of keys of maps this process has owned lately.
+
+        requested: dict with keys of maps this process has asked the
+            missing changes for as keys, and request times as values.
+    """
+    lease_ttl = 30  # Seconds the owner keeps the map without changing it
+    request_timeout = 5  # Seconds to wait for missing changes
+
+    def __init__(self, app):
+        self.application = app
+        self.owned = set()
+        self.requested = {}
+
+    @property
+    def storage(self):
+        return self.application.users.storage
+
+    def owner(self, key):
+        """
+        Take the map's lease, if it is free, or renew it.
+
+        :argument key: map key
+        :return: id of the process owning the map, None if unknown
+        """
+        pid = getpid()
+        if not self.application.channel:
+            return pid
+        leases = self.application.leases
+        held = 'map:' + key in leases
+        if leases.hold('map:' + key, self.lease_ttl):
+            if not held or key not in self.owned:
+                self.owned.add(key)
+                # Previous owner may have changed the map
+                # after this process has loaded it
+                users = self.application.users
+                users.refresh(key)
+                if users.cached(key) is not None:
+                    # Copy's links were not expired by this process
+                    users.cached(key)['router'].schedule()
+            return pid
+        self.owned.discard(key)
+        return self.storage.holder('map:' + key)
+
+    async def change(self, key, method, *args, kind='update'):
+        """
+        Change the map with its router's `method` in the owner process,
+        and send the change to everybody viewing the map.
+
+        :argument key:    map key
+        :argument method: name of the Router method, which makes the change
+        :argument args:   JSON-serializable method arguments
+        :argument kind:   type of the message to send the change with
+        :return: the change, None if nothing has changed or the change
+        is made by the other process
+        """
+        app = self.application
+        for _ in range(2):
+            owner = self.owner(key)
+            if owner == getpid():
+                break
+            if owner is not None and app.channel.tell(
+                    owner, {'change': [key, method, args, kind]}):
+                return None
+            if owner is not None:
+                # Owner has died without giving the lease up
+                logging.warning(f"Taking map {key} over from {owner}")
+                self.storage.release('map:' + key, owner)
+        else:
+            logging.error(f"Failed to change map {key}, no owner")
+            return None
+        change = await getattr(app.router(key=key), method)(*args)
+        if change:
+            message = [kind, change]
+            app.rooms.broadcast(key, message)
+            if app.channel:
+                app.channel.publish({
+                    'message': message, 'room': key,
+                    'map': key, 'owner': getpid(),
+                })
+        return change
+
+    def apply(self, key, message, owner):
+        """
+        Apply the change made by the owner process to the copy of the map,
+        if this process keeps one.
+
+        :argument key:     map key
+        :argument message: `[kind, change]` message, see `change`
+        :argument owner:   id of the owner process
+        """
+        user = self.application.users.cached(key)
+        if user is None:
+            return
+        kind, change = message
+        router = user['router']
+        if kind == 'recover':
+            # Map has been reset
+            if change['version'] > router.version:
+                router.clear(change['version'])
+        elif not router.apply(change):
+            requested = self.requested.get(key, 0)
+            if requested + self.request_timeout < time():
+                self.requested[key] = time()
+                self.application.channel.tell(
+                    owner, {'missing': [key, router.version, getpid()]}
+                )
+
+    def missing(self, key, version, pid):
+        """
+        Send changes of the map made after the `version` to the process,
+        or the whole map if they are not in the history anymore.
+
+        :argument key:     map key
+        :argument version: version of the process' copy of the map
+        :argument pid:     id of the process
+        """
+        router = self.application.router(key=key)
+        changes = router.since(version)
+        if changes is None:
+            replica = [key, None, router.dump()]
+        else:
+            replica = [key, changes, None]
+        self.application.channel.tell(pid, {'replica': replica})
+
+    def replica(self, key, changes, data):
+        """
+        Bring the copy of the map up to date with the owner's answer,
+        see `missing`.
+
+        :argument key:     map key
+        :argument changes: list of the missing changes, None if the whole
+                           map is sent instead
+        :argument data:    dict with router data, see `Router.dump`
+        """
+        self.requested.pop(key, None)
+        user = self.application.users.cached(key)
+        if user is None:
+            return
+        if changes is None:
+            if data['version'] > user['router'].version:
+                user['router'] = Router.restore(key, self.application, data)
+            return
+        for change in changes:
+            user['router'].apply(change)
+
+    def receive(self, notification):
+        """
+        Handle map notifications of other processes.
+
+        :argument notification: dict sent by the channel
+        """
+        if notification.get('map'):
+            self.apply(
+                notification['map'], notification['message'],
+                notification['owner']
+            )
+        if 'change' in notification:
+            key, method, args, kind = notification['change']
+            self.application.spawn(self.change, key, method, *args, kind=kind)
+        if 'missing' in notification:
+            self.missing(*notification['missing'])
+        if 'replica' in notification:
+            self.replica(*notification['replica'])
+
+    def release(self):
+        """
+        Give up leases of all owned maps, once they are stored.
+        """
+        if self.application.channel:
+            for key in self.owned:
+                self.application.leases.release('map:' + key)
+            self.owned.clear()
@@ -0,0 +1,264 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of wormhole-tracker package released under
+# the GNU GPLv3 license. See the LICENSE file for more information.
+
+"""
+Application metrics in the Prometheus text format.
+
+Collecting is a couple of dict operations per event, everything which
+can be taken from the application state, like the amount of trackers,
+is computed only when metrics are requested. Every worker process keeps
+its own metrics, labelled with its pid.
+"""
+
+from bisect import bisect_left
+from os import getpid
+
+from tornado.ioloop import IOLoop
+
+
+def _labels(names, values):
+    if not names:
+        return ''
+    pairs = (f'{name}="{value}"' for name, value in zip(names, values))
+    return '{' + ','.join(pairs) + '}'
+
+
+class Counter(object):
+    """
+    Monotonically increasing value, kept separately for
+    every combination of label values.
+    """
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.values = {}
+
+    def inc(self, *labels, amount=1):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def samples(self):
+        for labels, value in self.values.items():
+            yield self.name + _labels(self.labels, labels), value
+
+
+class Histogram(Counter):
+    """
+    Distribution of observed values over the `buckets` upper bounds.
+    Values are kept as [bucket counts..., sum] lists per label values,
+    bucket counts are only made cumulative on render.
+    """
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labels=(),
+                 buckets=(.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)):
+        super(Histogram, self).__init__(name, documentation, labels)
+        self.buckets = buckets
+
+    def observe(self, value, *labels):
+        counts = self.values.get(labels)
+        if counts is None:
+            # One more bucket for +Inf, and the sum
+            counts = self.values[labels] = [0] * (len(self.buckets) + 2)
+        counts[bisect_left(self.buckets, value)] += 1
+        counts[-1] += value
+
+    def samples(self):
+        names = self.labels + ('le',)
+        for labels, counts in self.values.items():
+            total = 0
+            bounds = self.buckets + ('+Inf',)
+            for bound, count in zip(bounds, counts):
+                total += count
+                yield (
+                    self.name + '_bucket' + _labels(names, labels + (bound,)),
+                    total
+                )
+            yield self.name + '_sum' + _labels(self.labels, labels), counts[-1]
+            yield self.name + '_count' + _labels(self.labels, labels), total
+
+
+class Gauge(object):
+    """
+    Value taken from the application state by the `function`
+    at the moment metrics are requested.
+    """
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, function):
+        self.name = name
+        self.documentation = documentation
+        self.function = function
+
+    def samples(self):
+        yield self.name, self.function()
+
+
+class FunctionCounter(Gauge):
+    """
+    Monotonically increasing value taken from the application state by
+    the `function`, for the counts the application keeps by itself.
+    """
+    kind = 'counter'
+
+
+class Metrics(object):
+    """
+    Registry of the application metrics.
+
+    Attributes:
+        upstream: Histogram of EVE SSO and API call durations, by endpoint.
+
+        responses: Counter of EVE SSO and API responses, by endpoint and
+            status code, 599 meaning there was no response.
+
+        router_update: Histogram of `Router.update` durations.
+
+        dropped: Counter of websocket tasks dropped, by reason, either
+            "full" lane of the queue or "unknown" command.
+
+        coalesced: Counter of websocket tasks replaced by or merged
+            with the newer ones while waiting in the queue, by command.
+
+        skipped: Counter of map updates skipped for the clients which
+            are behind, they get them later in a single message.
+
+        slow_closed: Counter of websocket connections closed because
+            the client did not receive what was sent.
+
+        received, sent: Counters of websocket message bytes, before
+            compression.
+
+        loop_lag: Histogram of IOLoop delays, measured by the callback
+            which is scheduled every `probe_interval` seconds.
+
+        slow_callbacks: Counter of IOLoop callbacks which have run longer
+            than the profiler's threshold.
+    """
+    def __init__(self, app, probe_interval=1):
+        self.application = app
+        self.probe_interval = probe_interval
+        self.probe_due = None
+        self.upstream = Histogram(
+            'wormhole_tracker_upstream_seconds',
+            "EVE SSO and API call duration.", ('endpoint',)
+        )
+        self.responses = Counter(
+            'wormhole_tracker_upstream_responses_total',
+            "EVE SSO and API responses.", ('endpoint', 'code')
+        )
+        self.router_update = Histogram(
+            'wormhole_tracker_router_update_seconds',
+            "Router.update duration.",
+            buckets=(.0001, .00025, .0005, .001, .0025, .005, .01, .025, .1)
+        )
+        self.dropped = Counter(
+            'wormhole_tracker_socket_tasks_dropped_total',
+            "Websocket tasks dropped.", ('reason',)
+        )
+        self.coalesced = Counter(
+            'wormhole_tracker_socket_tasks_coalesced_total',
+            "Websocket tasks coalesced with the newer ones.", ('command',)
+        )
+        self.skipped = Counter(
+            'wormhole_tracker_websocket_updates_skipped_total',
+            "Map updates skipped for clients which are behind."
+        )
+        self.slow_closed = Counter(
+            'wormhole_tracker_websocket_slow_closed_total',
+            "Websocket connections closed for not receiving messages."
+        )
+        self.received = Counter(
+            'wormhole_tracker_websocket_received_bytes_total',
+            "Websocket bytes received."
+        )
+        self.sent = Counter(
+            'wormhole_tracker_websocket_sent_bytes_total',
+            "Websocket bytes sent."
+        )
+        self.loop_lag = Histogram(
+            'wormhole_tracker_ioloop_lag_seconds',
+            "Delay of the periodic IOLoop probe.",
+            buckets=(.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1)
+        )
+        self.slow_callbacks = Counter(
+            'wormhole_tracker_slow_callbacks_total',
+            "IOLoop callbacks running longer than the threshold."
+        )
+        self.metrics = [
+            self.upstream, self.responses, self.router_update,
+            self.dropped, self.coalesced, self.skipped, self.slow_closed,
+            self.received, self.sent, self.loop_lag, self.slow_callbacks,
+            Gauge('wormhole_tracker_trackers',
+                  "Characters being tracked.",
+                  lambda: len(app.poller.subscribers)),
+            Gauge('wormhole_tracker_connections',
+                  "Open websocket connections.",
+                  lambda: len(app.connections)),
+            Gauge('wormhole_tracker_connections_tracking',
+                  "Websocket connections tracking their characters.",
+                  app.connections.tracking),
+            Gauge('wormhole_tracker_socket_queue_depth',
+                  "Websocket tasks waiting in all queues.",
+                  lambda: sum(socket.q.qsize() for socket in app.connections)),
+            Gauge('wormhole_tracker_socket_queue_depth_max',
+                  "Websocket tasks waiting in the longest queue.",
+                  lambda: max(
+                      (socket.q.qsize() for socket in app.connections),
+                      default=0
+                  )),
+            Gauge('wormhole_tracker_websocket_pending_bytes',
+                  "Websocket bytes sent but not received yet.",
+                  lambda: sum(socket.pending for socket in app.connections)),
+            FunctionCounter('wormhole_tracker_messages_offloaded_total',
+                            "Websocket messages encoded or decoded "
+                            "by the pool.",
+                            lambda: app.serializer.offloaded),
+            Gauge('wormhole_tracker_users_in_memory',
+                  "Users and fleet maps kept in memory.",
+                  lambda: len(app.users.activity)),
+            FunctionCounter('wormhole_tracker_users_evicted_total',
+                            "Users evicted from memory.",
+                            lambda: app.users.evicted),
+            Gauge('wormhole_tracker_states',
+                  "OAuth state tokens stored.",
+                  lambda: len(app.state_storage)),
+            FunctionCounter('wormhole_tracker_states_expired_total',
+                            "OAuth state tokens expired unused.",
+                            lambda: app.state_storage.expired),
+            FunctionCounter('wormhole_tracker_states_evicted_total',
+                            "OAuth state tokens evicted to keep "
+                            "within the limit.",
+                            lambda: app.state_storage.evicted),
+        ]
+
+    def start(self):
+        self.probe_due = IOLoop.current().time() + self.probe_interval
+        IOLoop.current().call_later(self.probe_interval, self.probe)
+
+    def probe(self):
+        now = IOLoop.current().time()
+        self.loop_lag.observe(max(now - self.probe_due, 0))
+        self.probe_due = now + self.probe_interval
+        IOLoop.current().call_later(self.probe_interval, self.probe)
+
+    def render(self):
+        """
+        :return: all metrics in the Prometheus text format
+        """
+        pid = f'pid="{getpid()}"'
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, value in metric.samples():
+                if name.endswith('}'):
+                    name = name[:-1] + ',' + pid + '}'
+                else:
+                    name += '{' + pid + '}'
+                lines.append(f"{name} {value}")
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,293 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of wormhole-tracker package released under
+# the GNU GPLv3 license. See the LICENSE file for more information.
+
+import logging
+from datetime import timedelta
+from email.utils import parsedate_to_datetime
+from heapq import heappop, heappush
+from itertools import count
+from random import uniform
+from time import time
+
+from tornado import gen
+from tornado.escape import json_decode
+from tornado.ioloop import IOLoop
+from tornado.locks import Event
+
+from wormhole_tracker.protocol import encode
+
+
+class Schedule(object):
+    """
+    Polling state of the single tracked character.
+
+    Attributes:
+        user_id: id of the tracked character.
+
+        interval: current polling interval, in seconds.
+
+        due: IOLoop time of the next poll.
+
+        etag: ETag of the last location response, for conditional requests.
+
+        location: the last fetched location data.
+
+        system: name of the system character was in on the last poll.
+    """
+    def __init__(self, user_id, interval, due):
+        self.user_id = user_id
+        self.interval = interval
+        self.due = due
+        self.etag = None
+        self.location = None
+        self.system = None
+
+
+class Poller(object):
+    """
+    Application-wide location poller.
+
+    Keeps a single schedule per tracked character, no matter how many
+    websocket connections are tracking it, and fans every map update out
+    to all sockets viewing the map, which may be shared by the fleet.
+
+    Polling interval adapts to the character's activity: it snaps to the
+    `min_interval` after every jump and backs off exponentially up to the
+    `max_interval` while character stays in the same system or is not in
+    game. Upstream cache expiry is honoured, and ETag of the last response
+    is used to make conditional requests.
+
+    When application runs in several processes, every character is polled
+    only by the process holding its lease, other processes receive results
+    through the application's notification channel.
+
+    Attributes:
+        subscribers: dict with user ids as keys and sets of subscribed
+            websocket handlers as values.
+
+        schedules: dict with user ids as keys and Schedule objects as values.
+
+        queue: heap of (due, sequence number, Schedule) tuples, with the
+            next character to poll on the top.
+
+        running: A flag indicates if the polling loop is running or not.
+    """
+    def __init__(self, app, interval=5, min_interval=2, max_interval=60,
+                 backoff=2):
+        self.application = app
+        self.interval = interval
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.subscribers = {}
+        self.schedules = {}
+        self.queue = []
+        self.counter = count()
+        self.wakeup = Event()
+        self.running = False
+
+    def subscribe(self, user_id, socket):
+        """
+        Start delivering `user_id` location updates to the `socket`.
+
+        :argument user_id: id of the character to track
+        :argument socket:  websocket handler to send updates to
+        """
+        self.subscribers.setdefault(user_id, set()).add(socket)
+        self.application.tokens.watch(user_id)
+        if user_id not in self.schedules:
+            # Spread first polls of characters tracked at
+            # the same moment, e.g. after the server restart
+            now = IOLoop.current().time()
+            schedule = Schedule(
+                user_id, self.interval, now + uniform(0, self.min_interval)
+            )
+            self.schedules[user_id] = schedule
+            self.push(schedule)
+        if not self.running:
+            self.running = True
+            self.application.spawn(self.run)
+
+    def unsubscribe(self, user_id, socket):
+        """
+        Stop delivering `user_id` location updates to the `socket`.
+        Character is not polled anymore once its last socket has gone,
+        and its lease is given up for the process which still tracks it.
+
+        :argument user_id: id of the tracked character
+        :argument socket:  websocket handler to remove
+        """
+        sockets = self.subscribers.get(user_id)
+        if sockets is not None:
+            sockets.discard(socket)
+            if not sockets:
+                del self.subscribers[user_id]
+                del self.schedules[user_id]
+                if self.application.channel:
+                    self.application.leases.release(user_id)
+
+    def push(self, schedule):
+        heappush(self.queue, (schedule.due, next(self.counter), schedule))
+        self.wakeup.set()
+
+    async def run(self):
+        """
+        Polling loop.
+
+        Sleeps until the nearest due time, or until the new character is
+        tracked, and spawns polls for all characters which are due. Every
+        character is put back to the queue when its poll is done, so polls
+        of the same character never overlap. Stops itself when there is
+        nobody left to track.
+        """
+        logging.info("Location poller started")
+        try:
+            while self.subscribers:
+                now = IOLoop.current().time()
+                while self.queue and self.queue[0][0] <= now:
+                    schedule = heappop(self.queue)[2]
+                    # Skip characters which have been untracked meanwhile
+                    if self.schedules.get(schedule.user_id) is schedule:
+                        self.application.spawn(self.poll, schedule)
+                if self.queue:
+                    delay = self.queue[0][0] - now
+                else:
+                    delay = self.max_interval
+                self.wakeup.clear()
+                try:
+                    await self.wakeup.wait(timeout=timedelta(seconds=delay))
+                except gen.TimeoutError:
+                    pass
+        finally:
+            self.running = False
+            logging.info("Location poller stopped")
+
+    def lease(self, user_id):
+        """
+        :argument user_id: id of the character to poll
+        :return: True if this process is the one to poll the character
+        """
+        if not self.application.channel:
+            return True
+        leases = self.application.leases
+        held = user_id in leases
+        if not leases.hold(user_id, 2 * self.max_interval):
+            return False
+        if not held:
+            # Previous holder may have recorded jumps
+            # after this process has loaded them
+            self.application.users.refresh_jumps(user_id)
+        return True
+
+    @staticmethod
+    def expires(response):
+        """
+        :argument response: HTTPResponse object
+        :return: how many seconds the response stays fresh in upstream cache
+        """
+        cache_control = response.headers.get('Cache-Control', '')
+        for directive in cache_control.split(','):
+            name, _, value = directive.strip().partition('=')
+            if name == 'max-age' and value.isdigit():
+                return int(value)
+        expires = response.headers.get('Expires')
+        if expires:
+            try:
+                return parsedate_to_datetime(expires).timestamp() - time()
+            except (TypeError, ValueError):
+                pass
+        return 0
+
+    async def fetch(self, schedule):
+        """
+        Fetch character's location with conditional request.
+
+        :argument schedule: Schedule object of the character
+        :return: tuple with location data and its freshness, in seconds
+        """
+        headers = {}
+        if schedule.etag:
+            headers['If-None-Match'] = schedule.etag
+        response = await self.application.character_response(
+            schedule.user_id, '/location/', 'GET', headers
+        )
+        if response is None:
+            schedule.etag = schedule.location = None
+            return None, 0
+        if response.code != 304:
+            schedule.etag = response.headers.get('ETag')
+            schedule.location = json_decode(response.body)
+        return schedule.location, self.expires(response)
+
+    async def poll(self, schedule):
+        """
+        Make an API call, update the map, which sends updated
+        data to every socket viewing it, see `App.maps`.
+        Then adapt polling interval and schedule the next poll.
+
+        :argument schedule: Schedule object of the character to poll
+        """
+        user_id = schedule.user_id
+        moved = False
+        expires = 0
+        try:
+            if not self.lease(user_id):
+                return
+            # Call API to find out current character location
+            location, expires = await self.fetch(schedule)
+            if location:
+                key = self.application.map_key(user_id)
+                system = location['solarSystem']['name']
+                moved = system != schedule.system
+                schedule.system = system
+                if moved:
+                    # History is kept by the process polling the character
+                    self.application.users.append_jump(
+                        user_id, time(), system
+                    )
+                start = IOLoop.current().time()
+                # Map may be owned by the other process, it
+                # decides whether the map has changed or not
+                graph_data = await self.application.maps.change(
+                    key, 'update', system, user_id
+                )
+                self.application.metrics.router_update.observe(
+                    IOLoop.current().time() - start
+                )
+                if graph_data:
+                    logging.debug(graph_data)
+            else:
+                message = ['warning', 'Log into game to track your route']
+                self.broadcast(user_id, message)
+                self.application.notify(message, user=user_id)
+        except Exception as e:
+            logging.error(f"Failed to poll location of {user_id}: {e}")
+        finally:
+            if moved:
+                schedule.interval = self.min_interval
+            else:
+                schedule.interval = min(
+                    schedule.interval * self.backoff, self.max_interval
+                )
+            # No sense in polling before upstream cache expires
+            delay = max(schedule.interval, min(expires, self.max_interval))
+            schedule.due = IOLoop.current().time() + delay
+            if self.schedules.get(user_id) is schedule:
+                self.push(schedule)
+
+    def broadcast(self, user_id, message):
+        """
+        Send the `message` to every socket subscribed to the character.
+
+        :argument user_id: id of the tracked character
+        :argument message: message to send
+        """
+        sockets = self.subscribers.get(user_id)
+        if sockets:
+            frames = {}
+            for socket in list(sockets):
+                if socket.compact not in frames:
+                    frames[socket.compact] = encode(message, socket.compact)
+                socket.safe_send(frames[socket.compact], message)
@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of wormhole-tracker package released under
+# the GNU GPLv3 license. See the LICENSE file for more information.
+
+import logging
+import sys
+from collections import Counter
+from os.path import basename, dirname
+from threading import Thread, get_ident
+from time import sleep, time
+
+from tornado.concurrent import Future
+from tornado.ioloop import IOLoop
+
+PACKAGE_DIR = dirname(__file__)
+
+
+def frame_name(frame):
+    code = frame.f_code
+    return f"{basename(code.co_filename)}:{code.co_name}"
+
+
+def collapse(frame):
+    """
+    :argument frame: the innermost frame of the stack
+    :return: stack in the collapsed format, the outermost frame first
+    """
+    names = []
+    while frame is not None:
+        names.append(frame_name(frame))
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+def culprit(frame):
+    """
+    :argument frame: the innermost frame of the stack
+    :return: "file:line function" of the innermost application's frame,
+    the innermost frame at all if there is no application's one
+    """
+    innermost = frame
+    while frame is not None:
+        if frame.f_code.co_filename.startswith(PACKAGE_DIR):
+            break
+        frame = frame.f_back
+    frame = frame or innermost
+    code = frame.f_code
+    return f"{basename(code.co_filename)}:{frame.f_lineno} {code.co_name}"
+
+
+class Profiler(object):
+    """
+    Diagnostics of the IOLoop stalls.
+
+    Slow callback detector is always on: IOLoop raises the alarm signal
+    when a callback runs longer than `threshold`, and the stack of the
+    callback which is still running is logged, attributed to the
+    innermost frame of the application, like the poller's `poll` or
+    the socket's `scheduler`.
+
+    Sampling profiler is started on demand for a bounded time: the other
+    thread records the IOLoop thread's stack every `interval` seconds,
+    so the IOLoop itself does not pay anything for it, and the result is
+    returned in the collapsed stack format understood by flamegraph.pl
+    and speedscope.
+
+    Attributes:
+        loop_thread: id of the IOLoop thread.
+
+        sampling: True while the profiler is running.
+    """
+    max_duration = 60
+
+    def __init__(self, app, threshold=0.25, interval=0.005):
+        self.application = app
+        self.threshold = threshold
+        self.interval = interval
+        self.loop_thread = get_ident()
+        self.sampling = False
+
+    def watch(self):
+        """
+        Start detecting slow callbacks, does nothing if `threshold` is 0.
+        """
+        if self.threshold:
+            IOLoop.current().set_blocking_signal_threshold(
+                self.threshold, self.on_blocked
+            )
+
+    def on_blocked(self, signum, frame):
+        """
+        Signal handler, called while the callback is still running.
+        """
+        where = culprit(frame)
+        self.application.metrics.slow_callbacks.inc()
+        logging.warning(
+            f"IOLoop blocked for more than {self.threshold} s in {where}, "
+            f"stack: {collapse(frame)}"
+        )
+
+    def profile(self, duration):
+        """
+        Sample the IOLoop thread's stack for `duration` seconds,
+        at most `max_duration`.
+
+        :return: Future resolved with collapsed stacks,
+        one "frame;frame;... count" line per stack
+        """
+        future = Future()
+        if self.sampling:
+            future.set_exception(RuntimeError("Profiler is already running"))
+            return future
+        self.sampling = True
+        duration = min(duration, self.max_duration)
+        Thread(
+            target=self.sample, args=(duration, future, IOLoop.current()),
+            daemon=True
+        ).start()
+        return future
+
+    def sample(self, duration, future, io_loop):
+        """
+        Sampling thread.
+        """
+        stacks = Counter()
+        end = time() + duration
+        try:
+            while time() < end:
+                frame = sys._current_frames().get(self.loop_thread)
+                if frame is not None:
+                    stacks[collapse(frame)] += 1
+                del frame
+                sleep(self.interval)
+        finally:
+            self.sampling = False
+            result = ''.join(
+                f"{stack} {count}\n" for stack, count in stacks.most_common()
+            )
+            # Futures are not thread-safe, resolve it on the IOLoop
+            io_loop.add_callback(future.set_result, result)
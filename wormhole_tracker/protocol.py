@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of wormhole-tracker package released under
+# the GNU GPLv3 license. See the LICENSE file for more information.
+
+"""
+Websocket message encoding.
+
+Every message is a `[type, data]` pair. By default it is sent as a JSON
+text frame. Clients which negotiate the `COMPACT` subprotocol receive map
+messages (`recover`, `sync` and `update`) as binary frames instead, all
+numbers are little-endian:
+
+    uint8   message type, see `TYPES`
+    uint32  map version
+    uint32  amount of strings, then every string as
+            uint16 length and UTF-8 bytes
+    uint32  `current` string index, `NONE` if there is none
+    uint32  `pilot` string index, `NONE` if there is none
+    uint32  amount of nodes, then every node as
+            uint32 name index, uint8 fixed flag,
+            and float32 x, float32 y if the node is fixed
+    uint32  amount of links, then every link as
+            uint32 source name index, uint32 target name index
+    uint32  amount of positions, then every position as
+            uint32 name index, float32 x, float32 y
+    uint32  amount of removed links, then every link as
+            uint32 source name index, uint32 target name index
+
+Every system name is sent once per message, nodes, links and positions
+refer to it by index. See `static/js/protocol.js` for the decoder.
+
+JSON is handled by orjson when it is installed, it is several times
+faster than the standard library.
+"""
+
+from struct import Struct
+
+from tornado.escape import json_decode, json_encode, utf8
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+COMPACT = 'wormhole-tracker.compact'
+
+TYPES = {'recover': 1, 'sync': 2, 'update': 3}
+
+NONE = 0xFFFFFFFF
+
+_header = Struct('<BI')
+_count = Struct('<I')
+_length = Struct('<H')
+_index = Struct('<I')
+_node = Struct('<IB')
+_point = Struct('<ff')
+_link = Struct('<II')
+_position = Struct('<Iff')
+
+
+def dumps(value):
+    """
+    :return: UTF-8 encoded JSON
+    """
+    if orjson is not None:
+        return orjson.dumps(value)
+    return utf8(json_encode(value))
+
+
+def loads(data):
+    """
+    :argument data: JSON string or UTF-8 encoded bytes
+    """
+    if orjson is not None:
+        return orjson.loads(data)
+    return json_decode(data)
+
+
+def encode(message, compact=False):
+    """
+    Encode message for the websocket once, to write it to many sockets.
+
+    :argument message: `[type, data]` message
+    :argument compact: encode map messages with the compact binary format
+    :return: tuple with encoded message and the binary frame flag
+    """
+    if compact and message[0] in TYPES:
+        return encode_compact(*message), True
+    return dumps(message), False
+
+
+def encode_compact(kind, data):
+    """
+    :argument kind: message type, one of `TYPES`
+    :argument data: dict with map data
+    :return: binary encoded message
+    """
+    strings = {}
+
+    def index(name):
+        if not name:
+            return NONE
+        if name not in strings:
+            strings[name] = len(strings)
+        return strings[name]
+
+    nodes = data.get('nodes', ())
+    links = data.get('links', ())
+    positions = data.get('positions', ())
+    removed = data.get('removed', ())
+
+    body = [_index.pack(index(data.get('current')))]
+    body.append(_index.pack(index(data.get('pilot'))))
+
+    body.append(_count.pack(len(nodes)))
+    for node in nodes:
+        fixed = 'x' in node and node.get('fixed')
+        body.append(_node.pack(index(node['name']), bool(fixed)))
+        if fixed:
+            body.append(_point.pack(node['x'], node['y']))
+
+    body.append(_count.pack(len(links)))
+    for link in links:
+        body.append(_link.pack(
+            index(link['source']['name']), index(link['target']['name'])
+        ))
+
+    body.append(_count.pack(len(positions)))
+    for position in positions:
+        body.append(_position.pack(
+            index(position['name']), position['x'], position['y']
+        ))
+
+    body.append(_count.pack(len(removed)))
+    for link in removed:
+        body.append(_link.pack(
+            index(link['source']['name']), index(link['target']['name'])
+        ))
+
+    head = [
+        _header.pack(TYPES[kind], data.get('version', 0)),
+        _count.pack(len(strings)),
+    ]
+    for name in strings:
+        name = utf8(name)
+        head.append(_length.pack(len(name)))
+        head.append(name)
+    return b''.join(head + body)
@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of wormhole-tracker package released under
+# the GNU GPLv3 license. See the LICENSE file for more information.
+
+from wormhole_tracker.protocol import encode
+
+
+class Rooms(object):
+    """
+    Keeps websocket connections grouped by the map they are viewing.
+
+    Map is either user's own, with user's id as its key, or shared by
+    the fleet, with "fleet:<name>" key. Every message for the map is
+    serialized once per protocol, no matter how many sockets are
+    viewing it.
+
+    Attributes:
+        viewers: dict with map keys as keys and sets of websocket
+            handlers as values.
+    """
+    def __init__(self):
+        self.viewers = {}
+
+    def join(self, key, socket):
+        self.viewers.setdefault(key, set()).add(socket)
+
+    def leave(self, key, socket):
+        sockets = self.viewers.get(key)
+        if sockets is not None:
+            sockets.discard(socket)
+            if not sockets:
+                del self.viewers[key]
+
+    def broadcast(self, key, message):
+        """
+        Send the `message` to every socket viewing the map.
+
+        :argument key:     map key
+        :argument message: message to send
+        """
+        sockets = self.viewers.get(key)
+        if sockets:
+            frames = {}
+            for socket in list(sockets):
+                if socket.compact not in frames:
+                    frames[socket.compact] = encode(message, socket.compact)
+                socket.safe_send(frames[socket.compact], message)
@@ -5,7 +5,11 @@
 
 import wormhole_tracker.handlers.pages as pages
 import wormhole_tracker.handlers.actions as actions
+import wormhole_tracker.handlers.admin as admin
+import wormhole_tracker.handlers.history as history
+import wormhole_tracker.handlers.metrics as metrics
 import wormhole_tracker.handlers.polling as polling
+import wormhole_tracker.handlers.route as route
 
 routes = [
     (r"/",          pages.MainHandler),
@@ -14,4 +18,8 @@ routes = [
     (r"/auth/(.*)", actions.AuthHandler),
     (r"/signout",   actions.SignoutHandler),
     (r"/poll",      polling.PollingHandler),
+    (r"/history",   history.HistoryHandler),
+    (r"/route",     route.RouteHandler),
+    (r"/metrics",   metrics.MetricsHandler),
+    (r"/admin/profile", admin.ProfileHandler),
 ]
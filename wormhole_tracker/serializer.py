@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of wormhole-tracker package released under
+# the GNU GPLv3 license. See the LICENSE file for more information.
+
+from concurrent.futures import ProcessPoolExecutor
+
+from tornado.concurrent import Future, chain_future
+from tornado.ioloop import IOLoop
+
+from wormhole_tracker.protocol import TYPES, encode, loads, orjson
+
+
+def size(message):
+    """
+    :argument message: `[type, data]` message
+    :return: amount of list items in the message data, like nodes,
+    links or jumps, which is what makes messages large
+    """
+    data = message[1] if isinstance(message, list) and message else None
+    if isinstance(data, dict):
+        return sum(
+            len(value) for value in data.values() if isinstance(value, list)
+        )
+    if isinstance(data, list):
+        return len(data)
+    return 0
+
+
+class Serializer(object):
+    """
+    Size-aware websocket message serialization.
+
+    Small messages are encoded and decoded right away. Large ones are
+    handed to the pool of `workers` processes, since the standard library
+    does not release the GIL, and a thread would stall the IOLoop just the
+    same. Pickling the message for the worker and unpickling the result
+    costs the IOLoop about a third of encoding it with the standard
+    library, and a half of encoding it with the compact format.
+
+    orjson encodes and decodes JSON faster than the message would be
+    pickled for the pool, so when it is installed only compact messages
+    are offloaded. See `benchmarks/serializer.py` for the numbers.
+
+    Pool is only started when the first large message comes, so every
+    worker process of the server gets its own one.
+
+    Attributes:
+        encode_threshold: amount of list items in the message, see `size`,
+            starting from which it is encoded by the pool.
+
+        decode_threshold: length of the received message, starting from
+            which it is decoded by the pool, by default only without orjson.
+
+        offloaded: amount of messages handled by the pool.
+    """
+    def __init__(self, workers=2, encode_threshold=2000,
+                 decode_threshold=None):
+        if decode_threshold is None:
+            decode_threshold = 64 * 1024 if orjson is None else float('inf')
+        self.workers = workers
+        self.encode_threshold = encode_threshold
+        self.decode_threshold = decode_threshold
+        self.pool = None
+        self.offloaded = 0
+
+    def inline(self, message, compact=False):
+        """
+        :return: True if the `message` is cheaper to encode right away
+        """
+        if orjson is not None and not (compact and message[0] in TYPES):
+            return True
+        return size(message) < self.encode_threshold
+
+    async def encode(self, message, compact=False):
+        """
+        See `wormhole_tracker.protocol.encode`.
+        """
+        if self.inline(message, compact):
+            return encode(message, compact)
+        return await self.run(encode, message, compact)
+
+    async def decode(self, data):
+        """
+        :argument data: received JSON message
+        """
+        if len(data) < self.decode_threshold:
+            return loads(data)
+        return await self.run(loads, data)
+
+    async def run(self, function, *args):
+        if self.pool is None:
+            self.pool = ProcessPoolExecutor(self.workers)
+        self.offloaded += 1
+        future = Future()
+        # Pool's futures are resolved in its own thread,
+        # hand the result over to the IOLoop
+        IOLoop.current().add_future(
+            self.pool.submit(function, *args),
+            lambda result: chain_future(result, future)
+        )
+        return await future
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown(wait=False)
+            self.pool = None
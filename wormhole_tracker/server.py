@@ -5,34 +5,63 @@
 # the GNU GPLv3 license. See the LICENSE file for more information.
 
 import logging
-import shelve
 from base64 import b64encode
-from os import sys
+from os import close, remove, sys
+from tempfile import mkstemp
+from time import time
+from urllib.parse import urlsplit
 
 from tornado.escape import json_decode, json_encode
 from tornado.httpclient import AsyncHTTPClient, HTTPError, HTTPRequest
 from tornado.httpserver import HTTPServer
 from tornado.ioloop import IOLoop
+from tornado.netutil import bind_sockets
 from tornado.options import (
     define, options, parse_command_line, parse_config_file
 )
+from tornado.process import fork_processes
 from tornado.web import Application
 
 from wormhole_tracker.auxiliaries import a, Router
+from wormhole_tracker.channel import Channel
+from wormhole_tracker.connections import Connections
+from wormhole_tracker.leases import Leases
+from wormhole_tracker.maps import Maps
+from wormhole_tracker.metrics import Metrics
+from wormhole_tracker.poller import Poller
+from wormhole_tracker.profiler import Profiler
+from wormhole_tracker.rooms import Rooms
 from wormhole_tracker.routes import routes
+from wormhole_tracker.serializer import Serializer
+from wormhole_tracker.sessions import Sessions
 from wormhole_tracker.settings import settings
+from wormhole_tracker.storage import (
+    ExpiringStates, SQLiteStorage, States, Storage, Users
+)
+from wormhole_tracker.sweeper import Sweeper
+from wormhole_tracker.tokens import TokenManager
 
 define('port', 13131, int)
 define('client_id')
 define('client_key')
 define('redirect_uri')
 define('cookie_secret', 'default_secret')
-
-http_client = AsyncHTTPClient()
+define('db_path', '')
+define('max_users', 10000, int)
+define('link_lifetime', 0, int)
+define('admins', [], str, multiple=True)
+define('slow_callback', 0.25, float)
+define('processes', 1, int)
+define('ipc_dir', '/tmp/wormhole-tracker')
+define('sso_url', 'https://login.eveonline.com')
+define('api_url', 'https://crest-tq.eveonline.com')
 
 
 class App(Application):
-    def __init__(self, client_id, client_key, routes, settings):
+    def __init__(self, client_id, client_key, routes, settings,
+                 storage=None, ipc_dir=None,
+                 sso_url=None, api_url=None, max_users=None,
+                 link_lifetime=None):
         """
         Instantiate application object
 
@@ -40,13 +69,55 @@ class App(Application):
         :argument client_key:  EVE app Secret Key
         Both application id and secret key, which can
         be obtained at https://developers.eveonline.com
+        :argument storage:     Storage backend for users data,
+        users are kept in memory only if not provided
+        :argument ipc_dir:     Directory for the cross-process notification
+        channel, required when application runs in several processes,
+        which have to share the `storage`
+        :argument sso_url:     EVE SSO base url
+        :argument api_url:     EVE API base url
+        Both are taken from options if not provided, and can be pointed
+        to the stand-in server (see benchmarks/fake_eve.py) for load testing
+        :argument max_users:   Maximum amount of users kept in memory,
+        inactive ones are evicted and loaded from the `storage` again
+        when they come back, so it must be able to load them
+        :argument link_lifetime: Seconds after which links are removed from
+        the maps, since wormholes collapse, 0 keeps links forever, taken
+        from options if not provided
         """
         super(App, self).__init__(routes, **settings)
         self.client_id = client_id
         self.client_key = client_key
-        self.vagrants = []
-        self.state_storage = {}
-        self.users = {}  # Temporary users storage
+        self.sso_url = sso_url or options.sso_url
+        self.api_url = api_url or options.api_url
+        self.http_client = AsyncHTTPClient()
+        self.connections = Connections(self)
+        self.sessions = Sessions(self)
+        if link_lifetime is None:
+            link_lifetime = options.link_lifetime
+        self.link_lifetime = link_lifetime
+        # Routers schedule their links' expiry when loaded
+        self.sweeper = Sweeper(self)
+        self.sweeper.timer.start()
+        self.users = Users(self, storage or Storage(), max_size=max_users)
+        self.users.flusher.start()
+        self.leases = Leases(self)
+        self.leases.timer.start()
+        self.maps = Maps(self)
+        self.poller = Poller(self)
+        self.rooms = Rooms()
+        self.serializer = Serializer()
+        self.tokens = TokenManager(self)
+        self.metrics = Metrics(self)
+        self.metrics.start()
+        self.profiler = Profiler(self, options.slow_callback)
+        self.channel = None
+        if ipc_dir:
+            self.channel = Channel(ipc_dir, self.on_notification)
+        if self.channel and self.users.storage.shared:
+            self.state_storage = States(self.users.storage)
+        else:
+            self.state_storage = ExpiringStates()
 
     def spawn(self, callback, *args, **kwargs):
         """
@@ -64,6 +135,107 @@ class App(Application):
         """
         IOLoop.current().spawn_callback(callback, *args, **kwargs)
 
+    async def fetch(self, request, endpoint):
+        """
+        Make EVE SSO or API call, measuring its duration and status code.
+
+        :argument request:  HTTPRequest object
+        :argument endpoint: endpoint name for metrics
+        :return: HTTPResponse object, raises HTTPError just like
+        AsyncHTTPClient.fetch does
+        """
+        start = IOLoop.current().time()
+        code = 599
+        try:
+            response = await self.http_client.fetch(request)
+            code = response.code
+            return response
+        except HTTPError as e:
+            code = e.code
+            raise
+        finally:
+            self.metrics.upstream.observe(
+                IOLoop.current().time() - start, endpoint
+            )
+            self.metrics.responses.inc(endpoint, code)
+
+    def map_key(self, user_id):
+        """
+        :argument user_id: user id
+        :return: key of the map user is viewing, in the users storage
+        and in the `self.rooms`
+        """
+        fleet = self.users[user_id].get('fleet')
+        if fleet:
+            return 'fleet:' + fleet
+        return user_id
+
+    def router(self, user_id=None, key=None):
+        """
+        :argument user_id: user id
+        :argument key:     map key, taken instead of the one user is viewing
+        :return: Router of the map user is viewing, either own or fleet's
+        """
+        key = key or self.map_key(user_id)
+        if key not in self.users:
+            # Fleet map is stored just like a user, but with router only
+            self.users[key] = {'router': Router(key, self)}
+        return self.users[key]['router']
+
+    def jumps(self, user_id):
+        """
+        :argument user_id: user id
+        :return: Jumps of the character, None if there is no such user
+        """
+        if self.channel and user_id not in self.leases:
+            # Jumps are recorded by the process polling the character
+            self.users.refresh_jumps(user_id)
+        return self.users.jumps(user_id)
+
+    def notify(self, message=None, evict=None, room=None, user=None):
+        """
+        Let other worker processes know about the changes
+
+        Does nothing if application runs in a single process.
+
+        :argument message: message for the sockets held by other processes
+        :argument evict:   id of the changed user, map changes are sent by
+        `self.maps` instead
+        :argument room:    key of the map, which viewers have to receive
+        the `message`
+        :argument user:    id of the character, which trackers have to
+        receive the `message`
+        """
+        if self.channel:
+            if evict:
+                # Other processes will load the user from the storage
+                self.users.flush()
+            self.channel.publish({
+                'message': message,
+                'evict': evict,
+                'room': room,
+                'user': user,
+            })
+
+    def on_notification(self, notification):
+        """
+        Handle other worker process' notification
+
+        :argument notification: dict sent by `App.notify`, or by `self.maps`
+        """
+        # Map changes are applied before their viewers get them
+        self.maps.receive(notification)
+        message = notification.get('message')
+        if notification.get('evict'):
+            self.users.evict(notification['evict'])
+            # User may have been signed out by other process
+            if self.connections.sockets(notification['evict']):
+                self.sessions.check(notification['evict'])
+        if message and notification.get('room'):
+            self.rooms.broadcast(notification['room'], message)
+        if message and notification.get('user'):
+            self.poller.broadcast(notification['user'], message)
+
     async def authorize(self, code, refresh=False):
         """
         Authorize user via API and get/refresh credentials data
@@ -77,13 +249,13 @@ class App(Application):
         4. :return user id in case of success
         """
         ''' 1 '''
-        authorization = "https://login.eveonline.com/oauth/token"
+        authorization = self.sso_url + "/oauth/token"
         auth_string = a(f"{self.client_id}:{self.client_key}")
         credentials = b64encode(auth_string)
         headers = {
             'Authorization': a("Basic ") + credentials,
             'Content-Type': 'application/json',
-            'Host': "login.eveonline.com"
+            'Host': urlsplit(self.sso_url).netloc
         }
         if not refresh:
             body = json_encode({
@@ -102,7 +274,7 @@ class App(Application):
             body=body
         )
         try:
-            response = await http_client.fetch(request)
+            response = await self.fetch(request, 'token')
             #logging.warning(response)
             logging.info(response.body)
             tokens = json_decode(response.body)
@@ -110,14 +282,14 @@ class App(Application):
             logging.error(e)
         else:
             ''' 2 '''
-            verify = "https://login.eveonline.com/oauth/verify"
+            verify = self.sso_url + "/oauth/verify"
             headers = {
                 'Authorization': 'Bearer ' + tokens['access_token'],
-                'Host': 'login.eveonline.com'
+                'Host': urlsplit(self.sso_url).netloc
             }
             request = HTTPRequest(verify, headers=headers)
             try:
-                response = await http_client.fetch(request)
+                response = await self.fetch(request, 'verify')
             except HTTPError as e:
                 logging.error(e)
             else:
@@ -133,63 +305,102 @@ class App(Application):
 
                     user['access_token']  = tokens['access_token']
                     user['refresh_token'] = tokens['refresh_token']
+                    user['expires_at']    = time() + tokens['expires_in']
 
                     self.users[user_id].update(user)
+                    self.users.save(user_id)
+                    self.tokens.schedule(user_id, user['expires_at'])
                 except Exception as e:
                     logging.error(f"ERROR OCCURRED: {e}")
                 else:
                     ''' 4 '''
                     return user_id
 
-    async def character(self, user_id, uri, method):
+    def character_request(self, user_id, uri, method, headers=None):
         """
-        Fetch specific character info, re-authorize
-        via API if access token became obsolete.
+        Build request for the specific character info
+        with the character's current access token.
 
         :argument user_id: user id
         :argument uri:     uri to fetch (/location/ in our case)
         :argument method:  HTTP method
-        :return:  fetched data (dict with location info)
+        :argument headers: additional request headers
+        :return: HTTPRequest object
         """
         user = self.users[user_id]
         url = (
-            "https://crest-tq.eveonline.com/characters/" +
+            self.api_url + "/characters/" +
             str(user['CharacterID']) + uri
         )
-        headers = {
-            'Authorization': 'Bearer ' + user['access_token']
-        }
-        request = HTTPRequest(
+        headers = dict(headers or {})
+        headers['Authorization'] = 'Bearer ' + user['access_token']
+        return HTTPRequest(
             url,
             headers=headers,
             method=method,
             allow_nonstandard_methods=(method != 'GET')
         )
+
+    async def character_response(self, user_id, uri, method, headers=None):
+        """
+        Fetch specific character info, re-authorize
+        via API if access token became obsolete.
+
+        Tokens of tracked characters are renewed in advance by the
+        `self.tokens`, so refreshing here is only a fallback.
+
+        :argument user_id: user id
+        :argument uri:     uri to fetch (/location/ in our case)
+        :argument method:  HTTP method
+        :argument headers: additional request headers, such as If-None-Match
+        :return:  HTTPResponse object, including "304 Not Modified" one
+        for conditional requests, None in case of failure
+        """
+        if self.tokens.expired(user_id):
+            # No sense in making a request which will surely fail
+            await self.tokens.refresh(user_id)
+        request = self.character_request(user_id, uri, method, headers)
         logging.debug('Fetching character related data')
         try:
-            response = await http_client.fetch(request)
+            response = await self.fetch(request, 'character')
         except HTTPError as e:
-            if e.code == 401:
+            if e.code == 304:
+                return e.response
+            elif e.code == 401:
                 logging.warning("Access token became obsolete, re-authorizing.")
 
-                # Authorize again using refresh_token
-                user_id = await self.authorize(
-                    user['refresh_token'], refresh=True
-                )
-                # And then refresh user object
-                user = self.users[user_id]
-                headers['Authorization'] = 'Bearer ' + user['access_token']
+                # Authorize again using refresh_token, or wait
+                # for the refresh which is already in progress
+                if not await self.tokens.refresh(user_id):
+                    return
+                # And then build the request with the new token
+                request = self.character_request(user_id, uri, method, headers)
                 try:
-                    response = await http_client.fetch(request)
+                    response = await self.fetch(request, 'character')
                 except HTTPError as e:
+                    if e.code == 304:
+                        return e.response
                     logging.error(f"UNEXPECTED ERROR OCCURRED: {e}")
                 else:
-                    return json_decode(response.body)
+                    return response
             elif e.code == 503:
                 if e.response:
                     logging.warning(e.response)
         else:
             logging.debug(response)
+            return response
+
+    async def character(self, user_id, uri, method):
+        """
+        Fetch specific character info.
+
+        :argument user_id: user id
+        :argument uri:     uri to fetch (/location/ in our case)
+        :argument method:  HTTP method
+        :return:  fetched data (dict with location info)
+        """
+        response = await self.character_response(user_id, uri, method)
+        if response is not None:
             return json_decode(response.body)
 
 
@@ -213,6 +424,8 @@ and fill it as follows:
     client_key    = "your_eve_app_key"
     redirect_uri  = "http://your-domain-or-ip.com"
     cookie_secret = "my_secret_secret"
+    db_path       = "/home/wormhole-tracker/wormhole-tracker.db"  # optional
+    processes     = 1  # optional, 0 means one process per CPU core
 
 For example:
 
@@ -233,28 +446,60 @@ as command line arguments as follows:
         logging.error(error)
         sys.exit(1)
 
+    if options.processes != 1 and not options.db_path:
+        logging.error("Running in several processes requires db_path.")
+        sys.exit(1)
+
     settings['cookie_secret'] = options.cookie_secret
-    app = App(options.client_id, options.client_key, routes, settings)
+    sockets = bind_sockets(options.port)
+    if options.processes != 1:
+        # Use one IOLoop per process, `0` means one process per CPU core.
+        # Everything touching IOLoop must be created after the fork.
+        fork_processes(options.processes)
+        ipc_dir = options.ipc_dir
+    else:
+        ipc_dir = None
+
+    if options.db_path:
+        storage = SQLiteStorage(options.db_path)
+    else:
+        # Inactive users are still evicted from memory to the disk
+        logging.warning("No db_path configured, users will be lost on exit.")
+        spill_fd, spill_path = mkstemp(prefix='wormhole-tracker-')
+        close(spill_fd)
+        storage = SQLiteStorage(spill_path)
+    app = App(
+        options.client_id, options.client_key, routes, settings,
+        storage, ipc_dir, max_users=options.max_users
+    )
     http_server = HTTPServer(app, xheaders=True)
+    http_server.add_sockets(sockets)
+    # Alarm signal can only be handled by the main thread
+    app.profiler.watch()
 
-    # TODO: uncomment when obtain db
-    #http_server.bind(options.port)
-    #http_server.start(0)  # Use one IOLoop per CPU core
-    http_server.listen(options.port)
+    def shutdown():
+        IOLoop.current().stop()
+        app.http_client.close()
+        app.users.flush()
+        app.maps.release()
+        app.serializer.close()
+        storage.close()
+        if not options.db_path:
+            remove(spill_path)
+        if app.channel:
+            app.channel.close()
 
     try:
         logging.info("Starting server...")
         IOLoop.current().start()
     except (SystemExit, KeyboardInterrupt):
         logging.info("Stopping server.")
-        IOLoop.current().stop()
-        http_client.close()
+        shutdown()
         sys.exit()
 
     except Exception as e:
         logging.error(e)
-        IOLoop.current().stop()
-        http_client.close()
+        shutdown()
         sys.exit(1)
 
 if __name__ == '__main__':
@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of wormhole-tracker package released under
+# the GNU GPLv3 license. See the LICENSE file for more information.
+
+from collections import namedtuple
+from secrets import token_hex
+
+from wormhole_tracker.auxiliaries import s
+
+Session = namedtuple('Session', 'user_id token')
+
+
+class Sessions(object):
+    """
+    Server-side index of signed in sessions.
+
+    Auth cookie holds "<user id>:<session token>", and every user keeps
+    tokens of the sessions which are still signed in, so the cookie is
+    only verified once per request or websocket connection, while the
+    sign out from one tab revokes the session everywhere with a simple
+    lookup. Tokens are stored with the user, so the index is shared
+    between worker processes.
+    """
+    def __init__(self, app, max_sessions=16):
+        self.application = app
+        self.max_sessions = max_sessions
+
+    def start(self, user_id):
+        """
+        :argument user_id: id of the user who has just signed in
+        :return: auth cookie value of the new session
+        """
+        token = token_hex(16)
+        user = self.application.users[user_id]
+        # Forget the oldest sessions, e.g. left in other browsers
+        user['sessions'] = (
+            user.get('sessions', []) + [token]
+        )[-self.max_sessions:]
+        self.application.users.save(user_id)
+        self.application.notify(evict=user_id)
+        return f"{user_id}:{token}"
+
+    def resolve(self, cookie):
+        """
+        :argument cookie: auth cookie value, already verified
+        :return: Session object, None if the session is not signed in
+        """
+        if not cookie:
+            return None
+        user_id, _, token = s(cookie).rpartition(':')
+        session = Session(user_id, token)
+        if self.valid(session):
+            return session
+        return None
+
+    def valid(self, session):
+        """
+        :argument session: Session object
+        :return: True if the session is still signed in
+        """
+        user = self.application.users.get(session.user_id)
+        return user is not None and session.token in user.get('sessions', ())
+
+    def end(self, session):
+        """
+        Sign the session out and close its websocket connections.
+
+        :argument session: Session object
+        """
+        user = self.application.users.get(session.user_id)
+        if user is not None and session.token in user.get('sessions', ()):
+            user['sessions'].remove(session.token)
+            self.application.users.save(session.user_id)
+            self.application.notify(evict=session.user_id)
+        self.check(session.user_id)
+
+    def check(self, user_id):
+        """
+        Close the character's websocket connections,
+        which sessions have been signed out.
+
+        :argument user_id: user id
+        """
+        for socket in list(self.application.connections.sockets(user_id)):
+            if not self.valid(socket.current_user):
+                socket.close()
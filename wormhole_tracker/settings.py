@@ -7,9 +7,14 @@ from base64 import b64encode
 from os import urandom
 from pkg_resources import resource_filename
 
+from wormhole_tracker.assets import urls
+from wormhole_tracker.handlers.static import StaticHandler
+
 
 settings = {
     'static_path': resource_filename('wormhole_tracker', 'static'),
+    'static_handler_class': StaticHandler,
+    'ui_methods': {'assets': urls},
     'template_path': resource_filename('wormhole_tracker', 'templates'),
     #'cookie_secret': b64encode(urandom(24)).strip(),
     'login_url': '/sign',
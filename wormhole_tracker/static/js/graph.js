@@ -9,12 +9,24 @@ var ForceLayout = function (svg, force) {
             force:     Predefined D3.js force layout object.
 
         Attributes:
+            pilot:     Character's id, to tell own moves on shared maps.
             current:   Character's current location.
+            version:   Version of the server's map this graph reflects.
             nodes:     List with objects used for drawing D3.js nodes.
             links:     List with objects used for drawing D3.js links.
-
-            svg_node:  D3.js node object. Replaces on every redraw.
-            svg_link:  D3.js link object. Replaces on every redraw.
+            index:     Object with system names as keys and nodes as values.
+            link_index: Object with "source|target" names as keys and links
+                       as values.
+            on_move:   Callback receiving a list of nodes user has dragged.
+
+            canvas_threshold:  Amount of nodes, above which the map is
+                               drawn on the canvas instead of SVG.
+            canvas:    D3.js selection of the canvas, hidden in SVG mode.
+            mode:      Either 'svg' or 'canvas'.
+            dragged:   Node being dragged on the canvas.
+
+            svg_node:  D3.js selection of drawn nodes.
+            svg_link:  D3.js selection of drawn links.
      */
 
     var self = this;
@@ -22,12 +34,34 @@ var ForceLayout = function (svg, force) {
     self.svg       = svg;
     self.force     = force;
 
+    self.pilot     = '';
     self.current   = '';
+    self.version   = 0;
     self.nodes     = [];
     self.links     = [];
-
-    self.svg_link = self.svg.selectAll(".link");
-    self.svg_node = self.svg.selectAll(".node");
+    self.index     = {};
+    self.link_index = {};
+    self.on_move   = null;
+
+    self.canvas_threshold = 1000;
+    self.canvas    = d3.select(svg.node().parentNode)
+        .append("canvas")
+        .attr("width", svg.attr("width"))
+        .attr("height", svg.attr("height"))
+        .style("display", "none");
+    self.context   = self.canvas.node().getContext("2d");
+    self.mode      = 'svg';
+    self.frame     = null;
+    self.dragged   = null;
+
+    // Separate layers keep links under the nodes added later
+    self.link_layer = self.svg.append("g");
+    self.node_layer = self.svg.append("g");
+    self.svg_link = self.link_layer.selectAll(".link");
+    self.svg_node = self.node_layer.selectAll(".node");
+
+    var name = function (d) { return d.name; };
+    var link_key = function (d) { return d.source.name + '|' + d.target.name; };
 
     self.bind_links = function(links) {
         /*
@@ -39,127 +73,341 @@ var ForceLayout = function (svg, force) {
          */
         for (var i in links) {
             var link = links[i];
-            for (var n in self.nodes) {
-                var node = self.nodes[n];
-                if (link.source.name === node.name) {
-                link.source = node;
-                }
-                else if (link.target.name === node.name) {
-                    link.target = node;
+            link.source = self.index[link.source.name] || link.source;
+            link.target = self.index[link.target.name] || link.target;
+        }
+    };
+
+    self.find = function (name) {
+        return self.index[name] || null;
+    };
+
+    self.add_nodes = function (nodes) {
+        for (var i in nodes) {
+            var node = nodes[i];
+            if (!(node.name in self.index)) {
+                self.index[node.name] = node;
+                self.nodes.push(node);
+            }
+        }
+    };
+
+    self.add_links = function (links) {
+        self.bind_links(links);
+        for (var i in links) {
+            var link = links[i],
+                key = link_key(link);
+            if (!(key in self.link_index)) {
+                self.link_index[key] = link;
+                self.links.push(link);
+            }
+        }
+    };
+
+    self.remove_links = function (links) {
+        /*
+            Remove expired links, in either direction.
+
+            Arguments:
+                links: A list of links like this:
+                    [{'source': {'name': 'Tama'}, 'target': {'name': 'Kedama'}]
+         */
+        var removed = false;
+        for (var i in links) {
+            var link = links[i],
+                keys = [link_key(link),
+                        link.target.name + '|' + link.source.name];
+            for (var k in keys) {
+                if (keys[k] in self.link_index) {
+                    remove(self.links, self.link_index[keys[k]]);
+                    delete self.link_index[keys[k]];
+                    removed = true;
                 }
             }
         }
+        return removed;
+    };
+
+    self.place = function (positions) {
+        /*
+            Move nodes to the positions saved on the server.
+
+            Arguments:
+                positions: A list of positions like this:
+                    [{'name': 'Tama', 'x': 120, 'y': 80}]
+         */
+        for (var i in positions) {
+            var position = positions[i],
+                node = self.find(position.name);
+            if (node) {
+                node.x = node.px = position.x;
+                node.y = node.py = position.y;
+                node.fixed = true;
+            }
+        }
     };
 
     self.clear_svg = function () {
-        self.svg.selectAll("*").remove();
+        self.link_layer.selectAll("*").remove();
+        self.node_layer.selectAll("*").remove();
+        self.svg_link = self.link_layer.selectAll(".link");
+        self.svg_node = self.node_layer.selectAll(".node");
+        self.context.clearRect(
+            0, 0, self.canvas.attr("width"), self.canvas.attr("height")
+        );
     };
 
-    self.draw = function () {
-        console.log(self);
+    self.moved = function (d) {
+        // Report only the node that has actually been moved
+        if (self.on_move) {
+            self.on_move([{'name': d.name, 'x': d.x, 'y': d.y}]);
+        }
+    };
 
-        self.force.nodes(self.nodes)
-             .links(self.links)
-             .start();
+    self.switch_mode = function () {
+        var mode = self.nodes.length > self.canvas_threshold ? 'canvas' : 'svg';
+        if (mode !== self.mode) {
+            self.clear_svg();
+            self.mode = mode;
+            self.svg.style("display", mode === 'svg' ? null : "none");
+            self.canvas.style("display", mode === 'canvas' ? null : "none");
+        }
+    };
 
-        self.svg_link = self.svg.selectAll(".link")
-            .data(self.links)
-          .enter().append("line")
+    self.draw_svg = function () {
+        // Only entering elements are created and only exiting
+        // ones are removed, the rest is left as it is
+        self.svg_link = self.svg_link.data(self.links, link_key);
+        self.svg_link.enter().append("line")
             .attr("class", "link")
             .style("stroke-width", function(d) { return 4; });
+        self.svg_link.exit().remove();
 
         var drag = self.force.drag()
             .on("dragstart", function (d) {
                 d.x = d3.event.x;
                 d.y = d3.event.y;
                 d3.select(this).classed("fixed", d.fixed = true);
-            });
+            })
+            .on("dragend", self.moved);
 
-        self.svg_node = self.svg.selectAll(".node")
-            .data(self.nodes)
-            .enter().append('g')
+        self.svg_node = self.svg_node.data(self.nodes, name);
+        var entered = self.svg_node.enter().append('g')
             .attr("class", "node")
             .call(drag);
+        entered.append("circle")
+            .attr("r", 5);
+        entered.append("text")
+            .attr("dx", 12)
+            .attr("dy", ".35em")
+            .attr("fill", "aliceblue");
+        self.svg_node.exit().remove();
+
+        self.style_svg();
+    };
 
-        self.svg_node.append("circle")
-            .attr("r", 5)
+    self.style_svg = function () {
+        // Current system is highlighted
+        self.svg_node.select("circle")
             .style("fill", function(d) {
                 if (d.name === self.current) {
                     return 'tomato';
                 }
                 return 'beige';
             });
-
-        self.svg_node.append("text")
-            .attr("dx", 12)
-            .attr("dy", ".35em")
-            .attr("fill", "aliceblue")
+        self.svg_node.select("text")
             .text(function (d) {
                 if (d.name === self.current) {
                     return '[ ' + d.name + ' ]';
                 }
                 return d.name;
             });
+    };
 
-        self.force.on("tick", function () {
-            self.svg_link.attr("x1", function (d) { return d.source.x; })
-                .attr("y1", function (d) { return d.source.y; })
-                .attr("x2", function (d) { return d.target.x; })
-                .attr("y2", function (d) { return d.target.y; });
-            self.svg_node.attr("transform", function (d) {
-                return "translate(" + d.x + "," + d.y + ")";
-            });
+    self.tick_svg = function () {
+        self.svg_link.attr("x1", function (d) { return d.source.x; })
+            .attr("y1", function (d) { return d.source.y; })
+            .attr("x2", function (d) { return d.target.x; })
+            .attr("y2", function (d) { return d.target.y; });
+        self.svg_node.attr("transform", function (d) {
+            return "translate(" + d.x + "," + d.y + ")";
         });
     };
 
-    self.save = function () {
-        self.nodes = self.svg_node.data();
-        self.links = self.svg_link.data();
-    };
+    self.render_canvas = function () {
+        /*
+            Draw the whole map on the canvas, at most once per frame.
+         */
+        self.frame = null;
+        var context = self.context,
+            current = self.find(self.current),
+            i, node, link;
+
+        context.clearRect(
+            0, 0, self.canvas.attr("width"), self.canvas.attr("height")
+        );
+
+        context.beginPath();
+        for (i = 0; i < self.links.length; i++) {
+            link = self.links[i];
+            context.moveTo(link.source.x, link.source.y);
+            context.lineTo(link.target.x, link.target.y);
+        }
+        context.strokeStyle = '#666';
+        context.lineWidth = 4;
+        context.stroke();
+
+        context.beginPath();
+        for (i = 0; i < self.nodes.length; i++) {
+            node = self.nodes[i];
+            context.moveTo(node.x + 5, node.y);
+            context.arc(node.x, node.y, 5, 0, 2 * Math.PI);
+        }
+        context.fillStyle = 'beige';
+        context.fill();
+        context.strokeStyle = '#333';
+        context.lineWidth = 1.5;
+        context.stroke();
+
+        if (current) {
+            context.beginPath();
+            context.arc(current.x, current.y, 5, 0, 2 * Math.PI);
+            context.fillStyle = 'tomato';
+            context.fill();
+            context.stroke();
+        }
 
+        context.fillStyle = 'aliceblue';
+        context.font = '12px sans-serif';
+        context.textBaseline = 'middle';
+        for (i = 0; i < self.nodes.length; i++) {
+            node = self.nodes[i];
+            context.fillText(
+                node === current ? '[ ' + node.name + ' ]' : node.name,
+                node.x + 12, node.y
+            );
+        }
+    };
 
-    self.update = function (data) {
-        if (data.current) {
-            self.current = data.current;
+    self.tick_canvas = function () {
+        if (self.frame === null) {
+            self.frame = window.requestAnimationFrame(self.render_canvas);
         }
-        if (data.nodes) {
-            self.nodes = self.nodes.concat(data.nodes);
+    };
+
+    self.canvas.call(d3.behavior.drag()
+        .on("dragstart", function () {
+            // Pick the node under the pointer, if there is one
+            var point = d3.mouse(this),
+                node = d3.geom.quadtree()
+                    .x(function (d) { return d.x; })
+                    .y(function (d) { return d.y; })(self.nodes)
+                    .find(point);
+            if (node && Math.abs(node.x - point[0]) < 8
+                     && Math.abs(node.y - point[1]) < 8) {
+                self.dragged = node;
+                node.fixed = true;
+            }
+        })
+        .on("drag", function () {
+            var node = self.dragged;
+            if (node) {
+                node.x = node.px = d3.event.x;
+                node.y = node.py = d3.event.y;
+                self.force.resume();
+            }
+        })
+        .on("dragend", function () {
+            if (self.dragged) {
+                self.moved(self.dragged);
+                self.dragged = null;
+            }
+        }));
+
+    self.restyle = function () {
+        /*
+            Highlight the current system without reheating the layout.
+         */
+        if (self.mode === 'svg') {
+            self.style_svg();
         }
-        if (data.links) {
-            self.bind_links(data.links);
-            self.links = self.links.concat(data.links);
+        else {
+            self.tick_canvas();
         }
-        self.clear_svg();
-        self.draw();
-        self.save();
     };
 
-    /*
-    self.redraw = function () {
-        self.clear_svg();
-        self.draw();
-        self.save();
+    self.draw = function () {
+        self.switch_mode();
+
+        // Nodes which already have positions keep them
+        self.force.nodes(self.nodes)
+             .links(self.links)
+             .start();
+
+        if (self.mode === 'svg') {
+            self.draw_svg();
+            self.force.on("tick", self.tick_svg);
+        }
+        else {
+            self.force.on("tick", self.tick_canvas);
+        }
     };
-    */
 
-    self.backup = function () {
-        self.save();
-        return {
-            'current': self.current,
-            'nodes'  : self.nodes,
-            'links'  : self.links
+    self.update = function (data) {
+        // Layout only has to be restarted when nodes or links have
+        // been added or removed, moving pilot just restyles the map
+        var redraw = false,
+            restyle = false;
+
+        // Version may be 0, e.g. in the snapshot of the fresh map
+        if ('version' in data) {
+            self.version = data.version;
+        }
+        // On shared maps updates may come from other pilots
+        if (data.current && (!data.pilot || data.pilot === self.pilot)) {
+            restyle = data.current !== self.current;
+            self.current = data.current;
+        }
+        if (data.nodes && data.nodes.length) {
+            self.add_nodes(data.nodes);
+            redraw = true;
+        }
+        if (data.links && data.links.length) {
+            self.add_links(data.links);
+            redraw = true;
+        }
+        if (data.removed && data.removed.length) {
+            redraw = self.remove_links(data.removed) || redraw;
+        }
+        if (data.positions) {
+            self.place(data.positions);
+        }
+        if (redraw) {
+            self.draw();
+        }
+        else {
+            if (restyle) {
+                self.restyle();
+            }
+            if (data.positions && data.positions.length) {
+                self.force.resume();
+            }
         }
     };
 
     self.clear = function () {
+        self.version = 0;
         self.current = '';
         self.nodes   = [];
         self.links   = [];
+        self.index   = {};
+        self.link_index = {};
     };
 
     self.reset = function () {
         self.clear();
         self.clear_svg();
+        self.force.nodes(self.nodes).links(self.links);
     }
 
 };
@@ -181,6 +429,3 @@ var svg = d3.select("#path")
     .attr("height", height);
 
 var graph = new ForceLayout(svg, force);
-
-
-
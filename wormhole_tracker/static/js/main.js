@@ -35,18 +35,52 @@ $(document).ready(function() {
         WebSocket = MozWebSocket;
     }
     if (WebSocket) {
-        var ws = new WebSocket("ws://" + window.location.host + "/poll");
+        // Map messages come as binary frames if the server
+        // supports compact protocol, everything else is JSON
+        var ws = new WebSocket(
+            "ws://" + window.location.host + "/poll", [Protocol.name]
+        );
+        ws.binaryType = 'arraybuffer';
 
         var send = function(message) {
             ws.send(JSON.stringify(message))
         };
 
+        // Set while waiting for the reply to the 'sync' request,
+        // updates coming meanwhile will be delivered with it.
+        var syncing = false;
+
+        var receive = function(data) {
+            if (syncing || data.version <= graph.version) {
+                return;
+            }
+            if (data.version > graph.version + 1) {
+                // Some changes were missed, ask for everything since ours
+                syncing = true;
+                send(['sync', graph.version]);
+                return;
+            }
+            graph.update(data);
+        };
+
+        graph.pilot = $('#path').attr('data-pilot');
+
+        graph.on_move = function(nodes) {
+            send(['move', nodes]);
+        };
+
         ws.onopen = function() {
             console.warn("WS connection established");
         };
         ws.onmessage = function(evt) {
             //console.debug(evt.data);
-            var message = $.parseJSON(evt.data);
+            var message;
+            if (evt.data instanceof ArrayBuffer) {
+                message = Protocol.decode(evt.data);
+            }
+            else {
+                message = $.parseJSON(evt.data);
+            }
             //console.log(data);
             var type = message[0],
                 data = message[1];
@@ -57,28 +91,31 @@ $(document).ready(function() {
                 warning();
                 if (data) {
                     console.log(data);
-                    graph.update(data);
+                    receive(data);
                 }
             }
+            else if (type === 'sync') {
+                syncing = false;
+                graph.update(data);
+            }
             else if (type === 'recover') {
+                syncing = false;
+                graph.reset();
                 graph.update(data);
             }
             else if (type === 'warning') {
                 warning(data);
             }
+            else if (type === 'fleet') {
+                // Invite of the fleet which map is shown, to pass it around
+                $('#fleet').val(data.invite || '');
+            }
         };
         ws.onclose = function() {
             console.warn("WS connection closed");
             untrack();
         };
 
-        function send_backup() {
-            var backup = graph.backup();
-            send(['backup', backup]);
-        }
-
-        setInterval(send_backup, 3000);
-
 
         // Button event handlers
 
@@ -95,6 +132,14 @@ $(document).ready(function() {
             untrack();
             graph.reset();
         }));
+        $('#join').on('click', (function() {
+            // Empty invite starts the new fleet
+            send(['fleet', $.trim($('#fleet').val())]);
+        }));
+        $('#leave').on('click', (function() {
+            $('#fleet').val('');
+            send(['fleet', null]);
+        }));
     } else {
         alert("WebSocket not supported");
     }
@@ -0,0 +1,109 @@
+// This file is part of wormhole-tracker package released under
+// the GNU GPLv3 license. See the LICENSE file for more information.
+
+var Protocol = {
+    /*
+        Decoder of the compact binary websocket protocol,
+        see wormhole_tracker/protocol.py for the format.
+
+        Attributes:
+            name:   Websocket subprotocol to ask the server for.
+            types:  Message types by their codes.
+            none:   Index meaning the string is absent.
+     */
+
+    name: 'wormhole-tracker.compact',
+    types: {1: 'recover', 2: 'sync', 3: 'update'},
+    none: 0xFFFFFFFF,
+
+    decode: function (buffer) {
+        /*
+            Decode binary frame into the same [type, data]
+            message the server would send as JSON.
+
+            Arguments:
+                buffer:  ArrayBuffer with the frame.
+         */
+        var view = new DataView(buffer),
+            decoder = new TextDecoder('utf-8'),
+            offset = 0,
+            strings = [],
+            data = {},
+            type, count, i;
+
+        var u8 = function () {
+            offset += 1;
+            return view.getUint8(offset - 1);
+        };
+        var u16 = function () {
+            offset += 2;
+            return view.getUint16(offset - 2, true);
+        };
+        var u32 = function () {
+            offset += 4;
+            return view.getUint32(offset - 4, true);
+        };
+        var f32 = function () {
+            offset += 4;
+            return view.getFloat32(offset - 4, true);
+        };
+        var string = function () {
+            var index = u32();
+            return index === Protocol.none ? '' : strings[index];
+        };
+
+        type = Protocol.types[u8()];
+        data.version = u32();
+
+        count = u32();
+        for (i = 0; i < count; i++) {
+            var length = u16();
+            strings.push(decoder.decode(new Uint8Array(buffer, offset, length)));
+            offset += length;
+        }
+
+        data.current = string();
+        var pilot = string();
+        if (pilot) {
+            data.pilot = pilot;
+        }
+
+        data.nodes = [];
+        count = u32();
+        for (i = 0; i < count; i++) {
+            var node = {'name': string()};
+            if (u8()) {
+                node.x = f32();
+                node.y = f32();
+                node.fixed = true;
+            }
+            data.nodes.push(node);
+        }
+
+        data.links = [];
+        count = u32();
+        for (i = 0; i < count; i++) {
+            data.links.push({
+                'source': {'name': string()},
+                'target': {'name': string()}
+            });
+        }
+
+        data.positions = [];
+        count = u32();
+        for (i = 0; i < count; i++) {
+            data.positions.push({'name': string(), 'x': f32(), 'y': f32()});
+        }
+
+        data.removed = [];
+        count = u32();
+        for (i = 0; i < count; i++) {
+            data.removed.push({
+                'source': {'name': string()},
+                'target': {'name': string()}
+            });
+        }
+
+        return [type, data];
+    }
+};
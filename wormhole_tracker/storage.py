@@ -0,0 +1,723 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of wormhole-tracker package released under
+# the GNU GPLv3 license. See the LICENSE file for more information.
+
+import logging
+import sqlite3
+from collections import OrderedDict, deque
+from datetime import datetime
+from time import time
+
+from tornado.escape import json_decode, json_encode
+from tornado.ioloop import PeriodicCallback
+
+from wormhole_tracker.auxiliaries import Jumps, Router, s
+
+
+class Storage(object):
+    """
+    Storage backend interface.
+
+    Keeps nothing by itself, so the application works purely in memory
+    when there is no database configured. Real backends override `load`,
+    `load_map`, `load_jumps`, `store` and `close` methods, backends which
+    can be `shared` between worker processes also override `lease`,
+    `holder`, `release`, `put_state`, `pop_state` and `count_states`
+    methods.
+
+    Maps are kept apart from users, since user's data may be changed by
+    any process, while the map is only changed by the process owning it,
+    see `wormhole_tracker.maps.Maps`.
+
+    Jump history belongs to the character rather than to the map, so it
+    is kept whichever map the character feeds, and survives map resets.
+    """
+    shared = False
+
+    def load(self, user_id):
+        """
+        :argument user_id: user's id
+        :return: dict with stored user data, None if there is nothing stored
+        """
+        return None
+
+    def load_map(self, key):
+        """
+        :argument key: map key, user's id or "fleet:<name>"
+        :return: dict with stored router data, None if there is nothing
+        stored
+        """
+        return None
+
+    def load_jumps(self, user_id):
+        """
+        :argument user_id: user's id
+        :return: dict with stored jumps data, see `Jumps.dump`, None if
+        there is nothing stored
+        """
+        return None
+
+    def store(self, users, maps=(), jumps=()):
+        """
+        Store several users, maps and jump histories at once.
+
+        :argument users: list of (user_id, user data) tuples
+        :argument maps:  list of (map key, router data) tuples
+        :argument jumps: list of (user_id, jumps data) tuples
+        """
+
+    def lease(self, user_id, owner, ttl):
+        """
+        Try to become the only process which polls the character.
+
+        :argument user_id: user's id
+        :argument owner:   id of the process, requesting the lease
+        :argument ttl:     lease lifetime, in seconds
+        :return: True if the lease is acquired or renewed, False if it is
+        held by the other process or the storage is busy
+        """
+        return True
+
+    def holder(self, user_id):
+        """
+        :argument user_id: user's id
+        :return: id of the process holding the lease, None if nobody does
+        """
+        return None
+
+    def release(self, user_id, owner):
+        """
+        Give the lease up, so any other process can take it right away.
+
+        :argument user_id: user's id
+        :argument owner:   id of the process, holding the lease
+        """
+
+    def put_state(self, state, created, ttl, max_size):
+        """
+        Store OAuth state token, forgetting the expired ones.
+
+        :argument state:    state token
+        :argument created:  token creation timestamp
+        :argument ttl:      token lifetime, in seconds
+        :argument max_size: maximum amount of stored tokens, the oldest
+        ones are evicted to keep within it
+        :return: tuple with amounts of expired and evicted tokens
+        """
+        raise NotImplementedError
+
+    def pop_state(self, state):
+        """
+        :argument state: state token
+        :return: token creation timestamp, None if there is no such token
+        """
+        raise NotImplementedError
+
+    def count_states(self):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class SQLiteStorage(Storage):
+    """
+    Keeps every user and every map as a single JSON document in the local
+    SQLite database.
+
+    Database may be shared by several worker processes, each of them
+    opening its own connection, so it also keeps polling leases and
+    OAuth state tokens. Every character's jumps are kept in a single row,
+    as packed arrays, rewritten on flush when the character has jumped.
+
+    Amount of stored state tokens is kept in the counts table, and is
+    updated by triggers on every insert and delete, so it is never
+    counted over the whole table.
+    """
+    shared = True
+    lease_timeout = 0.05  # Seconds to wait for the busy database
+
+    def __init__(self, path):
+        # Wait for other processes' transactions instead of failing
+        self.connection = sqlite3.connect(path, timeout=10)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        # Leases are taken on the IOLoop, so they never wait for long,
+        # the lease which can not be taken right away is not taken
+        self.lease_connection = sqlite3.connect(
+            path, timeout=self.lease_timeout
+        )
+        with self.connection:
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS users ("
+                "user_id TEXT PRIMARY KEY, data TEXT NOT NULL)"
+            )
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS maps ("
+                "key TEXT PRIMARY KEY, data TEXT NOT NULL)"
+            )
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS leases ("
+                "user_id TEXT PRIMARY KEY, owner INTEGER NOT NULL, "
+                "expires REAL NOT NULL)"
+            )
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS states ("
+                "state TEXT PRIMARY KEY, created REAL NOT NULL)"
+            )
+            self.connection.execute(
+                "CREATE INDEX IF NOT EXISTS states_created "
+                "ON states (created)"
+            )
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS counts ("
+                "name TEXT PRIMARY KEY, value INTEGER NOT NULL)"
+            )
+            self.connection.execute(
+                "INSERT OR IGNORE INTO counts (name, value) "
+                "VALUES ('states', 0)"
+            )
+            self.connection.execute(
+                "CREATE TRIGGER IF NOT EXISTS states_inserted "
+                "AFTER INSERT ON states BEGIN "
+                "UPDATE counts SET value = value + 1 WHERE name = 'states'; "
+                "END"
+            )
+            self.connection.execute(
+                "CREATE TRIGGER IF NOT EXISTS states_deleted "
+                "AFTER DELETE ON states BEGIN "
+                "UPDATE counts SET value = value - 1 WHERE name = 'states'; "
+                "END"
+            )
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS jumps ("
+                "user_id TEXT PRIMARY KEY, times BLOB NOT NULL, "
+                "systems BLOB NOT NULL, names TEXT NOT NULL)"
+            )
+
+    def load(self, user_id):
+        row = self.connection.execute(
+            "SELECT data FROM users WHERE user_id = ?", (user_id,)
+        ).fetchone()
+        if row:
+            return json_decode(row[0])
+
+    def load_map(self, key):
+        row = self.connection.execute(
+            "SELECT data FROM maps WHERE key = ?", (key,)
+        ).fetchone()
+        if row:
+            return json_decode(row[0])
+
+    def load_jumps(self, user_id):
+        row = self.connection.execute(
+            "SELECT times, systems, names FROM jumps WHERE user_id = ?",
+            (user_id,)
+        ).fetchone()
+        if row:
+            return {
+                'times': row[0], 'systems': row[1],
+                'names': json_decode(row[2]),
+            }
+
+    def store(self, users, maps=(), jumps=()):
+        # One transaction for the whole batch
+        with self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO users (user_id, data) VALUES (?, ?)",
+                [(user_id, json_encode(data)) for user_id, data in users]
+            )
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO maps (key, data) VALUES (?, ?)",
+                [(key, json_encode(data)) for key, data in maps]
+            )
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO jumps (user_id, times, systems, names) "
+                "VALUES (?, ?, ?, ?)",
+                [
+                    (user_id, data['times'], data['systems'],
+                     json_encode(data['names']))
+                    for user_id, data in jumps
+                ]
+            )
+
+    def lease(self, user_id, owner, ttl):
+        now = time()
+        try:
+            with self.lease_connection:
+                # Renew our own lease or take over the expired one
+                cursor = self.lease_connection.execute(
+                    "UPDATE leases SET owner = ?, expires = ? "
+                    "WHERE user_id = ? AND (owner = ? OR expires < ?)",
+                    (owner, now + ttl, user_id, owner, now)
+                )
+                if cursor.rowcount:
+                    return True
+                cursor = self.lease_connection.execute(
+                    "INSERT OR IGNORE INTO leases (user_id, owner, expires) "
+                    "VALUES (?, ?, ?)",
+                    (user_id, owner, now + ttl)
+                )
+                return cursor.rowcount == 1
+        except sqlite3.OperationalError as e:
+            logging.debug(f"Failed to take lease {user_id}: {e}")
+            return False
+
+    def holder(self, user_id):
+        row = self.connection.execute(
+            "SELECT owner FROM leases WHERE user_id = ? AND expires >= ?",
+            (user_id, time())
+        ).fetchone()
+        if row:
+            return row[0]
+
+    def release(self, user_id, owner):
+        try:
+            with self.lease_connection:
+                self.lease_connection.execute(
+                    "DELETE FROM leases WHERE user_id = ? AND owner = ?",
+                    (user_id, owner)
+                )
+        except sqlite3.OperationalError as e:
+            # Lease expires by itself anyway
+            logging.warning(f"Failed to release lease {user_id}: {e}")
+
+    def put_state(self, state, created, ttl, max_size):
+        with self.connection:
+            expired = self.connection.execute(
+                "DELETE FROM states WHERE created <= ?", (created - ttl,)
+            ).rowcount
+            excess = self.count_states() - max_size + 1
+            evicted = 0
+            if excess > 0:
+                evicted = self.connection.execute(
+                    "DELETE FROM states WHERE state IN ("
+                    "SELECT state FROM states ORDER BY created LIMIT ?)",
+                    (excess,)
+                ).rowcount
+            # Replacing would not fire the delete trigger
+            self.connection.execute(
+                "DELETE FROM states WHERE state = ?", (state,)
+            )
+            self.connection.execute(
+                "INSERT INTO states (state, created) VALUES (?, ?)",
+                (state, created)
+            )
+        return expired, evicted
+
+    def pop_state(self, state):
+        with self.connection:
+            row = self.connection.execute(
+                "SELECT created FROM states WHERE state = ?", (state,)
+            ).fetchone()
+            if row:
+                self.connection.execute(
+                    "DELETE FROM states WHERE state = ?", (state,)
+                )
+                return row[0]
+
+    def count_states(self):
+        return self.connection.execute(
+            "SELECT value FROM counts WHERE name = 'states'"
+        ).fetchone()[0]
+
+    def close(self):
+        self.lease_connection.close()
+        self.connection.close()
+
+
+class ExpiringStates(object):
+    """
+    OAuth state tokens storage of the single process application.
+
+    Every token lives for `ttl` seconds, so tokens expire in the same order
+    they were issued, and the queue of issued tokens stays ordered by expiry
+    time just like a min-heap would, but with O(1) pushes and pops. Tokens
+    popped by /auth/ are left in the queue and skipped when their time
+    comes. Expired tokens are swept on every insert, and the oldest ones are
+    evicted once there are `max_size` of them, so abandoned logins can't
+    grow the storage without bound.
+
+    Mimics the part of the dict interface handlers use.
+
+    Attributes:
+        entries: dict with state tokens as keys and (created, expires)
+            tuples as values.
+
+        queue: deque of (expires, state token) tuples, the soonest to
+            expire on the left.
+
+        expired: amount of tokens expired unused.
+
+        evicted: amount of tokens evicted to keep within the `max_size`.
+    """
+    def __init__(self, ttl=600, max_size=10000):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.entries = {}
+        self.queue = deque()
+        self.expired = 0
+        self.evicted = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __setitem__(self, state, created):
+        now = time()
+        self.sweep(now)
+        while len(self.entries) >= self.max_size:
+            if self.forget(*self.queue.popleft()):
+                self.evicted += 1
+        self.entries[state] = (created, now + self.ttl)
+        self.queue.append((now + self.ttl, state))
+
+    def pop(self, state, default=None):
+        entry = self.entries.pop(state, None)
+        if entry is None:
+            return default
+        if entry[1] <= time():
+            self.expired += 1
+            return default
+        return entry[0]
+
+    def forget(self, expires, state):
+        """
+        :return: True if the token was still stored, False if it has been
+        popped or issued again meanwhile
+        """
+        entry = self.entries.get(state)
+        if entry is not None and entry[1] == expires:
+            del self.entries[state]
+            return True
+        return False
+
+    def sweep(self, now):
+        """
+        Forget all tokens expired by the `now` timestamp.
+        """
+        queue = self.queue
+        while queue and queue[0][0] <= now:
+            if self.forget(*queue.popleft()):
+                self.expired += 1
+        # Drop popped tokens from the queue once they outnumber stored ones
+        if len(queue) > 2 * len(self.entries) + 1024:
+            self.queue = deque(
+                item for item in queue
+                if self.entries.get(item[1], (None, None))[1] == item[0]
+            )
+
+
+class States(object):
+    """
+    OAuth state tokens storage, shared between worker processes
+    through the `storage`, since /auth/ redirect can be handled by
+    the other process than the one /signin has been handled by.
+
+    Tokens expire and are evicted just like in ExpiringStates,
+    but by the `storage`, and counters only include tokens
+    forgotten by this process.
+
+    Mimics the part of the dict interface handlers use.
+    """
+    def __init__(self, storage, ttl=600, max_size=10000):
+        self.storage = storage
+        self.ttl = ttl
+        self.max_size = max_size
+        self.expired = 0
+        self.evicted = 0
+
+    def __len__(self):
+        return self.storage.count_states()
+
+    def __setitem__(self, state, created):
+        expired, evicted = self.storage.put_state(
+            s(state), created.timestamp(), self.ttl, self.max_size
+        )
+        self.expired += expired
+        self.evicted += evicted
+
+    def pop(self, state, default=None):
+        created = self.storage.pop_state(s(state))
+        if created is None:
+            return default
+        if created + self.ttl <= time():
+            self.expired += 1
+            return default
+        return datetime.fromtimestamp(created)
+
+
+class Users(dict):
+    """
+    Users storage with lazy loading and write-behind saving.
+
+    Works as a usual dict of user objects, but falls back to the `storage`
+    on the first access to the user which is not in memory yet, so startup
+    time does not depend on the amount of stored users. Changed users are
+    only marked dirty by `save` and are written to the `storage` in batches
+    by the `flusher`, instead of doing a write on every jump.
+
+    Character's jump history is loaded on the first request of it, and is
+    appended to in memory by the process polling the character, see
+    `append_jump`, to be stored on the flush like the rest of user's data.
+
+    If `max_size` is given, only that many users are kept in memory: after
+    every flush the least recently active users are evicted, and loaded
+    from the `storage` again on their next visit. Users whose maps are
+    viewed or tracked right now are never evicted.
+
+    Every user holds the router of own map, and fleet maps are kept just
+    like users, but with router only. Routers are saved by `save_map` and
+    are stored apart from the rest of user's data.
+
+    Attributes:
+        storage: Storage backend object.
+
+        dirty: set of ids of users changed since the last flush.
+
+        dirty_maps: set of keys of maps changed since the last flush.
+
+        dirty_jumps: set of ids of users who have jumped since the last
+            flush.
+
+        activity: OrderedDict with ids of users in memory as keys,
+            the least recently active first.
+
+        evicted: amount of users evicted from memory.
+
+        flusher: tornado.ioloop.PeriodicCallback with `flush` method as a
+            callback.
+    """
+    def __init__(self, app, storage, flush_interval=10, max_size=None):
+        super(Users, self).__init__()
+        self.application = app
+        self.storage = storage
+        self.max_size = max_size
+        self.dirty = set()
+        self.dirty_maps = set()
+        self.dirty_jumps = set()
+        self.activity = OrderedDict()
+        self.evicted = 0
+        self.flusher = PeriodicCallback(self.flush, flush_interval * 1000)
+
+    def __missing__(self, user_id):
+        data = self.storage.load(user_id)
+        router = self.storage.load_map(user_id)
+        if data is None and router is None:
+            raise KeyError(user_id)
+        data = data or {}
+        if router is None:
+            data['router'] = Router(user_id, self.application)
+        else:
+            data['router'] = Router.restore(
+                user_id, self.application, router
+            )
+        self[user_id] = data
+        return data
+
+    def __setitem__(self, user_id, user):
+        super(Users, self).__setitem__(user_id, user)
+        self.activity[user_id] = None
+        self.activity.move_to_end(user_id)
+
+    def __contains__(self, user_id):
+        return self.get(user_id) is not None
+
+    def get(self, user_id, default=None):
+        try:
+            return self[user_id]
+        except KeyError:
+            return default
+
+    def cached(self, user_id):
+        """
+        :argument user_id: user's id or map key
+        :return: user object, None if it is not in memory
+        """
+        return dict.get(self, user_id)
+
+    def evict(self, user_id):
+        """
+        Load user's data from the storage again, when user is changed by
+        other process. User's router is kept, since other processes send
+        their map changes instead, see `wormhole_tracker.maps.Maps`, and
+        so are jumps, which are only recorded by the polling process.
+
+        :argument user_id: user's id
+        """
+        if user_id in self.dirty:
+            self.flush()
+        user = self.cached(user_id)
+        if user is None:
+            return
+        data = self.storage.load(user_id) or {}
+        data['router'] = user['router']
+        if 'jumps' in user:
+            data['jumps'] = user['jumps']
+        user.clear()
+        user.update(data)
+
+    def refresh(self, key):
+        """
+        Load the map from the storage again, if it has been changed
+        there since it was loaded, e.g. by its previous owner process.
+
+        :argument key: map key
+        """
+        user = self.cached(key)
+        if user is None:
+            return
+        data = self.storage.load_map(key)
+        if data is not None and data['version'] > user['router'].version:
+            user['router'] = Router.restore(key, self.application, data)
+
+    def jumps(self, user_id):
+        """
+        :argument user_id: user's id
+        :return: wormhole_tracker.auxiliaries.Jumps of the character,
+        None if there is no such user
+        """
+        user = self.get(user_id)
+        if user is None:
+            return None
+        if 'jumps' not in user:
+            data = self.storage.load_jumps(user_id)
+            user['jumps'] = Jumps.restore(data) if data else Jumps()
+        return user['jumps']
+
+    def refresh_jumps(self, user_id):
+        """
+        Load character's jumps from the storage again, if more of them
+        have been stored since they were loaded, e.g. by the process
+        which has polled the character.
+
+        :argument user_id: user's id
+        """
+        user = self.cached(user_id)
+        if user is None or 'jumps' not in user:
+            return
+        data = self.storage.load_jumps(user_id)
+        if data is not None:
+            jumps = Jumps.restore(data)
+            if len(jumps) > len(user['jumps']):
+                user['jumps'] = jumps
+
+    def append_jump(self, user_id, timestamp, system):
+        """
+        Record the character's jump, unless the character is still in the
+        system of the latest recorded one, and schedule saving of jumps
+        on the next flush.
+
+        :argument user_id:   user's id
+        :argument timestamp: jump time
+        :argument system:    name of the system character has jumped into
+        """
+        jumps = self.jumps(user_id)
+        if jumps is not None and jumps.last() != system:
+            jumps.append(timestamp, system)
+            self.dirty_jumps.add(user_id)
+
+    def touch(self, user_id):
+        """
+        Get the user, marking the user as the most recently active one.
+
+        :argument user_id: user's id
+        :return: user object, None if there is no such user
+        """
+        user = self.get(user_id)
+        if user is not None:
+            self.activity.move_to_end(user_id)
+        return user
+
+    def busy(self, user_id):
+        """
+        :argument user_id: user's or fleet map's id
+        :return: True if the map is viewed or the character is tracked
+        """
+        app = self.application
+        return user_id in app.rooms.viewers or user_id in app.poller.subscribers
+
+    def shrink(self):
+        """
+        Evict the least recently active users over the `max_size`.
+        """
+        if self.max_size is None:
+            return
+        skipped = 0
+        while (len(self.activity) > self.max_size
+               and skipped < len(self.activity)):
+            user_id = next(iter(self.activity))
+            if (user_id in self.dirty or user_id in self.dirty_maps
+                    or user_id in self.dirty_jumps or self.busy(user_id)):
+                # Keep it, but look at the next one
+                self.activity.move_to_end(user_id)
+                skipped += 1
+                continue
+            del self.activity[user_id]
+            self.pop(user_id, None)
+            self.evicted += 1
+
+    def save(self, user_id):
+        """
+        Schedule user saving on the next flush.
+
+        :argument user_id: user's id
+        """
+        self.dirty.add(user_id)
+
+    def save_map(self, key):
+        """
+        Schedule map saving on the next flush.
+
+        :argument key: map key
+        """
+        self.dirty_maps.add(key)
+
+    def dump(self, user):
+        """
+        :argument user: user object
+        :return: JSON-serializable dict with user data, except the router
+        and jumps
+        """
+        return {
+            key: value for key, value in user.items()
+            if key not in ('router', 'jumps')
+        }
+
+    def flush(self):
+        """
+        Write all changed users, maps and jumps to the storage at once,
+        then evict inactive ones from memory.
+        """
+        if self.dirty or self.dirty_maps or self.dirty_jumps:
+            self.store()
+        self.shrink()
+
+    def store(self):
+        user_ids, self.dirty = self.dirty, set()
+        keys, self.dirty_maps = self.dirty_maps, set()
+        jumpers, self.dirty_jumps = self.dirty_jumps, set()
+        users = [
+            (user_id, self.dump(self.cached(user_id)))
+            for user_id in user_ids if self.cached(user_id) is not None
+        ]
+        maps = [
+            (key, self.cached(key)['router'].dump())
+            for key in keys if self.cached(key) is not None
+        ]
+        jumps = [
+            (user_id, self.cached(user_id)['jumps'].dump())
+            for user_id in jumpers if self.cached(user_id) is not None
+        ]
+        try:
+            self.storage.store(users, maps, jumps)
+        except Exception as e:
+            logging.error(f"Failed to store users: {e}")
+            # Try again on the next flush
+            self.dirty.update(user_ids)
+            self.dirty_maps.update(keys)
+            self.dirty_jumps.update(jumpers)
+        else:
+            logging.debug(
+                f"{len(users)} users, {len(maps)} maps "
+                f"and {len(jumps)} jump histories stored"
+            )
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of wormhole-tracker package released under
+# the GNU GPLv3 license. See the LICENSE file for more information.
+
+import logging
+from os import getpid
+from time import time
+
+from tornado.ioloop import PeriodicCallback
+
+
+class Sweeper(object):
+    """
+    Application-wide timing wheel of expiring links.
+
+    Every expiring link of every router is put into the wheel slot of its
+    expiry time, and the wheel turns by one slot every `resolution`
+    seconds, so scheduling is O(1) and every tick only looks at the links
+    of the current slot, no matter how many routers and links there are.
+    Links expiring more than a whole turn later stay in the slot until
+    the turn they are due. Routers of expired links commit the removal
+    and it is pushed to the map viewers like any other update.
+
+    Every process schedules links of the maps it has loaded, but only the
+    owner of the map removes them, see `wormhole_tracker.maps.Maps`.
+
+    Attributes:
+        wheel: list of slots, every slot is a list of
+            (expiry timestamp, map key, edge) tuples.
+
+        scheduled: set of the same tuples, so links of the router loaded
+            from the storage several times are only scheduled once.
+
+        tick_number: number of the last processed tick since the epoch.
+
+        timer: tornado.ioloop.PeriodicCallback with `tick` method as a
+            callback.
+    """
+    def __init__(self, app, resolution=60, slots=1440):
+        self.application = app
+        self.resolution = resolution
+        self.wheel = [[] for _ in range(slots)]
+        self.scheduled = set()
+        self.tick_number = int(time() // resolution)
+        self.timer = PeriodicCallback(self.tick, resolution * 1000)
+
+    def schedule(self, key, edge, expires):
+        """
+        :argument key:     key of the router's map
+        :argument edge:    (system id, system id) tuple
+        :argument expires: link expiry timestamp
+        """
+        entry = (expires, key, edge)
+        if entry in self.scheduled:
+            return
+        self.scheduled.add(entry)
+        # Links which have expired already go to the next tick
+        tick = max(self.due(expires), self.tick_number + 1)
+        self.wheel[tick % len(self.wheel)].append(entry)
+
+    def due(self, expires):
+        """
+        :argument expires: link expiry timestamp
+        :return: number of the first tick at which the link has expired
+        """
+        return int(-(-expires // self.resolution))
+
+    def tick(self):
+        """
+        Process all slots passed since the last tick.
+        """
+        current = int(time() // self.resolution)
+        steps = min(current - self.tick_number, len(self.wheel))
+        self.tick_number = current
+        due = {}
+        for step in range(steps):
+            index = (current - step) % len(self.wheel)
+            entries, self.wheel[index] = self.wheel[index], []
+            for entry in entries:
+                if self.due(entry[0]) > current:
+                    # Not this turn yet
+                    self.wheel[index].append(entry)
+                else:
+                    due.setdefault(entry[1], []).append(entry)
+        for key, entries in due.items():
+            self.application.spawn(self.expire, key, entries)
+
+    async def expire(self, key, entries):
+        """
+        Remove expired links of the map and notify its viewers.
+
+        :argument key:     key of the router's map
+        :argument entries: list of wheel entries of the map
+        """
+        try:
+            maps = self.application.maps
+            if maps.owner(key) == getpid():
+                await maps.change(
+                    key, 'expire', [entry[2] for entry in entries]
+                )
+        except Exception as e:
+            logging.error(f"Failed to expire links of {key}: {e}")
+        finally:
+            self.scheduled.difference_update(entries)
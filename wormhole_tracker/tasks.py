@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of wormhole-tracker package released under
+# the GNU GPLv3 license. See the LICENSE file for more information.
+
+from collections import deque
+
+from tornado.locks import Event
+
+
+class Tasks(object):
+    """
+    Per-connection task queue with priority lanes.
+
+    Tasks are taken from the first non-empty lane, so tasks of the lower
+    lanes can not delay the ones of the higher lanes. Every lane holds at
+    most `limit` tasks, and tasks coming to the full lane are dropped.
+
+    Task put with the `key` which is still waiting in the queue does not
+    take another place in it, it replaces the waiting one, or is merged
+    into it by the `merge` function. So the front-end sending the same
+    request over and over again only gets the latest one done.
+
+    Supports `async for`, which ends when the queue is closed.
+
+    Attributes:
+        lanes: list of deques of [task, key] entries, highest priority
+            lane first.
+
+        waiting: dict of entries waiting in the lanes, by their keys.
+
+        ready: tornado.locks.Event set while there are tasks to do.
+
+        dropped: amount of tasks dropped because the lane was full.
+
+        coalesced: amount of tasks replaced or merged into waiting ones.
+    """
+    def __init__(self, lanes=3, limit=8):
+        self.lanes = [deque() for _ in range(lanes)]
+        self.limit = limit
+        self.waiting = {}
+        self.ready = Event()
+        self.closed = False
+        self.dropped = 0
+        self.coalesced = 0
+
+    def put(self, task, lane=0, key=None, merge=None):
+        """
+        :argument task:  task to do
+        :argument lane:  index of the lane, 0 is the highest priority
+        :argument key:   key of the task for coalescing, None to never
+                         coalesce it
+        :argument merge: function merging the waiting task and the new
+                         one into a single task, by default the new task
+                         just replaces the waiting one
+        :return: False if the task was dropped, True otherwise
+        """
+        entry = self.waiting.get(key) if key is not None else None
+        if entry is not None:
+            entry[0] = merge(entry[0], task) if merge else task
+            self.coalesced += 1
+            return True
+        if self.closed or len(self.lanes[lane]) >= self.limit:
+            self.dropped += 1
+            return False
+        entry = [task, key]
+        self.lanes[lane].append(entry)
+        if key is not None:
+            self.waiting[key] = entry
+        self.ready.set()
+        return True
+
+    async def get(self):
+        """
+        :return: the next task to do, None if the queue is closed
+        """
+        while not self.closed:
+            for lane in self.lanes:
+                if lane:
+                    task, key = lane.popleft()
+                    if key is not None:
+                        del self.waiting[key]
+                    return task
+            self.ready.clear()
+            await self.ready.wait()
+
+    def close(self):
+        """
+        Drop all waiting tasks and stop the `async for` loop.
+        """
+        self.closed = True
+        for lane in self.lanes:
+            lane.clear()
+        self.waiting.clear()
+        self.ready.set()
+
+    def qsize(self):
+        return sum(len(lane) for lane in self.lanes)
+
+    def __len__(self):
+        return self.qsize()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        task = await self.get()
+        if task is None:
+            raise StopAsyncIteration
+        return task
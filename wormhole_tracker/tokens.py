@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of wormhole-tracker package released under
+# the GNU GPLv3 license. See the LICENSE file for more information.
+
+import logging
+from time import time
+
+from tornado.concurrent import Future
+from tornado.ioloop import IOLoop
+
+
+class TokenManager(object):
+    """
+    Keeps access tokens of tracked characters fresh.
+
+    Every token is renewed in the background `margin` seconds before it
+    expires, so polling never waits for the refresh round-trip. Concurrent
+    refresh attempts for the same character share a single in-flight
+    future instead of hitting the SSO several times.
+
+    When application runs in several processes, the token is only renewed
+    by the process holding the character's poll lease, since refresh token
+    may only be used once. Renewed token is sent to other processes,
+    which reload the user, see `App.notify`.
+
+    Attributes:
+        margin: how many seconds before the expiry token is renewed.
+
+        refreshing: dict with user ids as keys and futures of in-flight
+            refreshes as values.
+
+        timeouts: dict with user ids as keys and IOLoop timeout handles of
+            the scheduled renewals as values.
+    """
+    def __init__(self, app, margin=60):
+        self.application = app
+        self.margin = margin
+        self.refreshing = {}
+        self.timeouts = {}
+
+    def expired(self, user_id):
+        """
+        :argument user_id: user id
+        :return: True if access token is expired
+        """
+        user = self.application.users[user_id]
+        return user.get('expires_at', 0) <= time()
+
+    async def refresh(self, user_id):
+        """
+        Refresh access token, or join the refresh already in progress.
+
+        :argument user_id: user id
+        :return: user id in case of success, None otherwise
+        """
+        future = self.refreshing.get(user_id)
+        if future is None:
+            future = self.refreshing[user_id] = Future()
+            try:
+                user = self.application.users[user_id]
+                result = await self.application.authorize(
+                    user['refresh_token'], refresh=True
+                )
+                if result:
+                    self.application.notify(evict=user_id)
+            except Exception as e:
+                logging.error(f"Failed to refresh token of {user_id}: {e}")
+                result = None
+            finally:
+                del self.refreshing[user_id]
+            future.set_result(result)
+        return await future
+
+    def schedule(self, user_id, expires_at):
+        """
+        Schedule background renewal of the access token.
+
+        :argument user_id:    user id
+        :argument expires_at: token expiry timestamp
+        """
+        self.cancel(user_id)
+        delay = max(0, expires_at - self.margin - time())
+        self.timeouts[user_id] = IOLoop.current().call_later(
+            delay, self._renew, user_id
+        )
+
+    def cancel(self, user_id):
+        timeout = self.timeouts.pop(user_id, None)
+        if timeout is not None:
+            IOLoop.current().remove_timeout(timeout)
+
+    def watch(self, user_id):
+        """
+        Make sure the token of the character which has just been
+        tracked will be renewed in time, even if it was issued by
+        the other process or before restart.
+
+        :argument user_id: user id
+        """
+        if user_id not in self.timeouts:
+            user = self.application.users.get(user_id)
+            if user:
+                self.schedule(user_id, user.get('expires_at', 0))
+
+    def _renew(self, user_id):
+        del self.timeouts[user_id]
+        # Do not keep renewing tokens of characters nobody tracks,
+        # they will be refreshed on demand when tracked again
+        if user_id not in self.application.poller.subscribers:
+            return
+        if not self.application.poller.lease(user_id):
+            # The other process renews it, check again once it has
+            user = self.application.users.get(user_id)
+            if user:
+                self.schedule(user_id, max(
+                    user.get('expires_at', 0), time() + 2 * self.margin
+                ))
+            return
+        logging.debug(f"Renewing access token of {user_id}")
+        self.application.spawn(self.refresh, user_id)